@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import sys
+import time
 
 from aiogram import Dispatcher
 
@@ -11,11 +12,15 @@ from handlers.shared import change_password, activate_stored
 from handlers.user import placeholder, feedback, get_cards, other_features, start, buy_service, my_services, account, \
     tutorial, contact_support, payment, renew_service, extra_volume, conversion_offer, \
     FAQ, tariffs, transfer_ownership
-from config import APP_ENV, ENABLE_SCHEDULER
+from config import APP_ENV, BOT_RUN_MODE, ENABLE_SCHEDULER
 from services.bot_menu import setup_bot_menu
 from services.bot_instance import bot
-from services.db import create_tables
-from services.scheduler import scheduler  # همون فایلی که تسک رو نوشتی
+from services.db import create_tables, format_schema_report
+from services.executors import shutdown_executors
+from services.ibs_outbox import run_ibs_outbox_worker
+from services.metrics import setup_handler_metrics, start_metrics_server
+from services.scheduler import scheduler, shutdown_scheduler  # همون فایلی که تسک رو نوشتی
+from services.webhook import run_webhook
 
 logging.basicConfig(
     level=logging.INFO,
@@ -25,6 +30,7 @@ logging.basicConfig(
 
 
 async def main():
+    started = time.perf_counter()
     # تعریف بات با مشخصات پیش‌فرض
 
     dp = Dispatcher()
@@ -65,18 +71,40 @@ async def main():
         FAQ.router,
         placeholder.router,
     )
+    setup_handler_metrics(dp)
 
     # ایجاد جداول دیتابیس
-    create_tables()
+    schema_report = create_tables()
+    logging.info("Database ready: %s", format_schema_report(schema_report))
     await setup_bot_menu(bot)
 
     # اجرای تسک زمان‌بندی‌شده
-    logging.info("Starting bot with APP_ENV=%s, scheduler=%s", APP_ENV, "enabled" if ENABLE_SCHEDULER else "disabled")
-    asyncio.create_task(scheduler())
+    logging.info(
+        "Starting bot with APP_ENV=%s, mode=%s, scheduler=%s",
+        APP_ENV,
+        BOT_RUN_MODE,
+        "enabled" if ENABLE_SCHEDULER else "disabled",
+    )
+    metrics_runner = await start_metrics_server()
+    scheduler_task = asyncio.create_task(scheduler())
+    outbox_task = asyncio.create_task(run_ibs_outbox_worker())
+    logging.info("Startup took %dms", int((time.perf_counter() - started) * 1000))
     # asyncio.create_task(notifier())
 
     # اجرای ربات
-    await dp.start_polling(bot)
+    try:
+        if BOT_RUN_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await shutdown_scheduler()
+        scheduler_task.cancel()
+        outbox_task.cancel()
+        shutdown_executors()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
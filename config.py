@@ -1,6 +1,7 @@
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+import socket
 
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(BASE_DIR / ".env")
@@ -48,8 +49,60 @@ SCHEDULER_LIMIT_SPEED = env_bool("SCHEDULER_LIMIT_SPEED", default=IS_PRODUCTION)
 SCHEDULER_ACTIVATE_WAITING_FOR_PAYMENT = env_bool("SCHEDULER_ACTIVATE_WAITING_FOR_PAYMENT", default=IS_PRODUCTION)
 SCHEDULER_CANCEL_NOT_PAID = env_bool("SCHEDULER_CANCEL_NOT_PAID", default=IS_PRODUCTION)
 SCHEDULER_AUTO_RENEW = env_bool("SCHEDULER_AUTO_RENEW", default=IS_PRODUCTION)
+# Production still runs database/backup.sh from cron; enable this to let the bot take them instead.
+SCHEDULER_BACKUP = env_bool("SCHEDULER_BACKUP", default=False)
+SCHEDULER_DB_MAINTENANCE = env_bool("SCHEDULER_DB_MAINTENANCE", default=IS_PRODUCTION)
+SCHEDULER_REPORT_SNAPSHOT = env_bool("SCHEDULER_REPORT_SNAPSHOT", default=IS_PRODUCTION)
+SCHEDULER_LEASES = env_bool("SCHEDULER_LEASES", default=True)
+SCHEDULER_LEASE_TTL_SECONDS = max(env_int("SCHEDULER_LEASE_TTL_SECONDS", 90), 15)
+SCHEDULER_INSTANCE_ID = (os.getenv("SCHEDULER_INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}").strip()
 ORDER_ARCHIVE_AFTER_DAYS = max(env_int("ORDER_ARCHIVE_AFTER_DAYS", 30), 1)
 
+BACKUP_DIR = os.getenv("BACKUP_DIR", str(BASE_DIR / "database" / "backups"))
+BACKUP_COMPRESS = env_bool("BACKUP_COMPRESS", default=True)
+BACKUP_PAGES_PER_STEP = max(env_int("BACKUP_PAGES_PER_STEP", 256), 1)
+BACKUP_STEP_SLEEP_MS = max(env_int("BACKUP_STEP_SLEEP_MS", 10), 0)
+BACKUP_FULL_EVERY_HOURS = max(env_int("BACKUP_FULL_EVERY_HOURS", 24), 1)
+BACKUP_KEEP_DELTA_HOURS = max(env_int("BACKUP_KEEP_DELTA_HOURS", 48), 1)
+BACKUP_KEEP_FULL_DAYS = max(env_int("BACKUP_KEEP_FULL_DAYS", 14), 1)
+# Nightly maintenance: full ANALYZE every few days, and a one-off VACUUM to switch the file to
+# incremental auto-vacuum once this share of its pages sits on the free list.
+DB_ANALYZE_EVERY_DAYS = max(env_int("DB_ANALYZE_EVERY_DAYS", 7), 1)
+DB_VACUUM_FREE_PERCENT = min(max(env_int("DB_VACUUM_FREE_PERCENT", 10), 1), 100)
+DB_VACUUM_AFTER_ARCHIVED_ORDERS = max(env_int("DB_VACUUM_AFTER_ARCHIVED_ORDERS", 500), 1)
+# Admin reports read a copy of the database refreshed every few minutes, never the live file.
+REPORT_SNAPSHOT = env_bool("REPORT_SNAPSHOT", default=True)
+REPORT_SNAPSHOT_PATH = os.getenv("REPORT_SNAPSHOT_PATH") or f"{os.path.splitext(DB_PATH)[0]}.reports.db"
+REPORT_SNAPSHOT_MAX_AGE_SECONDS = max(env_int("REPORT_SNAPSHOT_MAX_AGE_SECONDS", 15 * 60), 60)
+
+EXECUTOR_IBS_WORKERS = max(env_int("EXECUTOR_IBS_WORKERS", 6), 1)
+EXECUTOR_DB_WORKERS = max(env_int("EXECUTOR_DB_WORKERS", 2), 1)
+EXECUTOR_NOTIFY_WORKERS = max(env_int("EXECUTOR_NOTIFY_WORKERS", 3), 1)
+EXECUTOR_HANDLER_WORKERS = max(env_int("EXECUTOR_HANDLER_WORKERS", 8), 1)
+IBS_OUTBOX_WORKERS = max(env_int("IBS_OUTBOX_WORKERS", 4), 1)
+IBS_OUTBOX_POLL_SECONDS = max(env_int("IBS_OUTBOX_POLL_SECONDS", 5), 1)
+IBS_OUTBOX_MAX_ATTEMPTS = max(env_int("IBS_OUTBOX_MAX_ATTEMPTS", 8), 1)
+IBS_OUTBOX_RETRY_BASE_SECONDS = max(env_int("IBS_OUTBOX_RETRY_BASE_SECONDS", 15), 1)
+IBS_OUTBOX_RETRY_MAX_SECONDS = max(env_int("IBS_OUTBOX_RETRY_MAX_SECONDS", 900), IBS_OUTBOX_RETRY_BASE_SECONDS)
+
+BOT_RUN_MODE = (os.getenv("BOT_RUN_MODE") or "polling").strip().lower()
+if BOT_RUN_MODE not in {"polling", "webhook"}:
+    BOT_RUN_MODE = "polling"
+
+WEBHOOK_BASE_URL = (os.getenv("WEBHOOK_BASE_URL") or "").strip().rstrip("/")
+WEBHOOK_PATH = "/" + (os.getenv("WEBHOOK_PATH") or "telegram/webhook").strip().strip("/")
+WEBHOOK_SECRET = (os.getenv("WEBHOOK_SECRET") or "").strip()
+WEBHOOK_LISTEN_HOST = (os.getenv("WEBHOOK_LISTEN_HOST") or "127.0.0.1").strip()
+WEBHOOK_LISTEN_PORT = env_int("WEBHOOK_LISTEN_PORT", 8080)
+WEBHOOK_MAX_CONNECTIONS = min(max(env_int("WEBHOOK_MAX_CONNECTIONS", 40), 1), 100)
+WEBHOOK_MAX_CONCURRENT_UPDATES = max(env_int("WEBHOOK_MAX_CONCURRENT_UPDATES", 32), 1)
+WEBHOOK_MAX_PENDING_UPDATES = max(env_int("WEBHOOK_MAX_PENDING_UPDATES", 500), WEBHOOK_MAX_CONCURRENT_UPDATES)
+WEBHOOK_DRAIN_TIMEOUT_SECONDS = max(env_int("WEBHOOK_DRAIN_TIMEOUT_SECONDS", 30), 0)
+
+METRICS_ENABLED = env_bool("METRICS_ENABLED", default=False)
+METRICS_LISTEN_HOST = (os.getenv("METRICS_LISTEN_HOST") or "127.0.0.1").strip()
+METRICS_LISTEN_PORT = env_int("METRICS_LISTEN_PORT", 9108)
+
 IBS_USERNAME = os.getenv("IBS_USERNAME", "")
 IBS_PASSWORD = os.getenv("IBS_PASSWORD", "")
 IBS_URL_BASE = os.getenv("IBS_URL_BASE", "")
@@ -57,6 +110,21 @@ IBS_URL_INFO = os.getenv("IBS_URL_INFO", "")
 IBS_URL_EDIT = os.getenv("IBS_URL_EDIT", "")
 IBS_URL_CONNECTIONS = os.getenv("IBS_URL_CONNECTIONS", "")
 IBS_URL_DELETE = os.getenv("IBS_URL_DELETE", "")
+IBS_HTTP_TIMEOUT_SECONDS = max(env_int("IBS_HTTP_TIMEOUT_SECONDS", 30), 1)
+IBS_BREAKER_ENABLED = env_bool("IBS_BREAKER_ENABLED", default=True)
+IBS_BREAKER_WINDOW_SECONDS = max(env_int("IBS_BREAKER_WINDOW_SECONDS", 60), 5)
+IBS_BREAKER_MIN_REQUESTS = max(env_int("IBS_BREAKER_MIN_REQUESTS", 8), 1)
+IBS_BREAKER_ERROR_PERCENT = min(max(env_int("IBS_BREAKER_ERROR_PERCENT", 50), 1), 100)
+IBS_BREAKER_SLOW_SECONDS = max(env_int("IBS_BREAKER_SLOW_SECONDS", 10), 1)
+IBS_BREAKER_OPEN_SECONDS = max(env_int("IBS_BREAKER_OPEN_SECONDS", 30), 1)
+IBS_BREAKER_MAX_OPEN_SECONDS = max(env_int("IBS_BREAKER_MAX_OPEN_SECONDS", 600), IBS_BREAKER_OPEN_SECONDS)
+IBS_MAX_CONCURRENCY = max(env_int("IBS_MAX_CONCURRENCY", 6), 1)
+IBS_USER_RESERVED_SLOTS = min(max(env_int("IBS_USER_RESERVED_SLOTS", 2), 0), IBS_MAX_CONCURRENCY - 1)
+IBS_SLOT_WAIT_SECONDS = max(env_int("IBS_SLOT_WAIT_SECONDS", 30), 1)
+IBS_READ_CACHE_SECONDS = max(env_int("IBS_READ_CACHE_SECONDS", 5), 0)
+# Orders whose account has not logged in yet are re-checked with exponential backoff.
+ORDER_TIME_CHECK_BASE_MINUTES = max(env_int("ORDER_TIME_CHECK_BASE_MINUTES", 15), 1)
+ORDER_TIME_CHECK_MAX_MINUTES = max(env_int("ORDER_TIME_CHECK_MAX_MINUTES", 24 * 60), ORDER_TIME_CHECK_BASE_MINUTES)
 
 # Cloudflare config
 CF_ZONE_ID = os.getenv("CF_ZONE_ID")
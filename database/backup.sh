@@ -1 +1 @@
-cp /root/bot_v2/database/vpn_bot.db /home/ftp/backup/Site000-Bot_v2/"DataBaseVPN-$(date +"%F-%H").db"
+cd /root/bot_v2 && BACKUP_DIR=/home/ftp/backup/Site000-Bot_v2 python3 -m tools.db_backup backup
@@ -8,6 +8,7 @@ from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMar
 from config import ADMINS
 from keyboards.main_menu import admin_main_menu_keyboard
 from services.db import get_order_with_plan, get_plans_for_admin, search_orders_for_admin, update_order_conversion_markers
+from services.executors import run_blocking
 from services.order_workflow import FINAL_ORDER_STATUSES, adjust_manual_extra_volume, cancel_order, change_order_plan
 
 router = Router()
@@ -391,7 +392,7 @@ async def order_management_cancel_confirm(callback: CallbackQuery, state: FSMCon
         return await callback.answer("دسترسی نداری.", show_alert=True)
 
     order_id = int(callback.data.split("|")[2])
-    result = cancel_order(order_id=order_id, admin_id=callback.from_user.id)
+    result = await run_blocking(cancel_order, order_id=order_id, admin_id=callback.from_user.id)
     if not result:
         return await callback.answer("لغو سفارش انجام نشد.", show_alert=True)
 
@@ -465,7 +466,7 @@ async def order_management_plan_apply(callback: CallbackQuery, state: FSMContext
         return await callback.answer("دسترسی نداری.", show_alert=True)
 
     _, _, order_id, plan_id = callback.data.split("|", 3)
-    result = change_order_plan(int(order_id), int(plan_id), admin_id=callback.from_user.id)
+    result = await run_blocking(change_order_plan, int(order_id), int(plan_id), admin_id=callback.from_user.id)
     if not result:
         return await callback.answer("تغییر پلن انجام نشد.", show_alert=True)
 
@@ -543,7 +544,8 @@ async def order_management_receive_volume(message: Message, state: FSMContext, b
         await message.answer("فقط عدد صحیح بفرست. مثال: 1 یا -1")
         return
 
-    result = adjust_manual_extra_volume(
+    result = await run_blocking(
+        adjust_manual_extra_volume,
         order_id=int(order_id),
         volume_gb=volume_gb,
         admin_id=message.from_user.id,
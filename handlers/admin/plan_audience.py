@@ -1,5 +1,6 @@
+import io
 import re
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
@@ -8,6 +9,7 @@ from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMar
 
 from config import ADMINS
 from keyboards.main_menu import admin_main_menu_keyboard
+from services.executors import run_blocking
 from services.db import (
     add_users_to_segment,
     attach_segments_to_plan,
@@ -31,6 +33,13 @@ from services.db import (
 
 router = Router()
 
+# Member lists can arrive as files with tens of thousands of lines; they are resolved and
+# written one chunk at a time.
+IDENTIFIER_CHUNK_SIZE = 5000
+MISSING_IDENTIFIERS_SHOWN = 30
+IDENTIFIER_FILE_EXTENSIONS = (".txt", ".csv")
+MAX_IDENTIFIER_FILE_BYTES = 5 * 1024 * 1024
+
 ACCESS_LEVEL_LABELS = {
     "all": "همه کاربران",
     "user": "فقط کاربران عادی",
@@ -63,6 +72,63 @@ def split_tokens(value: str) -> List[str]:
     return [token.strip() for token in re.split(r"[\s,\n،,]+", value or "") if token.strip()]
 
 
+def identifier_file_error(message: Message) -> Optional[str]:
+    """Why an uploaded member list is refused, or None when it can be read."""
+    document = message.document
+    if not document:
+        return None
+    file_name = (document.file_name or "").lower()
+    mime_type = (document.mime_type or "").lower()
+    if not file_name.endswith(IDENTIFIER_FILE_EXTENSIONS) and not mime_type.startswith("text/"):
+        return "❌ فقط فایل متنی txt یا csv پذیرفته می‌شود."
+    if int(document.file_size or 0) > MAX_IDENTIFIER_FILE_BYTES:
+        return f"❌ حجم فایل باید حداکثر {MAX_IDENTIFIER_FILE_BYTES // (1024 * 1024)} مگابایت باشد."
+    return None
+
+
+async def read_identifier_lines(message: Message) -> Iterable[str]:
+    """Lines of the pasted text, or of an uploaded .txt/.csv file read as it is decoded.
+
+    Check ``identifier_file_error`` first; this does not validate the upload.
+    """
+    if message.document:
+        buffer = await message.bot.download(message.document)
+        return io.TextIOWrapper(buffer, encoding="utf-8-sig", errors="replace")
+    return (message.text or "").splitlines()
+
+
+def iter_token_chunks(lines: Iterable[str], chunk_size: int = IDENTIFIER_CHUNK_SIZE) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for line in lines:
+        chunk.extend(split_tokens(line))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def add_identifier_chunk(segment_id: int, tokens: List[str]) -> Tuple[int, int, List[str]]:
+    """Resolve one chunk of identifiers and add them; returns (found, added, missing)."""
+    users, missing = resolve_user_identifiers(tokens)
+    added = add_users_to_segment(segment_id, (user["id"] for user in users))
+    return len(users), added, missing
+
+
+def remove_identifier_chunk(segment_id: int, tokens: List[str]) -> Tuple[int, int, List[str]]:
+    """Resolve one chunk of identifiers and remove them; returns (found, removed, missing)."""
+    users, missing = resolve_user_identifiers(tokens)
+    removed = remove_users_from_segment(segment_id, [user["id"] for user in users]) if users else 0
+    return len(users), removed, missing
+
+
+def format_missing_identifiers(missing: List[str]) -> str:
+    shown = ", ".join(missing[:MISSING_IDENTIFIERS_SHOWN])
+    if len(missing) > MISSING_IDENTIFIERS_SHOWN:
+        shown += f" و {len(missing) - MISSING_IDENTIFIERS_SHOWN} مورد دیگر"
+    return "پیدا نشد: " + shown
+
+
 def format_price(value: Optional[int]) -> str:
     try:
         return f"{int(value or 0):,}"
@@ -605,7 +671,8 @@ async def audience_segment_add_users_prompt(callback: CallbackQuery, state: FSMC
     await state.set_state(PlanAudienceStates.waiting_for_segment_add_users)
     await callback.message.answer(
         "آیدی یا یوزرنیم کاربران را بفرست.\n"
-        "می‌توانی چند مورد را با فاصله، ویرگول یا خط جدید بفرستی.\n\n"
+        "می‌توانی چند مورد را با فاصله، ویرگول یا خط جدید بفرستی.\n"
+        "برای لیست‌های بزرگ فایل txt یا csv بفرست.\n\n"
         "مثال:\n123456789 @omid another_user"
     )
     await callback.answer()
@@ -621,7 +688,7 @@ async def audience_segment_remove_users_prompt(callback: CallbackQuery, state: F
     await state.set_state(PlanAudienceStates.waiting_for_segment_remove_users)
     await callback.message.answer(
         "آیدی یا یوزرنیم کاربرهایی را بفرست که باید از سگمنت حذف شوند.\n"
-        "می‌توانی چند مورد را با فاصله، ویرگول یا خط جدید بفرستی."
+        "می‌توانی چند مورد را با فاصله، ویرگول یا خط جدید بفرستی یا فایل txt/csv بفرستی."
     )
     await callback.answer()
 
@@ -638,14 +705,23 @@ async def audience_segment_add_users_receive(message: Message, state: FSMContext
         await state.clear()
         return await message.answer("❌ وضعیت عملیات پیدا نشد.")
 
-    users, missing = resolve_user_identifiers(split_tokens(message.text))
-    if not users:
+    file_error = identifier_file_error(message)
+    if file_error:
+        return await message.answer(file_error)
+
+    found = added = 0
+    missing: List[str] = []
+    for tokens in iter_token_chunks(await read_identifier_lines(message)):
+        chunk_found, chunk_added, chunk_missing = await run_blocking(add_identifier_chunk, int(segment_id), tokens)
+        missing.extend(chunk_missing)
+        found += chunk_found
+        added += chunk_added
+    if not found:
         return await message.answer("❌ هیچ کاربر معتبری پیدا نشد.")
 
-    added = add_users_to_segment(int(segment_id), [user["id"] for user in users])
     summary = [f"✅ {added} عضویت برای سگمنت #{segment_id} ثبت شد."]
     if missing:
-        summary.append("پیدا نشد: " + ", ".join(missing))
+        summary.append(format_missing_identifiers(missing))
     await state.clear()
     await message.answer("\n".join(summary))
     await show_segment_detail(message, int(segment_id), state)
@@ -663,14 +739,23 @@ async def audience_segment_remove_users_receive(message: Message, state: FSMCont
         await state.clear()
         return await message.answer("❌ وضعیت عملیات پیدا نشد.")
 
-    users, missing = resolve_user_identifiers(split_tokens(message.text))
-    if not users:
+    file_error = identifier_file_error(message)
+    if file_error:
+        return await message.answer(file_error)
+
+    found = removed = 0
+    missing: List[str] = []
+    for tokens in iter_token_chunks(await read_identifier_lines(message)):
+        chunk_found, chunk_removed, chunk_missing = await run_blocking(remove_identifier_chunk, int(segment_id), tokens)
+        missing.extend(chunk_missing)
+        found += chunk_found
+        removed += chunk_removed
+    if not found:
         return await message.answer("❌ هیچ کاربر معتبری پیدا نشد.")
 
-    removed = remove_users_from_segment(int(segment_id), [user["id"] for user in users])
     summary = [f"✅ {removed} عضویت از سگمنت #{segment_id} حذف شد."]
     if missing:
-        summary.append("پیدا نشد: " + ", ".join(missing))
+        summary.append(format_missing_identifiers(missing))
     await state.clear()
     await message.answer("\n".join(summary))
     await show_segment_detail(message, int(segment_id), state)
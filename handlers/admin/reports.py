@@ -1,9 +1,11 @@
 import sqlite3
+import time
 from html import escape
 from typing import Iterable, Optional, Tuple, Union
 
 import jdatetime
 from aiogram import F, Router
+from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
@@ -11,19 +13,38 @@ from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMar
 from config import (
     ADMINS,
     APP_ENV,
-    DB_PATH,
     ENABLE_SCHEDULER,
+    REPORT_SNAPSHOT,
     SCHEDULER_ACTIVATE_RESERVED,
     SCHEDULER_ACTIVATE_WAITING_FOR_PAYMENT,
     SCHEDULER_AUTO_RENEW,
+    SCHEDULER_BACKUP,
+    SCHEDULER_DB_MAINTENANCE,
     SCHEDULER_CANCEL_NOT_PAID,
     SCHEDULER_EXPIRE_ORDERS,
+    SCHEDULER_INSTANCE_ID,
     SCHEDULER_LIMIT_SPEED,
     SCHEDULER_MEMBERSHIP,
     SCHEDULER_NOTIFIER,
+    SCHEDULER_REPORT_SNAPSHOT,
     SCHEDULER_UPDATE_ORDER_TIMES,
     SCHEDULER_USAGE_LOGGER,
 )
+from services.backup import LAST_BACKUP_RESULT, BackupBusy, format_backup_result, run_backup
+from services.db_maintenance import format_maintenance_row, get_db_maintenance_runs
+from services.db import LAST_SCHEMA_REPORT, format_schema_report, get_job_leases, get_scheduler_runs
+from services.executors import DB, executor_snapshots, format_executor_line, run_blocking, run_in_executor
+from services.ibs_circuit import format_breaker_line, ibs_breaker
+from services.ibs_outbox import get_outbox_summary
+from services.ibs_singleflight import format_read_cache_line, ibs_reads
+from services import metrics
+from services.report_snapshot import (
+    LAST_SNAPSHOT_RESULT,
+    connect_live_readonly,
+    connect_reports,
+    format_snapshot_result,
+    snapshot_taken_at,
+)
 from services.payment_workflow import (
     STATUS_ACCOUNTING_APPROVED,
     STATUS_ACCOUNTING_REJECTED,
@@ -46,9 +67,15 @@ def is_admin(user_id: int) -> bool:
 
 
 def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Reports read the periodically refreshed snapshot, so they never hold up the writers.
+    return connect_reports()
+
+
+def _snapshot_note() -> str:
+    taken_at = snapshot_taken_at() if REPORT_SNAPSHOT else None
+    if not taken_at:
+        return ""
+    return f"\n\n🕒 داده‌ها مربوط به {taken_at.strftime('%H:%M:%S')} است."
 
 
 def _fmt_num(value) -> str:
@@ -151,7 +178,13 @@ def _table_exists(cur: sqlite3.Cursor, table_name: str) -> bool:
 
 def _orders_source_sql(cur: sqlite3.Cursor, alias: str = "o", include_archive: bool = True) -> str:
     if include_archive and _table_exists(cur, "orders_archive"):
-        return f"(SELECT * FROM orders UNION ALL SELECT * FROM orders_archive) {alias}"
+        # The two tables gained columns in different orders (and archived_at only exists in the
+        # archive), so SELECT * would misalign or fail; name the shared columns instead.
+        archive_columns = {row[1] for row in cur.execute("PRAGMA table_info(orders_archive)").fetchall()}
+        columns = ", ".join(
+            row[1] for row in cur.execute("PRAGMA table_info(orders)").fetchall() if row[1] in archive_columns
+        )
+        return f"(SELECT {columns} FROM orders UNION ALL SELECT {columns} FROM orders_archive) {alias}"
     return f"orders {alias}"
 
 
@@ -195,6 +228,42 @@ def reports_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+STATS_SECTIONS = (
+    (metrics.IBS_HTTP, "IBS (HTTP)"),
+    (metrics.IBS_OPERATION, "IBS (عملیات)"),
+    (metrics.SQLITE_CALL, "SQLite"),
+    (metrics.HANDLER, "هندلرها"),
+    (metrics.SCHEDULER_JOB, "jobهای Scheduler"),
+)
+
+
+def build_stats_report(limit: int = 8) -> str:
+    if not metrics.is_enabled():
+        return "📈 متریک‌ها خاموش است. برای فعال‌سازی METRICS_ENABLED=1 را تنظیم کنید."
+
+    lines = ["📈 <b>آمار زمان‌بندی</b> (مرتب بر اساس کل زمان)"]
+    for name, title in STATS_SECTIONS:
+        rows = metrics.stats_rows(name, limit=limit)
+        lines.extend(["", f"<b>{title}</b>"])
+        if not rows:
+            lines.append("• داده‌ای ثبت نشده.")
+            continue
+        body = [
+            f"{row['labels'][:40]:<40} n={row['count']:<6} total={row['total_s']:.1f}s "
+            f"avg={row['avg_ms']:.0f}ms p95<={row['p95_ms']:.0f}ms max={row['max_ms']:.0f}ms"
+            for row in rows
+        ]
+        lines.append(f"<pre>{escape(chr(10).join(body))}</pre>")
+
+    notifications = metrics.counter_rows(metrics.NOTIFICATIONS)
+    lines.extend(["", "<b>اعلان‌ها</b>"])
+    if notifications:
+        lines.extend(f"• {escape(labels)}: {_fmt_num(int(value))}" for labels, value in notifications)
+    else:
+        lines.append("• داده‌ای ثبت نشده.")
+    return "\n".join(lines)
+
+
 def build_env_status_report() -> str:
     flags = [
         ("Scheduler", ENABLE_SCHEDULER),
@@ -208,6 +277,9 @@ def build_env_status_report() -> str:
         ("Activate waiting payment", SCHEDULER_ACTIVATE_WAITING_FOR_PAYMENT),
         ("Cancel not paid", SCHEDULER_CANCEL_NOT_PAID),
         ("Auto renew", SCHEDULER_AUTO_RENEW),
+        ("Backup", SCHEDULER_BACKUP),
+        ("DB maintenance", SCHEDULER_DB_MAINTENANCE),
+        ("Report snapshot", SCHEDULER_REPORT_SNAPSHOT and REPORT_SNAPSHOT),
     ]
     lines = [
         "🧪 وضعیت محیط اجرا",
@@ -218,6 +290,68 @@ def build_env_status_report() -> str:
     ]
     for label, enabled in flags:
         lines.append(f"• {label}: {'✅ فعال' if enabled else '🚫 غیرفعال'}")
+
+    lines.extend([
+        "",
+        "پایگاه داده:",
+        f"• {escape(format_schema_report(LAST_SCHEMA_REPORT))}",
+        f"• آخرین بکاپ: {escape(format_backup_result(LAST_BACKUP_RESULT))}",
+        f"• اسنپ‌شات گزارش‌ها: {escape(format_snapshot_result(LAST_SNAPSHOT_RESULT)) if REPORT_SNAPSHOT else 'خاموش (گزارش‌ها از فایل اصلی)'}",
+    ])
+    for run in get_db_maintenance_runs():
+        lines.append(f"• نگهداری: {escape(format_maintenance_row(run))}")
+
+    runs = get_scheduler_runs()
+    if runs:
+        lines.extend(["", "آخرین اجرای jobها:"])
+        for run in runs:
+            run_count = int(run["run_count"] or 0)
+            avg_ms = int(run["total_duration_ms"] or 0) // run_count if run_count else 0
+            lines.append(
+                f"• {escape(run['job_name'])}: {escape(str(run['last_status'] or '-'))} | "
+                f"{escape(str(run['last_finished_at'] or '-'))} | "
+                f"آخرین {_fmt_num(run['last_duration_ms'])}ms | میانگین {_fmt_num(avg_ms)}ms | "
+                f"خطا {_fmt_num(run['failure_count'])} | timeout {_fmt_num(run['timeout_count'])} | "
+                f"رد شده {_fmt_num(run['skipped_count'])}"
+            )
+
+    leases = get_job_leases()
+    if leases:
+        now = time.time()
+        lines.extend(["", f"قفل jobها (این نمونه: {escape(SCHEDULER_INSTANCE_ID)}):"])
+        for lease in leases:
+            expires_at = float(lease["expires_at"] or 0)
+            if lease["owner"] and expires_at > now:
+                state_text = f"{escape(str(lease['owner']))} تا {int(expires_at - now)}s دیگر"
+            else:
+                state_text = "آزاد"
+            lines.append(f"• {escape(lease['job_name'])}: {state_text} | token {_fmt_num(lease['fencing_token'])}")
+
+    lines.extend(["", "صف executorها:"])
+    for snapshot in executor_snapshots():
+        lines.append(f"• {escape(format_executor_line(snapshot))}")
+
+    breaker = ibs_breaker.snapshot()
+    lines.extend(["", "مدار قطع‌کن IBS:", f"• {escape(format_breaker_line(breaker))}"])
+    if breaker["last_error"]:
+        lines.append(f"• آخرین خطا: {escape(breaker['last_error'])}")
+    lines.append(f"• خواندن‌های مشترک/کش: {escape(format_read_cache_line(ibs_reads.snapshot()))}")
+
+    outbox = get_outbox_summary()
+    counts = outbox["counts"]
+    lines.extend([
+        "",
+        "صف تغییرات IBS:",
+        f"• در انتظار {_fmt_num(counts.get('pending', 0))} | در حال اجرا {_fmt_num(counts.get('running', 0))} | "
+        f"ناموفق {_fmt_num(counts.get('failed', 0))} | انجام‌شده {_fmt_num(counts.get('done', 0))}",
+    ])
+    if outbox["oldest_open"]:
+        lines.append(f"• قدیمی‌ترین مورد باز: {escape(str(outbox['oldest_open']))}")
+    for failed in outbox["recent_failed"]:
+        lines.append(
+            f"• ❌ #{failed['id']} {escape(str(failed['username']))}: "
+            f"{escape(str(failed['description'] or '-'))} | {escape(str(failed['last_error'] or '-'))}"
+        )
     lines.append("")
     lines.append("در محیط غیرپروداکشن، پیشنهاد امن این است که خود Scheduler یا jobهای حساس خاموش بمانند.")
     return "\n".join(lines)
@@ -930,7 +1064,9 @@ def build_user_balances_report(conn: sqlite3.Connection) -> str:
 
 
 def build_user_detail_report(user_id: int) -> Optional[str]:
-    with _connect() as conn:
+    # One user's rows are a few indexed lookups; read them live so a user who joined after the
+    # last snapshot is still found.
+    with connect_live_readonly() as conn:
         cur = conn.cursor()
 
         cur.execute(
@@ -1071,6 +1207,62 @@ def build_user_detail_report(user_id: int) -> Optional[str]:
 
     return "\n".join(lines)
 
+REPORT_BUILDERS = {
+    "management_snapshot": build_management_snapshot_report,
+    "volume_commitment": build_volume_commitment_report,
+    "dashboard_month": build_dashboard_month_report,
+    "orders_overview": build_orders_overview_report,
+    "wallet_overview": build_wallet_overview_report,
+    "top_plans": build_top_plans_report,
+    "users_overview": build_users_overview_report,
+    "expiring_overview": build_expiring_overview_report,
+    "feedback_overview": build_feedback_overview_report,
+    "user_balances": build_user_balances_report,
+}
+
+
+def _build_report(action: str) -> str:
+    """Runs on the handler pool: the aggregations must not block the event loop."""
+    if action == "env_status":
+        return build_env_status_report()
+    conn = _connect()
+    try:
+        return REPORT_BUILDERS[action](conn) + _snapshot_note()
+    finally:
+        conn.close()
+
+
+@router.message(Command("stats"))
+async def show_stats(message: Message):
+    if not is_admin(message.from_user.id):
+        return
+    await message.answer(build_stats_report(), parse_mode="HTML")
+
+
+@router.message(Command("backup"))
+async def take_backup(message: Message):
+    if not is_admin(message.from_user.id):
+        return
+    force_full = "full" in (message.text or "").split()[1:]
+    await message.answer("💾 بکاپ گرفتن از پایگاه داده شروع شد...")
+    try:
+        result = await run_in_executor(DB, run_backup, force_full=force_full)
+    except BackupBusy:
+        return await message.answer("⏳ یک بکاپ دیگر در حال اجراست.")
+    except Exception as exc:
+        return await message.answer(f"❌ بکاپ ناموفق بود: {escape(str(exc))}", parse_mode="HTML")
+    await message.answer(
+        "✅ بکاپ ثبت شد.\n"
+        f"نوع: <b>{result['kind']}</b>\n"
+        f"فایل: <code>{escape(result['path'])}</code>\n"
+        f"مدت: <b>{_fmt_num(result['duration_ms'])}ms</b> (کپی {_fmt_num(result['copy_ms'])}ms در {result['steps']} مرحله)\n"
+        f"صفحات تغییرکرده: {_fmt_num(result['changed_pages'])} از {_fmt_num(result['pages'])}\n"
+        f"حجم: {_fmt_num(result['backup_bytes'] // 1024)}KB از {_fmt_num(result['db_bytes'] // 1024)}KB\n"
+        f"فایل‌های قدیمی حذف‌شده: {len(result['removed'])}",
+        parse_mode="HTML",
+    )
+
+
 @router.message(F.text == "📑 گزارشات")
 async def show_reports_menu(message: Message):
     if not is_admin(message.from_user.id):
@@ -1088,49 +1280,18 @@ async def report_handler(callback: CallbackQuery, state: FSMContext):
         return await callback.answer("دسترسی نداری.", show_alert=True)
 
     action = callback.data.split(":", 1)[1]
-    if action == "env_status":
-        text = build_env_status_report()
-    elif action == "management_snapshot":
-        with _connect() as conn:
-            text = build_management_snapshot_report(conn)
-    elif action == "volume_commitment":
-        with _connect() as conn:
-            text = build_volume_commitment_report(conn)
-    elif action == "dashboard_month":
-        with _connect() as conn:
-            text = build_dashboard_month_report(conn)
-    elif action == "orders_overview":
-        with _connect() as conn:
-            text = build_orders_overview_report(conn)
-    elif action == "wallet_overview":
-        with _connect() as conn:
-            text = build_wallet_overview_report(conn)
-    elif action == "top_plans":
-        with _connect() as conn:
-            text = build_top_plans_report(conn)
-    elif action == "users_overview":
-        with _connect() as conn:
-            text = build_users_overview_report(conn)
-    elif action == "expiring_overview":
-        with _connect() as conn:
-            text = build_expiring_overview_report(conn)
-    elif action == "feedback_overview":
-        with _connect() as conn:
-            text = build_feedback_overview_report(conn)
-    elif action == "user_balances":
-        with _connect() as conn:
-            text = build_user_balances_report(conn)
-    elif action == "user_transactions":
+    if action == "user_transactions":
         await state.set_state(ReportUserTx.waiting_for_userid)
         await callback.message.answer("🔎 لطفاً آیدی عددی کاربر را ارسال کنید:")
         await callback.answer()
         return
-    else:
+    if action != "env_status" and action not in REPORT_BUILDERS:
         await callback.answer("گزارش نامعتبر است.", show_alert=True)
         return
 
-    await callback.message.answer(text, parse_mode="HTML")
     await callback.answer()
+    text = await run_blocking(_build_report, action)
+    await callback.message.answer(text, parse_mode="HTML")
 
 
 @router.message(ReportUserTx.waiting_for_userid)
@@ -1144,7 +1305,7 @@ async def process_user_transactions(message: Message, state: FSMContext):
         await message.answer("⚠️ لطفاً فقط آیدی عددی وارد کنید.")
         return
 
-    report = build_user_detail_report(int(user_id_text))
+    report = await run_blocking(build_user_detail_report, int(user_id_text))
     await state.clear()
 
     if not report:
@@ -8,6 +8,7 @@ from aiogram.fsm.state import StatesGroup, State
 from config import ADMINS
 from keyboards.main_menu import admin_main_menu_keyboard
 from services.IBSng import temporary_charge  # ← همون فانکشنی که گفتی
+from services.executors import run_blocking
 
 router = Router()
 
@@ -69,7 +70,7 @@ async def receive_username_and_charge(msg: Message, state: FSMContext, bot: Bot)
 
     try:
         # اجرای عملیات IBS
-        temporary_charge(username)
+        await run_blocking(temporary_charge, username)
     except Exception as e:
         await state.clear()
         return await msg.answer(
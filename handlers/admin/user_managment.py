@@ -12,6 +12,9 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKe
 
 from config import DB_PATH, ADMINS
 from keyboards.main_menu import admin_main_menu_keyboard
+from services.db import admin_search_match
+from services.usage_history import format_daily_usage, get_daily_usage
+from services.wallet import set_wallet_balance
 
 router = Router()
 
@@ -94,31 +97,90 @@ def _connect():
     return sqlite3.connect(DB_PATH)
 
 
-def get_users(offset: int = 0, limit: int = PAGE_SIZE) -> List[Tuple]:
+# --- keyset pagination ---
+# List pages seek from the boundary row instead of skipping rows with OFFSET, so page 40 costs
+# what page 1 does. The callback data carries the page number (display only) and a cursor
+# token: "" for the first page, "a<id>" for rows after that row, "b<id>" for rows before it
+# (the previous page) and "f<id>" for the page starting at that row (back from a detail view).
+def parse_page_cursor(token: str) -> Tuple[str, Optional[int]]:
+    token = (token or "").strip()
+    if not token or token[0] not in "abf":
+        return "", None
+    try:
+        return token[0], int(token[1:])
+    except ValueError:
+        return "", None
+
+
+def parse_page_callback(data: str, parts: int) -> Tuple[List[str], int, str]:
+    """Split "<prefix>:<args...>:<page>[:<cursor>]" into (args, page, cursor); older buttons had no cursor."""
+    fields = data.split(":")
+    args = fields[1:parts]
+    page = max(0, int(fields[parts])) if len(fields) > parts else 0
+    cursor = fields[parts + 1] if len(fields) > parts + 1 else ""
+    if page == 0:
+        cursor = ""
+    return args, page, cursor
+
+
+def keyset_nav_row(callback_base: str, page: int, first_key, last_key, has_prev: bool, has_next: bool) -> List[InlineKeyboardButton]:
+    nav = []
+    if has_prev and page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️ قبلی", callback_data=f"{callback_base}:{page - 1}:b{first_key}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="➡️ بعدی", callback_data=f"{callback_base}:{page + 1}:a{last_key}"))
+    return nav
+
+
+def _page_result(rows: List, limit: int, direction: str) -> Tuple[List, bool, bool]:
+    """Trim the look-ahead row and work out (rows, has_prev, has_next) for a fetched page."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == "b":
+        rows.reverse()
+        return rows, has_more, True
+    return rows, direction != "", has_more
+
+
+def _user_columns(conn: sqlite3.Connection) -> str:
+    last_name = "last_name" if column_exists(conn, "users", "last_name") else "'' as last_name"
+    return f"id, first_name, {last_name}, username, role, balance"
+
+
+def get_users(cursor: str = "", limit: int = PAGE_SIZE) -> Tuple[List[Tuple], bool, bool]:
     """
     بازمی‌گرداند لیست کاربران:
     id, first_name, [last_name?], username, role, balance
+    ترتیب: آیدی‌های مثبت صعودی و بعد بقیه؛ خروجی (rows, has_prev, has_next)
     """
+    direction, key = parse_page_cursor(cursor)
     conn = _connect()
-    has_last = column_exists(conn, "users", "last_name")
+    columns = _user_columns(conn)
     cur = conn.cursor()
-    if has_last:
-        cur.execute("""
-            SELECT id, first_name, last_name, username, role, balance
-            FROM users
-            ORDER BY CASE WHEN id > 0 THEN 0 ELSE 1 END, id ASC
-            LIMIT ? OFFSET ?
-        """, (limit, offset))
+    want = limit + 1
+
+    def fetch(condition: str, params: tuple, order: str, count: int) -> List[Tuple]:
+        if count <= 0:
+            return []
+        cur.execute(f"SELECT {columns} FROM users WHERE {condition} ORDER BY id {order} LIMIT ?", (*params, count))
+        return cur.fetchall()
+
+    # Two primary-key ranges in display order: positive ids, then the offline (<= 0) ones.
+    if direction == "b":
+        if key > 0:
+            rows = fetch("id > 0 AND id < ?", (key,), "DESC", want)
+        else:
+            rows = fetch("id < ?", (key,), "DESC", want)
+            rows += fetch("id > 0", (), "DESC", want - len(rows))
     else:
-        cur.execute("""
-            SELECT id, first_name, '' as last_name, username, role, balance
-            FROM users
-            ORDER BY CASE WHEN id > 0 THEN 0 ELSE 1 END, id ASC
-            LIMIT ? OFFSET ?
-        """, (limit, offset))
-    rows = cur.fetchall()
+        op = ">=" if direction == "f" else ">"
+        if direction and key <= 0:
+            rows = fetch(f"id {op} ? AND id <= 0", (key,), "ASC", want)
+        else:
+            rows = fetch(f"id {op} ?", (key,), "ASC", want) if direction else fetch("id > 0", (), "ASC", want)
+            rows += fetch("id <= 0", (), "ASC", want - len(rows))
     conn.close()
-    return rows
+    return _page_result(rows, limit, direction)
 
 
 def search_users(keyword: str, limit: int = 20) -> List[Tuple]:
@@ -126,7 +188,16 @@ def search_users(keyword: str, limit: int = 20) -> List[Tuple]:
     has_last = column_exists(conn, "users", "last_name")
     cur = conn.cursor()
     like_kw = f"%{keyword}%"
-    if has_last:
+    match = admin_search_match(cur, "users_search", keyword)
+    if match:
+        cur.execute("""
+            SELECT id, first_name, last_name, username, role, balance
+            FROM users
+            WHERE id IN (SELECT rowid FROM users_search WHERE users_search MATCH ?)
+            ORDER BY id ASC
+            LIMIT ?
+        """, (match, limit))
+    elif has_last:
         cur.execute("""
             SELECT id, first_name, last_name, username, role, balance
             FROM users
@@ -211,6 +282,8 @@ def update_user_field(user_id: int, field: str, value) -> bool:
     allowed = ("first_name", "last_name", "username", "role", "balance", "membership_status")
     if field not in allowed:
         return False
+    if field == "balance":
+        return update_user_balance(user_id, value)
     conn = _connect()
     if not column_exists(conn, "users", field):
         conn.close()
@@ -240,23 +313,27 @@ def update_any_user_field(user_id: int, field: str, value: str) -> bool:
     return update_user_field(user_id, field, value)
 
 
-def count_user_transactions(user_id: int) -> int:
-    conn = _connect()
-    cur = conn.cursor()
-    placeholders = ", ".join("?" for _ in VISIBLE_USER_TRANSACTION_STATUSES)
-    cur.execute(
-        f"SELECT COUNT(*) FROM transactions WHERE user_id = ? AND status IN ({placeholders})",
-        (user_id, *VISIBLE_USER_TRANSACTION_STATUSES),
-    )
-    row = cur.fetchone()
-    conn.close()
-    return int(row[0] or 0) if row else 0
+TRANSACTION_SORT_KEY = "COALESCE(submitted_at, created_at, '')"
 
 
-def get_user_transactions(user_id: int, page: int = 0, limit: int = USER_TXN_PAGE_SIZE) -> List[Dict]:
+def get_user_transactions(user_id: int, cursor: str = "", limit: int = USER_TXN_PAGE_SIZE) -> Tuple[List[Dict], bool, bool]:
+    direction, key = parse_page_cursor(cursor)
     conn = _connect()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
+    seek = ""
+    seek_params: tuple = ()
+    order = "DESC"
+    if direction:
+        boundary = cur.execute(f"SELECT {TRANSACTION_SORT_KEY} FROM transactions WHERE id = ?", (key,)).fetchone()
+        sort_value = boundary[0] if boundary else ""
+        if direction == "b":
+            seek = f"AND ({TRANSACTION_SORT_KEY} > ? OR ({TRANSACTION_SORT_KEY} = ? AND id > ?))"
+            order = "ASC"
+        else:
+            id_op = "<=" if direction == "f" else "<"
+            seek = f"AND ({TRANSACTION_SORT_KEY} < ? OR ({TRANSACTION_SORT_KEY} = ? AND id {id_op} ?))"
+        seek_params = (sort_value, sort_value, key)
     cur.execute("""
         SELECT
             id,
@@ -272,14 +349,20 @@ def get_user_transactions(user_id: int, page: int = 0, limit: int = USER_TXN_PAG
         FROM transactions
         WHERE user_id = ?
           AND status IN ({placeholders})
-        ORDER BY COALESCE(submitted_at, created_at) DESC, id DESC
-        LIMIT ? OFFSET ?
-    """.format(placeholders=", ".join("?" for _ in VISIBLE_USER_TRANSACTION_STATUSES)),
-        (user_id, *VISIBLE_USER_TRANSACTION_STATUSES, int(limit), int(page) * int(limit)),
+          {seek}
+        ORDER BY {sort_key} {order}, id {order}
+        LIMIT ?
+    """.format(
+        placeholders=", ".join("?" for _ in VISIBLE_USER_TRANSACTION_STATUSES),
+        seek=seek,
+        sort_key=TRANSACTION_SORT_KEY,
+        order=order,
+    ),
+        (user_id, *VISIBLE_USER_TRANSACTION_STATUSES, *seek_params, int(limit) + 1),
     )
     rows = [dict(row) for row in cur.fetchall()]
     conn.close()
-    return rows
+    return _page_result(rows, limit, direction)
 
 
 def get_user_transaction_detail(user_id: int, txn_id: int) -> Optional[Dict]:
@@ -300,16 +383,20 @@ def get_user_transaction_detail(user_id: int, txn_id: int) -> Optional[Dict]:
     return dict(row) if row else None
 
 
-def count_user_orders(user_id: int) -> int:
-    conn = _connect()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM orders WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return int(row[0] or 0) if row else 0
+def _id_seek(direction: str, column: str) -> Tuple[str, str]:
+    """Seek condition and order for lists shown newest id first."""
+    if direction == "b":
+        return f"AND {column} > ?", "ASC"
+    if direction == "f":
+        return f"AND {column} <= ?", "DESC"
+    if direction == "a":
+        return f"AND {column} < ?", "DESC"
+    return "", "DESC"
 
 
-def get_user_orders(user_id: int, page: int = 0, limit: int = USER_ORDER_PAGE_SIZE) -> List[Dict]:
+def get_user_orders(user_id: int, cursor: str = "", limit: int = USER_ORDER_PAGE_SIZE) -> Tuple[List[Dict], bool, bool]:
+    direction, key = parse_page_cursor(cursor)
+    seek, order = _id_seek(direction, "o.id")
     conn = _connect()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
@@ -331,12 +418,13 @@ def get_user_orders(user_id: int, page: int = 0, limit: int = USER_ORDER_PAGE_SI
         FROM orders o
         LEFT JOIN plans p ON p.id = o.plan_id
         WHERE o.user_id = ?
-        ORDER BY o.id DESC
-        LIMIT ? OFFSET ?
-    """, (user_id, int(limit), int(page) * int(limit)))
+          {seek}
+        ORDER BY o.id {order}
+        LIMIT ?
+    """.format(seek=seek, order=order), (user_id, *((key,) if direction else ()), int(limit) + 1))
     rows = [dict(row) for row in cur.fetchall()]
     conn.close()
-    return rows
+    return _page_result(rows, limit, direction)
 
 
 def get_user_order_detail(user_id: int, order_id: int) -> Optional[Dict]:
@@ -361,7 +449,9 @@ def get_user_order_detail(user_id: int, order_id: int) -> Optional[Dict]:
     return dict(row) if row else None
 
 
-def get_user_accounts(user_id: int, page: int = 0, limit: int = USER_ACCOUNT_PAGE_SIZE) -> List[Dict]:
+def get_user_accounts(user_id: int, cursor: str = "", limit: int = USER_ACCOUNT_PAGE_SIZE) -> Tuple[List[Dict], bool, bool]:
+    direction, key = parse_page_cursor(cursor)
+    seek, order = _id_seek(direction, "MAX(id)")
     conn = _connect()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
@@ -386,35 +476,15 @@ def get_user_accounts(user_id: int, page: int = 0, limit: int = USER_ACCOUNT_PAG
           AND TRIM(CAST(username AS TEXT)) != ''
           AND status IN ({placeholders})
         GROUP BY username
-        ORDER BY MAX(id) DESC
-        LIMIT ? OFFSET ?
-    """.format(placeholders=placeholders),
-        (*VISIBLE_USER_ACCOUNT_STATUSES, user_id, *VISIBLE_USER_ACCOUNT_STATUSES, int(limit), int(page) * int(limit)),
+        HAVING 1 = 1 {seek}
+        ORDER BY MAX(id) {order}
+        LIMIT ?
+    """.format(placeholders=placeholders, seek=seek, order=order),
+        (*VISIBLE_USER_ACCOUNT_STATUSES, user_id, *VISIBLE_USER_ACCOUNT_STATUSES, *((key,) if direction else ()), int(limit) + 1),
     )
     rows = [dict(row) for row in cur.fetchall()]
     conn.close()
-    return rows
-
-
-def count_user_accounts(user_id: int) -> int:
-    conn = _connect()
-    cur = conn.cursor()
-    placeholders = ", ".join("?" for _ in VISIBLE_USER_ACCOUNT_STATUSES)
-    cur.execute("""
-        SELECT COUNT(*)
-        FROM (
-            SELECT username
-            FROM orders
-            WHERE user_id = ?
-              AND username IS NOT NULL
-              AND TRIM(CAST(username AS TEXT)) != ''
-              AND status IN ({placeholders})
-            GROUP BY username
-        )
-    """.format(placeholders=placeholders), (user_id, *VISIBLE_USER_ACCOUNT_STATUSES))
-    row = cur.fetchone()
-    conn.close()
-    return int(row[0] or 0) if row else 0
+    return _page_result(rows, limit, direction)
 
 
 def update_user_role(user_id: int, role_value: str) -> bool:
@@ -428,7 +498,15 @@ def update_user_balance(user_id: int, balance_value: int) -> bool:
         balance_value = int(balance_value)
     except Exception:
         return False
-    return update_user_field(user_id, "balance", balance_value)
+    conn = _connect()
+    try:
+        new_balance = set_wallet_balance(conn.cursor(), user_id, balance_value, kind="admin_set")
+        conn.commit()
+    except Exception:
+        return False
+    finally:
+        conn.close()
+    return new_balance is not None
 
 
 def update_user_max_active_accounts(user_id: int, max_value: int) -> bool:
@@ -584,12 +662,9 @@ def edit_fields_keyboard(user_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-def paged_back_keyboard(prefix: str, user_id: int, page: int, total: int, page_size: int) -> InlineKeyboardMarkup:
-    nav = []
-    if page > 0:
-        nav.append(InlineKeyboardButton(text="⬅️ قبلی", callback_data=f"{prefix}:{user_id}:{page - 1}"))
-    if (page + 1) * page_size < total:
-        nav.append(InlineKeyboardButton(text="➡️ بعدی", callback_data=f"{prefix}:{user_id}:{page + 1}"))
+def paged_back_keyboard(prefix: str, user_id: int, page: int, first_key=None, last_key=None,
+                        has_prev: bool = False, has_next: bool = False) -> InlineKeyboardMarkup:
+    nav = keyset_nav_row(f"{prefix}:{user_id}", page, first_key, last_key, has_prev, has_next)
     rows = []
     if nav:
         rows.append(nav)
@@ -597,59 +672,52 @@ def paged_back_keyboard(prefix: str, user_id: int, page: int, total: int, page_s
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-def transactions_keyboard(user_id: int, rows_data: List[Dict], page: int, total: int) -> InlineKeyboardMarkup:
+def transactions_keyboard(user_id: int, rows_data: List[Dict], page: int, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
     rows = []
+    here = f"{page}:f{rows_data[0]['id']}"
     for txn in rows_data:
         date_text = format_jalali_datetime(txn.get("submitted_at") or txn.get("created_at"))
         button_text = f"#{txn['id']} | {format_price(txn.get('display_amount'))} | {date_text}"
-        rows.append([InlineKeyboardButton(text=button_text[:64], callback_data=f"user_txn_detail:{user_id}:{txn['id']}:{page}")])
-    nav = []
-    if page > 0:
-        nav.append(InlineKeyboardButton(text="⬅️ قبلی", callback_data=f"user_txns:{user_id}:{page - 1}"))
-    if (page + 1) * USER_TXN_PAGE_SIZE < total:
-        nav.append(InlineKeyboardButton(text="➡️ بعدی", callback_data=f"user_txns:{user_id}:{page + 1}"))
+        rows.append([InlineKeyboardButton(text=button_text[:64], callback_data=f"user_txn_detail:{user_id}:{txn['id']}:{here}")])
+    nav = keyset_nav_row(f"user_txns:{user_id}", page, rows_data[0]["id"], rows_data[-1]["id"], has_prev, has_next)
     if nav:
         rows.append(nav)
     rows.append([InlineKeyboardButton(text="🔙 بازگشت به کاربر", callback_data=f"user_select:{user_id}")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-def orders_keyboard(user_id: int, rows_data: List[Dict], page: int, total: int) -> InlineKeyboardMarkup:
+def orders_keyboard(user_id: int, rows_data: List[Dict], page: int, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
     rows = []
+    here = f"{page}:f{rows_data[0]['id']}"
     for order in rows_data:
         button_text = (
             f"#{order['id']} | {order.get('username') or '-'} | "
             f"{order_status_label(order.get('status'))} | {order.get('expires_at') or '-'}"
         )
-        rows.append([InlineKeyboardButton(text=button_text[:64], callback_data=f"user_order_detail:{user_id}:{order['id']}:{page}")])
-    nav = []
-    if page > 0:
-        nav.append(InlineKeyboardButton(text="⬅️ قبلی", callback_data=f"user_orders:{user_id}:{page - 1}"))
-    if (page + 1) * USER_ORDER_PAGE_SIZE < total:
-        nav.append(InlineKeyboardButton(text="➡️ بعدی", callback_data=f"user_orders:{user_id}:{page + 1}"))
+        rows.append([InlineKeyboardButton(text=button_text[:64], callback_data=f"user_order_detail:{user_id}:{order['id']}:{here}")])
+    nav = keyset_nav_row(f"user_orders:{user_id}", page, rows_data[0]["id"], rows_data[-1]["id"], has_prev, has_next)
     if nav:
         rows.append(nav)
     rows.append([InlineKeyboardButton(text="🔙 بازگشت به کاربر", callback_data=f"user_select:{user_id}")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-def accounts_keyboard(user_id: int, page: int, total: int) -> InlineKeyboardMarkup:
-    return paged_back_keyboard("user_accounts", user_id, page, total, USER_ACCOUNT_PAGE_SIZE)
+def accounts_keyboard(user_id: int, rows_data: List[Dict], page: int, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    return paged_back_keyboard(
+        "user_accounts", user_id, page,
+        rows_data[0]["latest_order_id"], rows_data[-1]["latest_order_id"], has_prev, has_next,
+    )
 
 
 # --- ساخت کیبورد صفحه‌بندی و جستجو ---
-def build_users_list_keyboard(rows: List[Tuple], page: int) -> InlineKeyboardMarkup:
+def build_users_list_keyboard(rows: List[Tuple], page: int, has_prev: bool = False, has_next: bool = False) -> InlineKeyboardMarkup:
     keyboard_rows = []
     for r in rows:
         uid = r[0]
         text = format_user_button_text(r)
         keyboard_rows.append([InlineKeyboardButton(text=text, callback_data=f"user_select:{uid}")])
 
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text="⬅️ قبلی", callback_data=f"user_page:{page - 1}"))
-    if len(rows) == PAGE_SIZE:
-        nav_buttons.append(InlineKeyboardButton(text="➡️ بعدی", callback_data=f"user_page:{page + 1}"))
+    nav_buttons = keyset_nav_row("user_page", page, rows[0][0], rows[-1][0], has_prev, has_next) if rows else []
     if nav_buttons:
         keyboard_rows.append(nav_buttons)
 
@@ -659,9 +727,8 @@ def build_users_list_keyboard(rows: List[Tuple], page: int) -> InlineKeyboardMar
 
 
 # --- نمایش لیست کاربران (صفحه‌بندی) ---
-async def show_users_list_message(msg_or_cb, page: int = 0):
-    offset = page * PAGE_SIZE
-    users = get_users(offset=offset, limit=PAGE_SIZE)
+async def show_users_list_message(msg_or_cb, page: int = 0, cursor: str = ""):
+    users, has_prev, has_next = get_users(cursor=cursor, limit=PAGE_SIZE)
     if not users:
         text = "🚫 هیچ کاربری یافت نشد."
         if isinstance(msg_or_cb, Message):
@@ -676,7 +743,7 @@ async def show_users_list_message(msg_or_cb, page: int = 0):
         return
 
     text = f"📋 لیست کاربران — صفحه {page + 1}:"
-    kb = build_users_list_keyboard(users, page)
+    kb = build_users_list_keyboard(users, page, has_prev, has_next)
     if isinstance(msg_or_cb, Message):
         await msg_or_cb.answer(text, reply_markup=kb)
     else:
@@ -700,8 +767,8 @@ async def manage_users_entry(msg: Message):
 async def user_page_handler(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return await cb.answer("دسترسی نداری.", show_alert=True)
-    page = int(cb.data.split(":")[1])
-    await show_users_list_message(cb, page)
+    _, page, cursor = parse_page_callback(cb.data, 1)
+    await show_users_list_message(cb, page, cursor)
 
 
 # --- بازگشت به منوی اصلی ---
@@ -831,18 +898,16 @@ async def user_receive_field_value(msg: Message, state: FSMContext):
 async def user_transactions_list(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return await cb.answer("دسترسی نداری.", show_alert=True)
-    _, uid_text, page_text = cb.data.split(":")
+    (uid_text,), page, cursor = parse_page_callback(cb.data, 2)
     uid = int(uid_text)
-    page = max(0, int(page_text))
-    total = count_user_transactions(uid)
-    rows = get_user_transactions(uid, page=page)
+    rows, has_prev, has_next = get_user_transactions(uid, cursor=cursor)
     if not rows:
-        await cb.message.answer("برای این کاربر تراکنشی ثبت نشده.", reply_markup=paged_back_keyboard("user_txns", uid, page, total, USER_TXN_PAGE_SIZE))
+        await cb.message.answer("برای این کاربر تراکنشی ثبت نشده.", reply_markup=paged_back_keyboard("user_txns", uid, 0))
         return await cb.answer()
     await cb.message.answer(
         f"🧾 تراکنش‌های کاربر #{uid} — صفحه {page + 1}\n"
         "شماره | مبلغ | تاریخ",
-        reply_markup=transactions_keyboard(uid, rows, page, total),
+        reply_markup=transactions_keyboard(uid, rows, page, has_prev, has_next),
     )
     await cb.answer()
 
@@ -851,10 +916,9 @@ async def user_transactions_list(cb: CallbackQuery):
 async def user_transaction_detail(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return await cb.answer("دسترسی نداری.", show_alert=True)
-    _, uid_text, txn_text, page_text = cb.data.split(":")
+    (uid_text, txn_text), page, cursor = parse_page_callback(cb.data, 3)
     uid = int(uid_text)
     txn_id = int(txn_text)
-    page = int(page_text)
     txn = get_user_transaction_detail(uid, txn_id)
     if not txn:
         return await cb.answer("تراکنش پیدا نشد.", show_alert=True)
@@ -874,7 +938,7 @@ async def user_transaction_detail(cb: CallbackQuery):
         f"🧮 یادداشت حسابداری: {escape(str(txn.get('accounting_note') or '-'))}"
     )
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 بازگشت به تراکنش‌ها", callback_data=f"user_txns:{uid}:{page}")],
+        [InlineKeyboardButton(text="🔙 بازگشت به تراکنش‌ها", callback_data=f"user_txns:{uid}:{page}:{cursor}")],
         [InlineKeyboardButton(text="🔙 بازگشت به کاربر", callback_data=f"user_select:{uid}")],
     ])
     await cb.message.answer(text, parse_mode="HTML", reply_markup=kb)
@@ -885,17 +949,15 @@ async def user_transaction_detail(cb: CallbackQuery):
 async def user_orders_list(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return await cb.answer("دسترسی نداری.", show_alert=True)
-    _, uid_text, page_text = cb.data.split(":")
+    (uid_text,), page, cursor = parse_page_callback(cb.data, 2)
     uid = int(uid_text)
-    page = max(0, int(page_text))
-    total = count_user_orders(uid)
-    rows = get_user_orders(uid, page=page)
+    rows, has_prev, has_next = get_user_orders(uid, cursor=cursor)
     if not rows:
-        await cb.message.answer("برای این کاربر سفارشی ثبت نشده.", reply_markup=paged_back_keyboard("user_orders", uid, page, total, USER_ORDER_PAGE_SIZE))
+        await cb.message.answer("برای این کاربر سفارشی ثبت نشده.", reply_markup=paged_back_keyboard("user_orders", uid, 0))
         return await cb.answer()
     await cb.message.answer(
         f"📦 سفارش‌های کاربر #{uid} — صفحه {page + 1}:",
-        reply_markup=orders_keyboard(uid, rows, page, total),
+        reply_markup=orders_keyboard(uid, rows, page, has_prev, has_next),
     )
     await cb.answer()
 
@@ -904,10 +966,9 @@ async def user_orders_list(cb: CallbackQuery):
 async def user_order_detail(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return await cb.answer("دسترسی نداری.", show_alert=True)
-    _, uid_text, order_text, page_text = cb.data.split(":")
+    (uid_text, order_text), page, cursor = parse_page_callback(cb.data, 3)
     uid = int(uid_text)
     order_id = int(order_text)
-    page = int(page_text)
     order = get_user_order_detail(uid, order_id)
     if not order:
         return await cb.answer("سفارش پیدا نشد.", show_alert=True)
@@ -925,8 +986,11 @@ async def user_order_detail(cb: CallbackQuery):
         f"⏳ پایان: <code>{escape(str(order.get('expires_at') or '-'))}</code>\n"
         f"🔁 تمدید سفارش: <code>{escape(str(order.get('is_renewal_of_order') or '-'))}</code>"
     )
+    daily = get_daily_usage(order_id)
+    if any(day["used_mb"] for day in daily):
+        text += f"\n\n📈 <b>مصرف ۷ روز اخیر:</b>\n{format_daily_usage(daily)}"
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 بازگشت به سفارش‌ها", callback_data=f"user_orders:{uid}:{page}")],
+        [InlineKeyboardButton(text="🔙 بازگشت به سفارش‌ها", callback_data=f"user_orders:{uid}:{page}:{cursor}")],
         [InlineKeyboardButton(text="🔙 بازگشت به کاربر", callback_data=f"user_select:{uid}")],
     ])
     await cb.message.answer(text, parse_mode="HTML", reply_markup=kb)
@@ -937,13 +1001,11 @@ async def user_order_detail(cb: CallbackQuery):
 async def user_accounts_list(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return await cb.answer("دسترسی نداری.", show_alert=True)
-    _, uid_text, page_text = cb.data.split(":")
+    (uid_text,), page, cursor = parse_page_callback(cb.data, 2)
     uid = int(uid_text)
-    page = max(0, int(page_text))
-    total = count_user_accounts(uid)
-    rows = get_user_accounts(uid, page=page)
+    rows, has_prev, has_next = get_user_accounts(uid, cursor=cursor)
     if not rows:
-        await cb.message.answer("برای این کاربر اکانتی در سفارش‌ها پیدا نشد.", reply_markup=accounts_keyboard(uid, page, total))
+        await cb.message.answer("برای این کاربر اکانتی در سفارش‌ها پیدا نشد.", reply_markup=paged_back_keyboard("user_accounts", uid, 0))
         return await cb.answer()
 
     lines = [f"👤 اکانت‌های کاربر #{uid} — صفحه {page + 1}:"]
@@ -954,7 +1016,7 @@ async def user_accounts_list(cb: CallbackQuery):
             f"آخرین وضعیت: {order_status_label(account.get('latest_status'))} | "
             f"پایان: <code>{escape(str(account.get('latest_expires_at') or '-'))}</code>"
         )
-    await cb.message.answer("\n".join(lines), parse_mode="HTML", reply_markup=accounts_keyboard(uid, page, total))
+    await cb.message.answer("\n".join(lines), parse_mode="HTML", reply_markup=accounts_keyboard(uid, rows, page, has_prev, has_next))
     await cb.answer()
 
 
@@ -10,10 +10,9 @@ from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMar
 from config import ADMINS
 from keyboards.main_menu import admin_main_menu_keyboard
 from services.db import (
+    count_messaging_audience,
     get_all_segments,
-    get_all_user_ids_for_messaging,
-    get_user_ids_by_min_balance,
-    get_user_ids_by_segment_ids,
+    iter_messaging_audience,
     resolve_user_identifiers,
 )
 
@@ -106,12 +105,13 @@ async def show_messaging_home(target: Message, state: FSMContext) -> None:
     )
 
 
-async def begin_message_input(message: Message, state: FSMContext, title: str, user_ids: List[int]) -> None:
+async def begin_message_input(message: Message, state: FSMContext, title: str, audience: Dict, count: int) -> None:
+    # Only the audience definition goes into FSM storage; messaging_send walks it in chunks.
     await state.set_state(MessagingStates.waiting_for_message)
-    await state.update_data(recipient_title=title, recipient_user_ids=user_ids)
+    await state.update_data(recipient_title=title, recipient_audience=audience)
     await message.answer(
         f"گیرنده: {title}\n"
-        f"تعداد گیرنده: {len(user_ids)}\n\n"
+        f"تعداد گیرنده: {count}\n\n"
         "متن پیام را ارسال کن.\n"
         "برای لغو، «لغو» را بفرست.",
         reply_markup=cancel_keyboard(),
@@ -148,12 +148,13 @@ async def messaging_select_all(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         return await callback.answer("دسترسی نداری.", show_alert=True)
 
-    user_ids = get_all_user_ids_for_messaging()
-    if not user_ids:
+    audience = {"kind": "all"}
+    count = count_messaging_audience(audience)
+    if not count:
         await callback.message.answer("هیچ کاربری برای ارسال پیام پیدا نشد.", reply_markup=messaging_home_keyboard())
         return await callback.answer()
 
-    await begin_message_input(callback.message, state, "همه کاربران", user_ids)
+    await begin_message_input(callback.message, state, "همه کاربران", audience, count)
     await callback.answer()
 
 
@@ -236,7 +237,8 @@ async def messaging_receive_single_user(message: Message, state: FSMContext):
         message,
         state,
         f"کاربر #{user_id} (@{username})",
-        [user_id],
+        {"kind": "user", "user_id": user_id},
+        1,
     )
 
 
@@ -260,9 +262,13 @@ async def messaging_receive_segments(message: Message, state: FSMContext):
         )
         return
 
-    segment_ids = [int(segment["id"]) for segment in segments]
-    user_ids = get_user_ids_by_segment_ids(segment_ids, only_active_segments=True)
-    if not user_ids:
+    audience = {
+        "kind": "segments",
+        "segment_ids": [int(segment["id"]) for segment in segments],
+        "only_active_segments": True,
+    }
+    count = count_messaging_audience(audience)
+    if not count:
         await message.answer("در سگمنت(های) انتخابی کاربری برای ارسال پیام پیدا نشد.", reply_markup=messaging_home_keyboard())
         await state.clear()
         return
@@ -271,7 +277,7 @@ async def messaging_receive_segments(message: Message, state: FSMContext):
     title = "سگمنت: " + ", ".join(segment_titles[:3])
     if len(segment_titles) > 3:
         title += f" و {len(segment_titles) - 3} مورد دیگر"
-    await begin_message_input(message, state, title, user_ids)
+    await begin_message_input(message, state, title, audience, count)
 
 
 @router.message(MessagingStates.waiting_for_min_balance)
@@ -285,8 +291,9 @@ async def messaging_receive_min_balance(message: Message, state: FSMContext):
         await message.answer("حداقل موجودی معتبر بفرست. مثال: 300000", reply_markup=cancel_keyboard())
         return
 
-    user_ids = get_user_ids_by_min_balance(amount)
-    if not user_ids:
+    audience = {"kind": "min_balance", "min_balance": amount}
+    count = count_messaging_audience(audience)
+    if not count:
         await message.answer(
             f"کاربری با موجودی بالاتر یا مساوی {format_price(amount)} تومان پیدا نشد.",
             reply_markup=messaging_home_keyboard(),
@@ -298,7 +305,8 @@ async def messaging_receive_min_balance(message: Message, state: FSMContext):
         message,
         state,
         f"کاربران با موجودی >= {format_price(amount)} تومان",
-        user_ids,
+        audience,
+        count,
     )
 
 
@@ -319,9 +327,9 @@ async def messaging_send(message: Message, state: FSMContext, bot: Bot):
         return
 
     data = await state.get_data()
-    user_ids = [int(uid) for uid in (data.get("recipient_user_ids") or [])]
+    audience = data.get("recipient_audience")
     recipient_title = str(data.get("recipient_title") or "نامشخص")
-    if not user_ids:
+    if not audience:
         await state.clear()
         await message.answer("لیست گیرنده‌ها پیدا نشد. دوباره از منوی ارسال پیام شروع کن.", reply_markup=messaging_home_keyboard())
         return
@@ -329,22 +337,23 @@ async def messaging_send(message: Message, state: FSMContext, bot: Bot):
     await message.answer(
         f"ارسال شروع شد...\n"
         f"گیرنده: {recipient_title}\n"
-        f"تعداد: {len(user_ids)}"
+        f"تعداد: {count_messaging_audience(audience)}"
     )
 
     success = 0
     failed = 0
     failed_ids: List[int] = []
 
-    for user_id in user_ids:
-        try:
-            await bot.send_message(user_id, text)
-            success += 1
-        except Exception:
-            failed += 1
-            if len(failed_ids) < 20:
-                failed_ids.append(user_id)
-        await asyncio.sleep(0.02)
+    for user_ids in iter_messaging_audience(audience):
+        for user_id in user_ids:
+            try:
+                await bot.send_message(user_id, text)
+                success += 1
+            except Exception:
+                failed += 1
+                if len(failed_ids) < 20:
+                    failed_ids.append(user_id)
+            await asyncio.sleep(0.02)
 
     await state.clear()
     failed_preview = ", ".join(str(uid) for uid in failed_ids) if failed_ids else "-"
@@ -14,13 +14,10 @@ from aiogram.types import (
     InlineKeyboardMarkup,
 )
 from keyboards.main_menu import main_menu_keyboard_for_user
-from services import IBSng
 from services.admin_notifier import send_message_to_admins
-from services.db import (
-    get_services_waiting_for_renew,
-    update_order_status, set_order_expiry_to_now, get_services_waiting_for_renew_admin,
-    # set_order_expiry_to_now,
-)
+from services.executors import run_blocking
+from services.order_workflow import activate_stored_order
+from services.db import get_services_waiting_for_renew, get_services_waiting_for_renew_admin
 
 router = Router()
 
@@ -128,15 +125,13 @@ async def activate_confirm(callback: CallbackQuery, state: FSMContext):
     now = jdatetime.datetime.now()
     expiry_str = now.strftime("%Y-%m-%d %H:%M")  # مثال: 1404-07-07 23:47
 
-    # تاریخ پایان رو الان بزن
-    set_order_expiry_to_now(expiry_str=expiry_str, service_id=service_id)
+    # تاریخ پایان رو الان بزن و ریست اکانت رو در همون تراکنش در صف بذار
+    # (که تو سیکل بعدی همه‌چی درست میشه)
+    await run_blocking(activate_stored_order, service_id, callback.from_user.id, expiry_str)
 
     # وضعیت رو active کن
     # update_order_status(order_id=service_id, new_status="active")
 
-    # ریست اکانت (که تو سیکل بعدی همه‌چی درست میشه)
-    IBSng.reset_account_client(username=username)
-
     # گزارش به ادمین
     text_admin = (
         "🔔 فعال‌سازی سرویس ذخیره\n"
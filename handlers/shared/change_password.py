@@ -9,6 +9,7 @@ from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMar
 from config import ADMINS
 from keyboards.main_menu import main_menu_keyboard_for_user
 from services.IBSng import change_password as ibs_change_password
+from services.executors import run_blocking
 from services.db import (
     get_accounts_id_by_username,
     get_user_services_for_password_change,
@@ -78,7 +79,7 @@ def service_password_keyboard(services: List[Dict]) -> InlineKeyboardMarkup:
 
 async def apply_password_change(username: str, new_password: str) -> tuple[bool, str]:
     try:
-        success = ibs_change_password(username=username, password=new_password)
+        success = await run_blocking(ibs_change_password, username=username, password=new_password)
     except Exception as exc:
         return False, f"خطا در تغییر رمز در IBS: {exc}"
 
@@ -12,7 +12,6 @@ from config import ADMINS
 from handlers.user.start import is_user_member, join_channel_keyboard
 from keyboards.main_menu import main_menu_keyboard_for_user
 from services.admin_notifier import send_message_to_admins
-from services.IBSng import change_group
 from services.db import (
     ensure_user_exists,
     add_user,
@@ -20,7 +19,6 @@ from services.db import (
     insert_order,
     get_user_balance,
     find_free_account,
-    update_user_balance,
     assign_account_to_order,
     get_active_locations_by_category,
     update_last_name, get_active_cards,
@@ -31,6 +29,8 @@ from services.db import (
     release_account_by_username,
     cancel_unpaid_order,
 )
+from services.executors import run_blocking
+from services.order_workflow import purchase_service
 from services.runtime_settings import get_access_mode_setting, get_bool_setting, get_text_setting
 from services.payment_workflow import format_card_number_for_display
 from services.usage_policy import get_volume_policy_alert, get_volume_policy_text
@@ -731,31 +731,25 @@ async def confirm_and_create(callback: CallbackQuery, state: FSMContext):
             reply_markup=main_menu_keyboard_for_user(callback.from_user.id),
         )
 
-    free_account = find_free_account()
-    if not free_account:
-        await state.clear()
-        return await edit_then_show_main_menu(callback.message, callback.from_user.id, "اکانت آزاد موجود نیست ❌")
-
-    account_id, account_username, account_password = free_account
     try:
-        order_id = insert_order(
-            user_id=user_id,
-            plan_id=plan["id"],
-            username=account_username,
-            price=plan["price"],
-            status="active",
-            volume_gb=plan.get("volume_gb"),
-        )
-        assign_account_to_order(account_id, order_id)
+        # ثبت سفارش، رزرو اکانت، کسر موجودی و صف IBS در یک تراکنش؛ اگر موجودی کافی نباشد هیچ‌کدام ثبت نمی‌شود
+        purchase = await run_blocking(purchase_service, user_id, plan)
     except Exception as e:
         print(f"خطا در درج سفارش: {e}")
         await state.clear()
         return await edit_then_show_main_menu(callback.message, callback.from_user.id, "❌ خطایی در ثبت سفارش رخ داد.")
 
-    change_group(username=account_username, group=plan["group_name"])
-
-    new_balance = user_balance - plan["price"]
-    update_user_balance(user_id, new_balance)
+    if not purchase["ok"]:
+        await state.clear()
+        if purchase["error"] == "no_free_account":
+            return await edit_then_show_main_menu(callback.message, callback.from_user.id, "اکانت آزاد موجود نیست ❌")
+        if purchase["error"] == "insufficient_balance":
+            return await edit_then_show_main_menu(callback.message, callback.from_user.id, "❌ موجودی کافی نیست.")
+        return await edit_then_show_main_menu(callback.message, callback.from_user.id, "❌ خطایی در ثبت سفارش رخ داد.")
+    order_id = purchase["order_id"]
+    account_username = purchase["username"]
+    account_password = purchase["password"]
+    new_balance = purchase["new_balance"]
 
     await callback.message.answer(
         f"✅ سرویس شما فعال شد!\n\n"
@@ -8,6 +8,7 @@ from handlers.user.start import is_user_member, join_channel_keyboard
 from keyboards.main_menu import main_menu_keyboard_for_user
 from services.admin_notifier import send_message_to_admins
 from services.db import get_active_volume_packages, get_volume_services_for_user
+from services.executors import run_blocking
 from services.order_workflow import purchase_volume_package
 from services.runtime_settings import get_bool_setting, get_text_setting
 
@@ -325,7 +326,8 @@ async def extra_volume_confirm(callback: CallbackQuery, state: FSMContext):
         )
         return await callback.answer()
 
-    result = purchase_volume_package(
+    result = await run_blocking(
+        purchase_volume_package,
         user_id=callback.from_user.id,
         order_id=int(selected_service["id"]),
         package_id=int(selected_package["id"]),
@@ -4,9 +4,12 @@ from typing import Optional
 from config import ADMINS
 from keyboards.main_menu import admin_main_menu_keyboard, user_main_menu_keyboard
 from services.db import get_user_services, update_last_name
+from services.usage_history import format_daily_usage, get_daily_usage
 
 router = Router()
 
+USAGE_HISTORY_STATUSES = {"active", "waiting_for_renewal", "waiting_for_renewal_not_paid"}
+
 
 def format_datetime(value: Optional[str]) -> str:
     if not value:
@@ -101,4 +104,10 @@ async def my_services_handler(message: types.Message):
             f"📍 <b>وضعیت:</b> {status_fa}"
         )
 
+        is_unlimited = int(service.get("is_unlimited") or 0) == 1
+        if status_value in USAGE_HISTORY_STATUSES and not is_unlimited:
+            daily = get_daily_usage(service["id"])
+            if any(day["used_mb"] for day in daily):
+                text += f"\n\n📈 <b>مصرف ۷ روز اخیر:</b>\n{format_daily_usage(daily)}"
+
         await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
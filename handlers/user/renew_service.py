@@ -17,14 +17,11 @@ from aiogram.types import (
 
 from handlers.user.start import is_user_member, join_channel_keyboard
 from keyboards.main_menu import main_menu_keyboard_for_user
-from services import IBSng
-from services.IBSng import change_group
 from services.admin_notifier import send_message_to_admins
 from services.db import get_active_cards
 from services.db import (
     get_renew_plans,
     get_user_balance,
-    update_user_balance,
     get_services_for_renew,
     insert_renewed_order,
     update_order_status,
@@ -35,6 +32,8 @@ from services.db import (
     get_pending_renewal_order,
     get_order_data,
 )
+from services.executors import run_blocking
+from services.order_workflow import renew_service
 from services.runtime_settings import get_access_mode_setting, get_bool_setting, get_text_setting
 from services.payment_workflow import format_card_number_for_display
 from services.usage_policy import get_volume_policy_alert, get_volume_policy_text
@@ -745,7 +744,6 @@ async def renew_confirm_and_process(callback: CallbackQuery, state: FSMContext):
     plan_id = selected_plan["id"]
     plan_name = selected_plan["name"]
     plan_duration_months = selected_plan.get("duration_months")
-    plan_group_name = selected_plan["group_name"]
     service_id = selected_service["id"]
     service_username = str(selected_service["username"])
     volume_gb = selected_plan.get("volume_gb") or 0
@@ -805,18 +803,31 @@ async def renew_confirm_and_process(callback: CallbackQuery, state: FSMContext):
         )
         await state.clear()
     else:
-        # کسر موجودی
-        new_balance = current_balance - plan_price
-        update_user_balance(user_id, new_balance)
+        # کسر موجودی، ثبت تمدید و صف IBS در یک تراکنش
+        renewal = await run_blocking(renew_service, user_id, service_id, selected_plan, is_expired)
+        if not renewal["ok"]:
+            await state.clear()
+            if renewal["error"] == "already_renewed":
+                return await callback.message.edit_text(
+                    "⚠️ این سرویس قبلاً برای تمدید ثبت شده یا هم‌اکنون تمدید شده است."
+                )
+            if renewal["error"] == "insufficient_balance":
+                return await callback.message.edit_text("❌ موجودی کافی نیست. لطفاً دوباره تلاش کنید.")
+            text_admin = (
+                "⚠️ تمدید انجام نشد\n"
+                f"📥 کاربر <a href='tg://user?id={user_id}'>{user_id} {first_name} {last_name or ' '}</a> \n"
+                f"🆔 یوزرنیم: {service_username}\n"
+                f"🧾 سفارش: {service_id}\n"
+                f"❗️ خطا: {renewal['error']}"
+            )
+            await send_message_to_admins(text_admin)
+            return await callback.message.edit_text(
+                "❌ تمدید انجام نشد. لطفاً با پشتیبانی تماس بگیرید."
+            )
+        new_balance = renewal["new_balance"]
 
         if is_expired:
             # تمدید فوری
-            update_order_status(order_id=service_id, new_status="renewed")
-            insert_renewed_order(user_id, plan_id, service_username, plan_price, "active", service_id, volume_gb)
-
-            IBSng.reset_account_client(username=service_username)
-            change_group(username=service_username, group=plan_group_name)
-
             text_admin = (
                 "🔔 تمدید انجام شد (فعالسازی فوری)\n"
                 f"📥 کاربر <a href='tg://user?id={user_id}'>{user_id} {first_name} {last_name or ' '}</a> \n"
@@ -840,10 +851,7 @@ async def renew_confirm_and_process(callback: CallbackQuery, state: FSMContext):
             await state.clear()
             return
 
-        # اگر هنوز فعال است → رزرو تمدید در انتهای دوره
-        update_order_status(order_id=service_id, new_status="waiting_for_renewal")
-        insert_renewed_order(user_id, plan_id, service_username, plan_price, "reserved", service_id, volume_gb)
-
+        # اگر هنوز فعال است → تمدید در انتهای دوره رزرو شد
         text_admin = (
             "🔔 تمدید رزروی ثبت شد\n"
             f"📥 کاربر <a href='tg://user?id={user_id}'>{user_id} {first_name} {last_name or ' '}</a> \n"
@@ -4,12 +4,24 @@ import requests
 from bs4 import BeautifulSoup
 
 from config import IBS_USERNAME, IBS_PASSWORD, IBS_URL_BASE, IBS_URL_INFO, IBS_URL_EDIT, IBS_URL_CONNECTIONS, \
-    IBS_URL_DELETE
+    IBS_URL_DELETE, IBS_HTTP_TIMEOUT_SECONDS
+from services.ibs_circuit import ibs_breaker
+from services.ibs_singleflight import coalesced, ibs_reads
+from services.metrics import IBS_OPERATION, attach_requests_timing, instrument_functions
+
+
+class IBSSession(requests.Session):
+    """requests.Session whose every request goes through the shared IBS circuit breaker."""
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault('timeout', IBS_HTTP_TIMEOUT_SECONDS)
+        return ibs_breaker.call(super().request, method, url, *args, **kwargs)
 
 
 def login():
     # Create a session to persist cookies
-    session = requests.Session()
+    session = IBSSession()
+    attach_requests_timing(session)
     # Define the payload for the login form
     payload = {
         'username': IBS_USERNAME,
@@ -25,7 +37,14 @@ def login():
 
 
 def get_user_id(username):
-    session = login()
+    return _find_user_id(login(), username)
+
+
+def _find_user_id(session, username):
+    return ibs_reads.do((str(username), 'user_id'), _lookup_user_id, session, username)
+
+
+def _lookup_user_id(session, username):
     user_info_url = IBS_URL_INFO
     payload = {
         'normal_username_multi': username
@@ -58,9 +77,11 @@ def get_user_id(username):
             return None
 
 
-def get_user_exp_date(username):
+@coalesced
+def _user_info_text(username):
+    # Shared by the expiry, first-login and radius readers so one page fetch serves them all.
     session = login()
-    user_id = get_user_id(username)
+    user_id = _find_user_id(session, username)
     # user_info_url = 'http://ibs.persiapro.com/IBSng/admin/user/user_info.php'
     user_info_url = IBS_URL_INFO
 
@@ -69,7 +90,14 @@ def get_user_exp_date(username):
     }
     response = session.post(user_info_url, data=payload)
     if response.ok:
-        soup = BeautifulSoup(response.text, 'html.parser')
+        return response.text
+    return None
+
+
+def get_user_exp_date(username):
+    text = _user_info_text(username)
+    if text:
+        soup = BeautifulSoup(text, 'html.parser')
 
         # Find all 'tr' elements
         tr_elements = soup.find_all('tr')
@@ -99,17 +127,9 @@ def get_user_exp_date(username):
 
 
 def get_user_start_date(username):
-    session = login()
-    user_id = get_user_id(username)
-    # user_info_url = 'http://ibs.persiapro.com/IBSng/admin/user/user_info.php'
-    user_info_url = IBS_URL_INFO
-
-    payload = {
-        'user_id_multi': user_id
-    }
-    response = session.post(user_info_url, data=payload)
-    if response.ok:
-        soup = BeautifulSoup(response.text, 'html.parser')
+    text = _user_info_text(username)
+    if text:
+        soup = BeautifulSoup(text, 'html.parser')
 
         # Find all 'tr' elements
         tr_elements = soup.find_all('tr')
@@ -154,25 +174,92 @@ def user_info_page(user_id):
         return None
 
 
+class UserEdit:
+    """Collects attribute changes for one IBSng user and submits them in one edit post.
+
+    edit.php applies every template listed in ``edit_tpl_cs`` with its own
+    ``attr_update_method_N`` (``reset_times`` already sends three that way), so a full
+    account reset costs one login, one user lookup and one edit instead of a login,
+    lookup and post per attribute. Setting the same template twice keeps the last value::
+
+        UserEdit(username).reset_times().set_group(group).unlock().reset_radius_attrs().commit()
+    """
+
+    def __init__(self, username, session=None):
+        self.username = username
+        self.session = session
+        self.tab = None
+        self.changes = {}
+
+    def _add(self, template, method, tab=None, **fields):
+        self.changes[template] = (method, fields)
+        if tab and not self.tab:
+            self.tab = tab
+        return self
+
+    def reset_times(self):
+        self._add('rel_exp_date', 'relExpDate', 'Exp_Dates')
+        self._add('abs_exp_date', 'absExpDate', 'Exp_Dates')
+        return self._add('first_login', 'firstLogin', 'Exp_Dates', reset_first_login='t')
+
+    def reset_relative_exp_date(self):
+        return self._add('rel_exp_date', 'relExpDate', 'Exp_Dates')
+
+    def reset_first_login(self):
+        return self._add('first_login', 'firstLogin', 'Exp_Dates', reset_first_login='t')
+
+    def set_group(self, group):
+        return self._add('group_name', 'groupName', group_name=group)
+
+    def lock(self):
+        return self._add('lock', 'lock', 'Main', has_lock='t', lock='')
+
+    def unlock(self):
+        return self._add('lock', 'lock', 'Main')
+
+    def reset_radius_attrs(self):
+        return self._add('radius_attrs', 'radiusAttrs', 'Misc')
+
+    def set_radius_attrs(self, radius_attrs):
+        return self._add('radius_attrs', 'radiusAttrs', 'Misc', has_radius_attrs='t', radius_attrs=radius_attrs)
+
+    def payload(self, user_id):
+        payload = {
+            'target': 'user',
+            'target_id': user_id,
+            'update': '1',
+            'edit_tpl_cs': ','.join(self.changes),
+        }
+        if self.tab:
+            payload['tab1_selected'] = self.tab
+        for index, (method, fields) in enumerate(self.changes.values()):
+            payload[f'attr_update_method_{index}'] = method
+            payload.update(fields)
+        return payload
+
+    def commit(self):
+        if not self.changes:
+            return True
+        session = self.session or login()
+        user_id = _find_user_id(session, self.username)
+        if not user_id:
+            return False
+        response = session.post(IBS_URL_EDIT, data=self.payload(user_id))
+        ibs_reads.invalidate(self.username)
+        if not response.ok:
+            print(f"Failed to edit user {self.username}.")
+            print("Status code:", response.status_code)
+        self.changes = {}
+        return bool(response.ok)
+
+
 def change_group(username, group):
-    session = login()
-    user_id = get_user_id(username)
-    # edit_url = 'http://ibs.persiapro.com/IBSng/admin/plugins/edit.php'
-    edit_url = IBS_URL_EDIT
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'group_name',
-        'attr_update_method_0': 'groupName',
-        'group_name': group
-    }
-    session.post(edit_url, data=payload)
+    UserEdit(username).set_group(group).commit()
 
 
 def change_password(username, password):
     session = login()
-    user_id = get_user_id(username)
+    user_id = _find_user_id(session, username)
     # edit_url = 'http://ibs.persiapro.com/IBSng/admin/plugins/edit.php'
     edit_url = IBS_URL_EDIT
 
@@ -191,6 +278,7 @@ def change_password(username, password):
         'password': password
     }
     response = session.post(edit_url, data=payload)
+    ibs_reads.invalidate(username)
     if response.ok:
         print("Password Changed successfully!")
     else:
@@ -200,66 +288,17 @@ def change_password(username, password):
 
 
 def lock_user(username):
-    session = login()
-    user_id = get_user_id(username)
-    # edit_url = 'http://ibs.persiapro.com/IBSng/admin/plugins/edit.php'
-    edit_url = IBS_URL_EDIT
-
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'lock',
-        'tab1_selected': 'Main',
-        'attr_update_method_0': 'lock',
-        'has_lock': 't',
-        'lock': ''
-    }
-    response = session.post(edit_url, data=payload)
-    if response.ok:
+    if UserEdit(username).lock().commit():
         print("User has been locked!")
-    else:
-        print("Failed to lock the user.")
-        print("Status code:", response.status_code)
 
 
 def unlock_user(username):
-    session = login()
-    user_id = get_user_id(username)
-    # edit_url = 'http://ibs.persiapro.com/IBSng/admin/plugins/edit.php'
-    edit_url = IBS_URL_EDIT
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'lock',
-        'tab1_selected': 'Main',
-        'attr_update_method_0': 'lock',
-    }
-    session.post(edit_url, data=payload)
+    UserEdit(username).unlock().commit()
 
 
 def reset_first_login(username):
-    session = login()
-    user_id = get_user_id(username)
-    edit_url = IBS_URL_EDIT
-
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'first_login',
-        'tab1_selected': 'Exp_Dates',
-        'attr_update_method_0': 'firstLogin',
-        'reset_first_login': 't',
-    }
-    response = session.post(edit_url, data=payload)
-
-    if response.ok:
+    if UserEdit(username).reset_first_login().commit():
         print("User expire time has been reset!")
-    else:
-        print("Failed to reset user expire time.")
-        print("Status code:", response.status_code)
 
 
 def kill_user(user_id, username):
@@ -321,81 +360,35 @@ def get_user_password(user_id):
 
 
 def reset_relative_exp_date(username):
-    session = login()
-    user_id = get_user_id(username)
-    # edit_url = 'http://ibs.persiapro.com/IBSng/admin/plugins/edit.php'
-    edit_url = IBS_URL_EDIT
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'rel_exp_date',
-        'tab1_selected': 'Exp_Dates',
-        'attr_update_method_0': 'relExpDate'
-    }
-    response = session.post(edit_url, data=payload)
-
-    if response.ok:
+    if UserEdit(username).reset_relative_exp_date().commit():
         print("User relative expire time has been reset!")
-    else:
-        print("Failed to reset user relative expire time.")
-        print("Status code:", response.status_code)
 
 
 def reset_times(username):
-    session = login()
-    user_id = get_user_id(username)
-    # edit_url = 'http://ibs.persiapro.com/IBSng/admin/plugins/edit.php'
-    edit_url = IBS_URL_EDIT
-
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'rel_exp_date,abs_exp_date,first_login',
-        'tab1_selected': 'Exp_Dates',
-        'attr_update_method_0': 'relExpDate',
-        'attr_update_method_1': 'absExpDate',
-        'attr_update_method_2': 'firstLogin',
-        'reset_first_login': 't',
-    }
-    session.post(edit_url, data=payload)
+    UserEdit(username).reset_times().commit()
 
 
 def reset_radius_attrs(username):
-    session = login()
-    user_id = get_user_id(username)
-    # edit_url = 'http://ibs.persiapro.com/IBSng/admin/plugins/edit.php'
-    edit_url = IBS_URL_EDIT
-
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'radius_attrs',
-        'tab1_selected': 'Misc',
-        'attr_update_method_0': 'radiusAttrs',
-    }
-    session.post(edit_url, data=payload)
+    UserEdit(username).reset_radius_attrs().commit()
 
 
 def reset_account(username):
-    reset_times(username)
-    change_group(username, 'Starter')
-    unlock_user(username)
-    reset_radius_attrs(username)
+    UserEdit(username).reset_times().set_group('Starter').unlock().reset_radius_attrs().commit()
+
 
+def reset_account_client(username, group='Starter-Bot'):
+    """Reset times, lock and radius attributes and move the user to ``group`` in one edit.
 
-def reset_account_client(username):
-    reset_times(username)
-    change_group(username, 'Starter-Bot')
-    unlock_user(username)
-    reset_radius_attrs(username)
+    Callers activating a plan pass the plan's group here instead of calling
+    ``change_group`` afterwards.
+    """
+    UserEdit(username).reset_times().set_group(group).unlock().reset_radius_attrs().commit()
 
 
+@coalesced
 def get_usage_last_n_days(username, days):
     session = login()
-    user_id = get_user_id(username)
+    user_id = _find_user_id(session, username)
     # user_info_url = 'http://ibs.persiapro.com/IBSng/admin/report/connections.php'
     user_info_url = IBS_URL_CONNECTIONS
     payload = {
@@ -439,9 +432,62 @@ def get_usage_last_n_days(username, days):
     return None, None
 
 
+def _connection_log_usernames(soup):
+    """Usernames in the rows of the connection log table, or None when it has no Username column."""
+    for header in soup.find_all('tr'):
+        cells = [cell.get_text(strip=True) for cell in header.find_all(['td', 'th'])]
+        if 'Username' not in cells:
+            continue
+        column = cells.index('Username')
+        usernames = []
+        for row in header.find_next_siblings('tr'):
+            row_cells = row.find_all('td')
+            if len(row_cells) == len(cells):
+                username = row_cells[column].get_text(strip=True)
+                if username:
+                    usernames.append(username)
+        return usernames
+    return None
+
+
+def get_usernames_logged_in_since(since, max_pages=20, rpp=500):
+    """Set of usernames with a successful login after ``since`` (jalali), from one connection report.
+
+    Returns None when the report could not be read, so callers can fall back to asking
+    about each user separately.
+    """
+    session = login()
+    usernames = set()
+    for page in range(1, max_pages + 1):
+        payload = {
+            'show_reports': 1,
+            'page': page,
+            'admin_connection_logs': 1,
+            'owner': 'All',
+            'login_time_from': since,
+            'login_time_from_unit': 'jalali',
+            'successful_yes': 'on',
+            'order_by': 'login_time',
+            'rpp': rpp
+        }
+        response = session.post(IBS_URL_CONNECTIONS, data=payload)
+        if not response.ok:
+            return None
+        rows = _connection_log_usernames(BeautifulSoup(response.text, 'html.parser'))
+        if rows is None:
+            # An empty report has no table at all; anything else is a page we do not understand.
+            if page > 1 or 'No Results' in response.text:
+                return usernames
+            return None
+        usernames.update(rows)
+        if len(rows) < rpp:
+            return usernames
+    return None
+
+
 def delete_user(username):
     session = login()
-    user_id = get_user_id(username)
+    user_id = _find_user_id(session, username)
     # delete_url = 'http://ibs.persiapro.com/IBSng/admin/user/del_user.php'
     delete_url = IBS_URL_DELETE
     payload = {
@@ -452,6 +498,7 @@ def delete_user(username):
         'delete_audit_logs': 'on'
     }
     response = session.post(delete_url, data=payload)
+    ibs_reads.invalidate(username)
 
     if response.ok:
         print(f"User {username} has been deleted!")
@@ -475,7 +522,7 @@ def change_queue_level(username, queue_level):
         3: "Rate-Limit=\"1m/1m\"",
     }
     session = login()
-    user_id = get_user_id(username)
+    user_id = _find_user_id(session, username)
     # edit_url = 'http://ibs.persiapro.com/IBSng/admin/plugins/edit.php'
     edit_url = IBS_URL_EDIT
     if queue_level == 0:
@@ -500,39 +547,20 @@ def change_queue_level(username, queue_level):
             'radius_attrs': levels[queue_level]
         }
     response = session.post(edit_url, data=payload)
+    ibs_reads.invalidate(username)
     if not response.ok:
         print("Failed to change queue level.")
         print("Status code:", response.status_code)
 
 
 def apply_user_radius_attrs(username, radius_attrs):
-    session = login()
-    user_id = get_user_id(username)
-    # edit_url = 'http://ibs.persiapro.com/IBSng/admin/plugins/edit.php'
-    edit_url = IBS_URL_EDIT
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'radius_attrs',
-        'tab1_selected': 'Misc',
-        'attr_update_method_0': 'radiusAttrs',
-        'has_radius_attrs': 't',
-        'radius_attrs': radius_attrs
-    }
-    session.post(edit_url, data=payload)
+    UserEdit(username).set_radius_attrs(radius_attrs).commit()
 
 
 def get_user_radius_attribute(username):
-    session = login()
-    user_id = get_user_id(username)
-    user_info_url = IBS_URL_INFO
-    payload = {
-        'user_id_multi': user_id
-    }
-    response = session.post(user_info_url, data=payload)
-    if response.ok:
-        soup = BeautifulSoup(response.text, 'html.parser')
+    text = _user_info_text(username)
+    if text:
+        soup = BeautifulSoup(text, 'html.parser')
 
         # پیدا کردن تگ td که مقدار Radius Attributes را دارد
         tds = soup.find_all("td", class_="Form_Content_Row_Right_textarea_td_dark")
@@ -546,22 +574,18 @@ def get_user_radius_attribute(username):
     return None  # اگر چیزی پیدا نشد
 
 
+@coalesced
 def get_group_radius_attribute(username):
-    session = login()
-    user_id = get_user_id(username)
-    user_info_url = IBS_URL_INFO
-    payload = {
-        'user_id_multi': user_id
-    }
-    response = session.post(user_info_url, data=payload)
+    text = _user_info_text(username)
     group_name = ""
-    if response.ok:
-        soup = BeautifulSoup(response.text, 'html.parser')
+    if text:
+        soup = BeautifulSoup(text, 'html.parser')
 
         link = soup.find("a", href=re.compile(r"group_info\.php\?group_name="))
         if link:
             group_name = link.text.strip()
 
+    session = login()
     edit_url = IBS_URL_EDIT
     payload = {
         'group_name': group_name,
@@ -585,56 +609,13 @@ def get_group_radius_attribute(username):
 
 
 def temporary_charge(username):
-    session = login()
-    user_id = get_user_id(username)
-
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'rel_exp_date,abs_exp_date,first_login',
-        'tab1_selected': 'Exp_Dates',
-        'attr_update_method_0': 'relExpDate',
-        'attr_update_method_1': 'absExpDate',
-        'attr_update_method_2': 'firstLogin',
-        'reset_first_login': 't',
-    }
-    session.post(IBS_URL_EDIT, data=payload)
-
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'group_name',
-        'attr_update_method_0': 'groupName',
-        'group_name': '1-Hour'
-    }
-    session.post(IBS_URL_EDIT, data=payload)
-
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'lock',
-        'tab1_selected': 'Main',
-        'attr_update_method_0': 'lock',
-    }
-    session.post(IBS_URL_EDIT, data=payload)
-
-    payload = {
-        'target': 'user',
-        'target_id': user_id,
-        'update': '1',
-        'edit_tpl_cs': 'radius_attrs',
-        'tab1_selected': 'Misc',
-        'attr_update_method_0': 'radiusAttrs',
-    }
-    session.post(IBS_URL_EDIT, data=payload)
+    UserEdit(username).reset_times().set_group('1-Hour').unlock().reset_radius_attrs().commit()
 
 
+@coalesced
 def get_usage_from_ibs(username, starts_at, expires_at):
     session = login()
-    user_id = get_user_id(username)
+    user_id = _find_user_id(session, username)
     payload = {
         'show_reports': 1,
         'page': 1,
@@ -693,3 +674,6 @@ def get_usage_from_ibs(username, starts_at, expires_at):
 
         return send_mb, receive_mb
     return None
+
+
+instrument_functions(globals(), IBS_OPERATION, "operation")
@@ -1,6 +1,7 @@
 # services/admin_notifier.py
 from aiogram import Bot
 from config import BOT_TOKEN, ADMINS  # اطمینان حاصل کن ADMIN_IDS در config لیست آیدی ادمین‌هاست
+from services.metrics import NOTIFICATIONS, inc
 
 
 async def send_message_to_admins(text: str):
@@ -9,9 +10,10 @@ async def send_message_to_admins(text: str):
         for admin_id in ADMINS:
             try:
                 await bot.send_message(admin_id, text, parse_mode="HTML")
+                inc(NOTIFICATIONS, channel="admin", outcome="sent")
             except Exception:
                 # نذار یک ادمین خراب، کل حلقه رو بترکونه
-                pass
+                inc(NOTIFICATIONS, channel="admin", outcome="failed")
     finally:
         # بستن سشن برای تمیزی
         await bot.session.close()
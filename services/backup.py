@@ -0,0 +1,384 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    BACKUP_COMPRESS,
+    BACKUP_DIR,
+    BACKUP_FULL_EVERY_HOURS,
+    BACKUP_KEEP_DELTA_HOURS,
+    BACKUP_KEEP_FULL_DAYS,
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_SLEEP_MS,
+    DB_PATH,
+)
+
+# Online snapshots of the bot database. The live file is copied with the SQLite backup API a
+# few hundred pages per step, so writers only wait for one step at a time. The copy is then
+# stored either as a full snapshot (plus a manifest of page hashes) or, when a recent full
+# exists, as a delta holding just the pages that differ from that full. Restoring a delta
+# needs its full and nothing else; older deltas can be dropped in any order.
+#
+#   <name>-YYYYmmdd-HHMMSS.full.db[.gz]   complete database file
+#   <name>-YYYYmmdd-HHMMSS.full.pages     manifest: b"PPPAGES1", page size, page count, digests
+#   <name>-YYYYmmdd-HHMMSS.delta[.gz]     b"PPDELTA1", page size, page count, base file name,
+#                                         then (page number, page bytes) for each changed page
+
+PAGES_MAGIC = b"PPPAGES1"
+DELTA_MAGIC = b"PPDELTA1"
+DIGEST_SIZE = 16
+STAMP_FORMAT = "%Y%m%d-%H%M%S"
+# A writer that lands between steps makes the backup restart from page one. After this many
+# restarts the remaining copy is done in a single step instead.
+MAX_BACKUP_RESTARTS = 5
+
+LAST_BACKUP_RESULT: Dict[str, Any] = {}
+_backup_lock = threading.Lock()
+
+
+class BackupBusy(RuntimeError):
+    """Raised when another backup is still running in this process."""
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _base_name() -> str:
+    return os.path.splitext(os.path.basename(DB_PATH))[0]
+
+
+def _stamp_of(file_name: str) -> Optional[datetime]:
+    prefix = _base_name() + "-"
+    if not file_name.startswith(prefix):
+        return None
+    try:
+        return datetime.strptime(file_name[len(prefix):len(prefix) + 15], STAMP_FORMAT)
+    except ValueError:
+        return None
+
+
+def _open_output(path: str, compress: bool):
+    return gzip.open(path, "wb", compresslevel=6) if compress else open(path, "wb")
+
+
+def _open_input(path: str):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def copy_live_database(target_path: str, pages_per_step: int, sleep_ms: int) -> Dict[str, int]:
+    """Copy DB_PATH into ``target_path`` with the paged backup API; returns step counters."""
+    counters = {"steps": 0, "restarts": 0, "single_step": 0}
+    last_remaining = [None]
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        counters["steps"] += 1
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            counters["restarts"] += 1
+            if counters["restarts"] > MAX_BACKUP_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining[0] = remaining
+
+    source = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            try:
+                source.backup(target, pages=pages_per_step, progress=progress, sleep=sleep_ms / 1000)
+            except _TooManyRestarts:
+                counters["single_step"] = 1
+                source.backup(target, pages=-1)
+            check = target.execute("PRAGMA quick_check").fetchone()
+            if not check or check[0] != "ok":
+                raise sqlite3.DatabaseError(f"snapshot failed quick_check: {check[0] if check else '-'}")
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return counters
+
+
+def _page_digests(path: str) -> Tuple[int, List[bytes]]:
+    with sqlite3.connect(path) as conn:
+        page_size = int(conn.execute("PRAGMA page_size").fetchone()[0])
+    digests = []
+    with open(path, "rb") as handle:
+        while True:
+            page = handle.read(page_size)
+            if not page:
+                break
+            digests.append(hashlib.blake2b(page, digest_size=DIGEST_SIZE).digest())
+    return page_size, digests
+
+
+def _write_manifest(path: str, page_size: int, digests: List[bytes]) -> None:
+    with open(path, "wb") as handle:
+        handle.write(PAGES_MAGIC + struct.pack(">II", page_size, len(digests)))
+        handle.write(b"".join(digests))
+
+
+def _read_manifest(path: str) -> Optional[Tuple[int, List[bytes]]]:
+    try:
+        with open(path, "rb") as handle:
+            data = handle.read()
+    except OSError:
+        return None
+    if not data.startswith(PAGES_MAGIC) or len(data) < len(PAGES_MAGIC) + 8:
+        return None
+    page_size, page_count = struct.unpack(">II", data[len(PAGES_MAGIC):len(PAGES_MAGIC) + 8])
+    body = data[len(PAGES_MAGIC) + 8:]
+    if len(body) != page_count * DIGEST_SIZE:
+        return None
+    return page_size, [body[i:i + DIGEST_SIZE] for i in range(0, len(body), DIGEST_SIZE)]
+
+
+def _latest_full(backup_dir: str) -> Optional[Tuple[str, datetime]]:
+    latest = None
+    for file_name in os.listdir(backup_dir):
+        stamp = _stamp_of(file_name)
+        if stamp is None or ".full.db" not in file_name or file_name.endswith(".part"):
+            continue
+        if not os.path.exists(os.path.join(backup_dir, _manifest_name(file_name))):
+            continue
+        if latest is None or stamp > latest[1]:
+            latest = (file_name, stamp)
+    return latest
+
+
+def _manifest_name(full_name: str) -> str:
+    return full_name.split(".full.db", 1)[0] + ".full.pages"
+
+
+def _store_full(snapshot_path: str, backup_dir: str, stamp: str, compress: bool,
+                page_size: int, digests: List[bytes]) -> str:
+    file_name = f"{_base_name()}-{stamp}.full.db" + (".gz" if compress else "")
+    final_path = os.path.join(backup_dir, file_name)
+    partial_path = final_path + ".part"
+    if compress:
+        with open(snapshot_path, "rb") as source, _open_output(partial_path, True) as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        os.remove(snapshot_path)
+    else:
+        os.replace(snapshot_path, partial_path)
+    _write_manifest(os.path.join(backup_dir, _manifest_name(file_name)), page_size, digests)
+    os.replace(partial_path, final_path)
+    return final_path
+
+
+def _store_delta(snapshot_path: str, backup_dir: str, stamp: str, compress: bool, base_name: str,
+                 page_size: int, changed: List[int], page_count: int) -> str:
+    file_name = f"{_base_name()}-{stamp}.delta" + (".gz" if compress else "")
+    final_path = os.path.join(backup_dir, file_name)
+    partial_path = final_path + ".part"
+    encoded_base = base_name.encode("utf-8")
+    with open(snapshot_path, "rb") as source, _open_output(partial_path, compress) as target:
+        target.write(DELTA_MAGIC + struct.pack(">IIH", page_size, page_count, len(encoded_base)) + encoded_base)
+        for page_number in changed:
+            source.seek(page_number * page_size)
+            target.write(struct.pack(">I", page_number) + source.read(page_size))
+    os.replace(partial_path, final_path)
+    os.remove(snapshot_path)
+    return final_path
+
+
+def apply_retention(backup_dir: str = BACKUP_DIR, now: Optional[datetime] = None) -> List[str]:
+    """Drop deltas older than BACKUP_KEEP_DELTA_HOURS and fulls older than BACKUP_KEEP_FULL_DAYS.
+
+    The newest full and every full that a kept delta was built on always stay.
+    """
+    now = now or datetime.now()
+    delta_cutoff = now - timedelta(hours=BACKUP_KEEP_DELTA_HOURS)
+    full_cutoff = now - timedelta(days=BACKUP_KEEP_FULL_DAYS)
+    fulls: Dict[str, datetime] = {}
+    kept_bases = set()
+    removed: List[str] = []
+
+    for file_name in sorted(os.listdir(backup_dir)):
+        stamp = _stamp_of(file_name)
+        if stamp is None:
+            continue
+        path = os.path.join(backup_dir, file_name)
+        if file_name.endswith(".part"):
+            # Left behind by a run that died mid-write.
+            if stamp < delta_cutoff:
+                os.remove(path)
+                removed.append(file_name)
+        elif ".full.db" in file_name:
+            fulls[file_name] = stamp
+        elif ".delta" in file_name:
+            if stamp < delta_cutoff:
+                os.remove(path)
+                removed.append(file_name)
+                continue
+            base = _delta_base(path)
+            if base:
+                kept_bases.add(base)
+
+    newest = max(fulls, key=fulls.get) if fulls else None
+    for file_name, stamp in fulls.items():
+        if stamp >= full_cutoff or file_name == newest or file_name in kept_bases:
+            continue
+        os.remove(os.path.join(backup_dir, file_name))
+        removed.append(file_name)
+        manifest = os.path.join(backup_dir, _manifest_name(file_name))
+        if os.path.exists(manifest):
+            os.remove(manifest)
+    return removed
+
+
+def _delta_base(path: str) -> Optional[str]:
+    try:
+        with _open_input(path) as handle:
+            header = handle.read(len(DELTA_MAGIC) + 10)
+            if not header.startswith(DELTA_MAGIC):
+                return None
+            _, _, name_length = struct.unpack(">IIH", header[len(DELTA_MAGIC):])
+            return handle.read(name_length).decode("utf-8")
+    except (OSError, EOFError, struct.error):
+        return None
+
+
+def run_backup(
+    backup_dir: str = BACKUP_DIR,
+    compress: bool = BACKUP_COMPRESS,
+    force_full: bool = False,
+) -> Dict[str, Any]:
+    """Take one snapshot of DB_PATH, store it as a full or a delta, then apply retention."""
+    if not _backup_lock.acquire(blocking=False):
+        raise BackupBusy("a backup is already running")
+    try:
+        started = time.perf_counter()
+        now = datetime.now()
+        stamp = now.strftime(STAMP_FORMAT)
+        os.makedirs(backup_dir, exist_ok=True)
+        snapshot_path = os.path.join(backup_dir, f".{_base_name()}-{stamp}.snapshot")
+        try:
+            counters = copy_live_database(snapshot_path, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP_MS)
+            copied_at = time.perf_counter()
+            page_size, digests = _page_digests(snapshot_path)
+
+            changed: Optional[List[int]] = None
+            base = None if force_full else _latest_full(backup_dir)
+            if base and now - base[1] < timedelta(hours=BACKUP_FULL_EVERY_HOURS):
+                manifest = _read_manifest(os.path.join(backup_dir, _manifest_name(base[0])))
+                if manifest and manifest[0] == page_size:
+                    base_digests = manifest[1]
+                    changed = [
+                        index for index, digest in enumerate(digests)
+                        if index >= len(base_digests) or base_digests[index] != digest
+                    ]
+                    # Past half the file a delta saves little and makes the next ones bigger.
+                    if len(changed) * 2 > len(digests):
+                        changed = None
+
+            if changed is None:
+                kind = "full"
+                path = _store_full(snapshot_path, backup_dir, stamp, compress, page_size, digests)
+            else:
+                kind = "delta"
+                path = _store_delta(snapshot_path, backup_dir, stamp, compress, base[0], page_size, changed, len(digests))
+        finally:
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+
+        removed = apply_retention(backup_dir, now)
+        result = {
+            "kind": kind,
+            "path": path,
+            "base": base[0] if kind == "delta" else None,
+            "started_at": now.isoformat(sep=" ", timespec="seconds"),
+            "db_bytes": page_size * len(digests),
+            "backup_bytes": os.path.getsize(path),
+            "pages": len(digests),
+            "changed_pages": len(changed) if changed is not None else len(digests),
+            "copy_ms": int((copied_at - started) * 1000),
+            "duration_ms": int((time.perf_counter() - started) * 1000),
+            "removed": removed,
+            **counters,
+        }
+        LAST_BACKUP_RESULT.clear()
+        LAST_BACKUP_RESULT.update(result)
+        return result
+    finally:
+        _backup_lock.release()
+
+
+def scheduled_backup() -> None:
+    try:
+        result = run_backup()
+    except BackupBusy:
+        print("Backup skipped: another backup is still running.")
+        return
+    print(f"Backup done: {format_backup_result(result)}")
+
+
+def restore_backup(path: str, target_path: str) -> Dict[str, Any]:
+    """Rebuild a database file at ``target_path`` from a full snapshot or a delta and its full."""
+    if os.path.exists(target_path):
+        raise FileExistsError(target_path)
+    partial_path = target_path + ".part"
+    applied = 0
+    if ".delta" in os.path.basename(path):
+        with _open_input(path) as delta:
+            header = delta.read(len(DELTA_MAGIC) + 10)
+            if not header.startswith(DELTA_MAGIC):
+                raise ValueError(f"{path} is not a delta backup")
+            page_size, page_count, name_length = struct.unpack(">IIH", header[len(DELTA_MAGIC):])
+            base_path = os.path.join(os.path.dirname(path), delta.read(name_length).decode("utf-8"))
+            with _open_input(base_path) as source, open(partial_path, "wb") as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            with open(partial_path, "r+b") as target:
+                while True:
+                    record = delta.read(4 + page_size)
+                    if not record:
+                        break
+                    (page_number,) = struct.unpack(">I", record[:4])
+                    target.seek(page_number * page_size)
+                    target.write(record[4:])
+                    applied += 1
+                target.truncate(page_count * page_size)
+    else:
+        with _open_input(path) as source, open(partial_path, "wb") as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+    with sqlite3.connect(partial_path) as conn:
+        check = conn.execute("PRAGMA quick_check").fetchone()
+    if not check or check[0] != "ok":
+        raise sqlite3.DatabaseError(f"restored file failed quick_check: {check[0] if check else '-'}")
+    os.replace(partial_path, target_path)
+    return {"path": target_path, "applied_pages": applied, "bytes": os.path.getsize(target_path)}
+
+
+def _format_bytes(value: int) -> str:
+    size = float(value or 0)
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+def format_backup_result(result: Dict[str, Any]) -> str:
+    if not result:
+        return "no backup in this process yet"
+    text = (
+        f"{result['kind']} {os.path.basename(result['path'])} at {result['started_at']}, "
+        f"{_format_bytes(result['backup_bytes'])} of {_format_bytes(result['db_bytes'])} "
+        f"({result['changed_pages']}/{result['pages']} pages), "
+        f"copy {result['copy_ms']}ms in {result['steps']} steps, total {result['duration_ms']}ms"
+    )
+    if result["restarts"]:
+        text += f", {result['restarts']} restarts"
+    if result["single_step"]:
+        text += ", finished in one step"
+    if result["removed"]:
+        text += f", removed {len(result['removed'])} old files"
+    return text
@@ -8,7 +8,7 @@ from typing import Any, Optional
 import jdatetime
 
 from config import DB_PATH
-from services.IBSng import change_group, reset_account_client
+from services.IBSng import reset_account_client
 from services.scheduler_services.telegram_safe import send_scheduler_notification
 from services.runtime_settings import get_bool_setting, get_int_setting, get_text_setting
 
@@ -1005,8 +1005,7 @@ def apply_conversion(user_id: int, service_id: int) -> dict[str, Any]:
 
     ibs_warning = None
     try:
-        reset_account_client(str(service["username"]))
-        change_group(str(service["username"]), str(target_plan["group_name"]))
+        reset_account_client(str(service["username"]), group=str(target_plan["group_name"]))
     except Exception as exc:
         ibs_warning = f"{type(exc).__name__}: {exc}"
         logger.warning(
@@ -1,11 +1,15 @@
+import re
 import sqlite3
+import time
 import zlib
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Optional, Iterable, List, Dict
 
 import jdatetime
 
 from config import DB_PATH, ORDER_ARCHIVE_AFTER_DAYS
+from services.metrics import SQLITE_CALL, instrument_functions
+from services.wallet import set_wallet_balance
 
 
 def _now_text(timespec: str = "minutes") -> str:
@@ -112,477 +116,830 @@ def _move_orders_to_archive(cursor: sqlite3.Cursor, order_ids: List[int], archiv
     return total_deleted
 
 
-def create_tables():
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        from services.runtime_settings import initialize_runtime_settings_schema
+def _migrate_baseline_schema(cursor: sqlite3.Cursor):
+    """Every table, column, index and data fix-up that create_tables() used to redo on each boot."""
 
-        def ensure_column(table: str, column: str, definition: str):
-            existing_columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
-            if column not in existing_columns:
-                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    def ensure_column(table: str, column: str, definition: str):
+        existing_columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
 
-        def normalize_datetime_column(table: str, column: str):
-            existing_columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
-            if column not in existing_columns:
-                return
-            cursor.execute(
-                f"""
-                UPDATE {table}
-                SET {column} = substr(replace({column}, 'T', ' '), 1, 16)
-                WHERE {column} IS NOT NULL
-                  AND TRIM({column}) != ''
-                """
+    def normalize_datetime_column(table: str, column: str):
+        existing_columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+        if column not in existing_columns:
+            return
+        cursor.execute(
+            f"""
+            UPDATE {table}
+            SET {column} = substr(replace({column}, 'T', ' '), 1, 16)
+            WHERE {column} IS NOT NULL
+              AND TRIM({column}) != ''
+            """
+        )
+
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS accounts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL UNIQUE,
+                password TEXT NOT NULL,
+                status TEXT DEFAULT 'free',
+                plan_id INTEGER,
+                order_id INTEGER,
+                start_date INTEGER,
+                expire_date TIMESTAMP,
+                comment TEXT,
+                FOREIGN KEY(order_id) REFERENCES orders(id),
+                FOREIGN KEY(plan_id) REFERENCES plans(id)
             )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS accounts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL UNIQUE,
-                    password TEXT NOT NULL,
-                    status TEXT DEFAULT 'free',
-                    plan_id INTEGER,
-                    order_id INTEGER,
-                    start_date INTEGER,
-                    expire_date TIMESTAMP,
-                    comment TEXT,
-                    FOREIGN KEY(order_id) REFERENCES orders(id),
-                    FOREIGN KEY(plan_id) REFERENCES plans(id)
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bank_cards (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                card_number TEXT NOT NULL,
+                owner_name TEXT,
+                bank_name TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                is_active INTEGER NOT NULL DEFAULT 1,
+                show_in_receipt INTEGER NOT NULL DEFAULT 1
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS bank_cards (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    card_number TEXT NOT NULL,
-                    owner_name TEXT,
-                    bank_name TEXT,
-                    priority INTEGER NOT NULL DEFAULT 0,
-                    is_active INTEGER NOT NULL DEFAULT 1,
-                    show_in_receipt INTEGER NOT NULL DEFAULT 1
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS feedbacks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                type TEXT,
+                message TEXT,
+                created_at TEXT
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS feedbacks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    type TEXT,
-                    message TEXT,
-                    created_at TEXT
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                plan_id INTEGER,
+                username INTEGER,
+                status TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                created_at TEXT,
+                starts_at BLOB,
+                expires_at TEXT,
+                last_notif_level INTEGER,
+                is_renewal_of_order INTEGER,
+                volume_bytes INTEGER,
+                FOREIGN KEY(plan_id) REFERENCES plans(id),
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS orders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    plan_id INTEGER,
-                    username INTEGER,
-                    status TEXT NOT NULL,
-                    price INTEGER NOT NULL,
-                    created_at TEXT,
-                    starts_at BLOB,
-                    expires_at TEXT,
-                    last_notif_level INTEGER,
-                    is_renewal_of_order INTEGER,
-                    volume_bytes INTEGER,
-                    FOREIGN KEY(plan_id) REFERENCES plans(id),
-                    FOREIGN KEY(user_id) REFERENCES users(id)
-                )
-                """)
+    cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE_NAME} (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                plan_id INTEGER,
+                username INTEGER,
+                status TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                created_at TEXT,
+                starts_at BLOB,
+                expires_at TEXT,
+                last_notif_level INTEGER,
+                is_renewal_of_order INTEGER,
+                volume_bytes INTEGER,
+                archived_at TEXT
+            )
+            """)
 
-        cursor.execute(f"""
-                CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE_NAME} (
-                    id INTEGER PRIMARY KEY,
-                    user_id INTEGER,
-                    plan_id INTEGER,
-                    username INTEGER,
-                    status TEXT NOT NULL,
-                    price INTEGER NOT NULL,
-                    created_at TEXT,
-                    starts_at BLOB,
-                    expires_at TEXT,
-                    last_notif_level INTEGER,
-                    is_renewal_of_order INTEGER,
-                    volume_bytes INTEGER,
-                    archived_at TEXT
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS plans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                volume_gb INTEGER,
+                duration_months INTEGER,
+                max_users INTEGER,
+                price INTEGER NOT NULL,
+                order_priority INTEGER DEFAULT 0,
+                visible INTEGER DEFAULT 1,
+                location TEXT,
+                is_unlimited INTEGER DEFAULT 0,
+                group_name TEXT,
+                duration_days INTEGER
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS plans (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    volume_gb INTEGER,
-                    duration_months INTEGER,
-                    max_users INTEGER,
-                    price INTEGER NOT NULL,
-                    order_priority INTEGER DEFAULT 0,
-                    visible INTEGER DEFAULT 1,
-                    location TEXT,
-                    is_unlimited INTEGER DEFAULT 0,
-                    group_name TEXT,
-                    duration_days INTEGER
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                photo_id TEXT NOT NULL,
+                photo_path TEXT NOT NULL,
+                photo_hash TEXT
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    amount INTEGER NOT NULL DEFAULT 0,
-                    status TEXT NOT NULL DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    photo_id TEXT NOT NULL,
-                    photo_path TEXT NOT NULL,
-                    photo_hash TEXT
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                first_name TEXT,
+                username TEXT,
+                role TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                balance INTEGER DEFAULT 0,
+                membership_status TEXT DEFAULT 'not_member'
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    first_name TEXT,
-                    username TEXT,
-                    role TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    balance INTEGER DEFAULT 0,
-                    membership_status TEXT DEFAULT 'not_member'
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ownership_transfers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                from_user_id INTEGER NOT NULL,
+                to_user_id INTEGER NOT NULL,
+                username TEXT,
+                transferred_by INTEGER,
+                transferred_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                total_orders INTEGER DEFAULT 0
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ownership_transfers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    from_user_id INTEGER NOT NULL,
-                    to_user_id INTEGER NOT NULL,
-                    username TEXT,
-                    transferred_by INTEGER,
-                    transferred_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    total_orders INTEGER DEFAULT 0
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                slug TEXT NOT NULL UNIQUE,
+                title TEXT NOT NULL,
+                description TEXT,
+                is_active INTEGER NOT NULL DEFAULT 1,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS segments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    slug TEXT NOT NULL UNIQUE,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    is_active INTEGER NOT NULL DEFAULT 1,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS segment_users (
+                segment_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (segment_id, user_id)
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS segment_users (
-                    segment_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (segment_id, user_id)
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS plan_segments (
+                plan_id INTEGER NOT NULL,
+                segment_id INTEGER NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (plan_id, segment_id)
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS plan_segments (
-                    plan_id INTEGER NOT NULL,
-                    segment_id INTEGER NOT NULL,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (plan_id, segment_id)
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS volume_packages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                volume_gb INTEGER NOT NULL,
+                price INTEGER NOT NULL,
+                sort_order INTEGER NOT NULL DEFAULT 0,
+                is_active INTEGER NOT NULL DEFAULT 1,
+                is_archived INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS volume_packages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    volume_gb INTEGER NOT NULL,
-                    price INTEGER NOT NULL,
-                    sort_order INTEGER NOT NULL DEFAULT 0,
-                    is_active INTEGER NOT NULL DEFAULT 1,
-                    is_archived INTEGER NOT NULL DEFAULT 0,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS volume_package_segments (
+                package_id INTEGER NOT NULL,
+                segment_id INTEGER NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (package_id, segment_id),
+                FOREIGN KEY(package_id) REFERENCES volume_packages(id),
+                FOREIGN KEY(segment_id) REFERENCES segments(id)
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS volume_package_segments (
-                    package_id INTEGER NOT NULL,
-                    segment_id INTEGER NOT NULL,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (package_id, segment_id),
-                    FOREIGN KEY(package_id) REFERENCES volume_packages(id),
-                    FOREIGN KEY(segment_id) REFERENCES segments(id)
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS volume_package_categories (
+                package_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (package_id, category),
+                FOREIGN KEY(package_id) REFERENCES volume_packages(id)
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS volume_package_categories (
-                    package_id INTEGER NOT NULL,
-                    category TEXT NOT NULL,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (package_id, category),
-                    FOREIGN KEY(package_id) REFERENCES volume_packages(id)
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS order_volume_allocations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                package_id INTEGER,
+                package_name TEXT,
+                source_type TEXT NOT NULL DEFAULT 'user_package',
+                status TEXT NOT NULL DEFAULT 'applied',
+                volume_gb INTEGER NOT NULL DEFAULT 0,
+                price INTEGER NOT NULL DEFAULT 0,
+                note TEXT,
+                admin_id INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                applied_at TEXT,
+                FOREIGN KEY(order_id) REFERENCES orders(id),
+                FOREIGN KEY(package_id) REFERENCES volume_packages(id),
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS order_volume_allocations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    order_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    package_id INTEGER,
-                    package_name TEXT,
-                    source_type TEXT NOT NULL DEFAULT 'user_package',
-                    status TEXT NOT NULL DEFAULT 'applied',
-                    volume_gb INTEGER NOT NULL DEFAULT 0,
-                    price INTEGER NOT NULL DEFAULT 0,
-                    note TEXT,
-                    admin_id INTEGER,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    applied_at TEXT,
-                    FOREIGN KEY(order_id) REFERENCES orders(id),
-                    FOREIGN KEY(package_id) REFERENCES volume_packages(id),
-                    FOREIGN KEY(user_id) REFERENCES users(id)
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversion_offer_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                service_id INTEGER NOT NULL,
+                previous_plan_id INTEGER,
+                previous_expire_at TEXT,
+                previous_remaining_volume REAL,
+                target_plan_id INTEGER,
+                new_service_id INTEGER,
+                status TEXT NOT NULL,
+                notification_sent_at TEXT,
+                viewed_at TEXT,
+                selected_at TEXT,
+                confirmed_at TEXT,
+                converted_at TEXT,
+                failure_reason TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                FOREIGN KEY(service_id) REFERENCES orders(id),
+                FOREIGN KEY(new_service_id) REFERENCES orders(id)
+            )
+            """)
 
-        cursor.execute("""
-                CREATE TABLE IF NOT EXISTS conversion_offer_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    service_id INTEGER NOT NULL,
-                    previous_plan_id INTEGER,
-                    previous_expire_at TEXT,
-                    previous_remaining_volume REAL,
-                    target_plan_id INTEGER,
-                    new_service_id INTEGER,
-                    status TEXT NOT NULL,
-                    notification_sent_at TEXT,
-                    viewed_at TEXT,
-                    selected_at TEXT,
-                    confirmed_at TEXT,
-                    converted_at TEXT,
-                    failure_reason TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(user_id) REFERENCES users(id),
-                    FOREIGN KEY(service_id) REFERENCES orders(id),
-                    FOREIGN KEY(new_service_id) REFERENCES orders(id)
-                )
-                """)
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS scheduler_runs (
+                job_name TEXT PRIMARY KEY,
+                last_status TEXT,
+                last_started_at TEXT,
+                last_finished_at TEXT,
+                last_success_at TEXT,
+                last_duration_ms INTEGER,
+                last_error TEXT,
+                run_count INTEGER NOT NULL DEFAULT 0,
+                failure_count INTEGER NOT NULL DEFAULT 0,
+                timeout_count INTEGER NOT NULL DEFAULT 0,
+                skipped_count INTEGER NOT NULL DEFAULT 0,
+                total_duration_ms INTEGER NOT NULL DEFAULT 0,
+                max_duration_ms INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT
+            )
+            """)
+
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS scheduler_leases (
+                job_name TEXT PRIMARY KEY,
+                owner TEXT,
+                fencing_token INTEGER NOT NULL DEFAULT 0,
+                acquired_at REAL,
+                heartbeat_at REAL,
+                expires_at REAL NOT NULL DEFAULT 0
+            )
+            """)
 
-        ensure_column("plans", "duration_days", "INTEGER")
-        ensure_column("plans", "category", "TEXT DEFAULT 'standard'")
-        ensure_column("plans", "access_level", "TEXT DEFAULT 'all'")
-        ensure_column("plans", "display_context", "TEXT DEFAULT 'all'")
-        ensure_column("plans", "is_archived", "INTEGER DEFAULT 0")
-        ensure_column("plans", "archived_at", "TEXT")
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ibs_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                payload TEXT,
+                idempotency_key TEXT UNIQUE,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                locked_by TEXT,
+                locked_until REAL,
+                last_error TEXT,
+                notify_user_id INTEGER,
+                description TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT
+            )
+            """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ibs_outbox_status ON ibs_outbox(status, next_attempt_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ibs_outbox_username ON ibs_outbox(username, status, id)")
 
-        ensure_column("bank_cards", "show_in_receipt", "INTEGER")
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS usage_history (
+                order_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                resolution_minutes INTEGER NOT NULL DEFAULT 0,
+                base_total_mb INTEGER NOT NULL DEFAULT 0,
+                last_total_mb INTEGER NOT NULL DEFAULT 0,
+                used_mb INTEGER NOT NULL DEFAULT 0,
+                sample_count INTEGER NOT NULL DEFAULT 0,
+                samples BLOB,
+                PRIMARY KEY (order_id, day)
+            )
+            """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_history_day ON usage_history(day, resolution_minutes)")
+
+    ledger_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'wallet_ledger'"
+    ).fetchone()
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS wallet_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                balance_after INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                ref_type TEXT,
+                ref_id INTEGER,
+                note TEXT,
+                idempotency_key TEXT UNIQUE,
+                created_at TEXT NOT NULL
+            )
+            """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallet_ledger_user ON wallet_ledger(user_id, id)")
+    if not ledger_exists:
+        # Open the ledger with each user's current balance so SUM(amount) always equals users.balance.
         cursor.execute("""
-            UPDATE bank_cards
-            SET show_in_receipt = COALESCE(is_active, 0)
-            WHERE show_in_receipt IS NULL
-        """)
+            INSERT INTO wallet_ledger (user_id, amount, balance_after, kind, created_at)
+            SELECT id, COALESCE(balance, 0), COALESCE(balance, 0), 'opening', ?
+            FROM users
+            WHERE COALESCE(balance, 0) != 0
+        """, (datetime.now().isoformat(sep=" ", timespec="seconds"),))
 
-        ensure_column("users", "last_name", "TEXT")
-        ensure_column("users", "message_name", "TEXT")
-        ensure_column("users", "referred_by", "INTEGER")
-        ensure_column("users", "max_active_accounts", "INTEGER DEFAULT 3")
-
-        order_column_definitions = [
-            ("volume_gb", "INTEGER DEFAULT 0"),
-            ("extra_volume_gb", "INTEGER DEFAULT 0"),
-            ("auto_renew", "INTEGER DEFAULT 0"),
-            ("usage_sent_mb", "INTEGER DEFAULT 0"),
-            ("usage_received_mb", "INTEGER DEFAULT 0"),
-            ("usage_total_mb", "INTEGER DEFAULT 0"),
-            ("usage_credit_mb", "INTEGER DEFAULT 0"),
-            ("overused_volume_gb", "REAL DEFAULT 0"),
-            ("remaining_volume_mb", "INTEGER DEFAULT 0"),
-            ("usage_last_update", "TEXT"),
-            ("usage_applied_speed", "TEXT"),
-            ("usage_notif_level", "INTEGER DEFAULT 0"),
-            ("usage_lock_applied", "INTEGER DEFAULT 0"),
-            ("eligible_for_conversion", "INTEGER DEFAULT 0"),
-            ("old_limited_service", "INTEGER DEFAULT 0"),
-            ("converted_by_offer", "INTEGER DEFAULT 0"),
-            ("converted_to_service_id", "INTEGER"),
-            ("replaced_from_service_id", "INTEGER"),
-            ("service_source", "TEXT"),
-            ("closed_by_conversion_at", "TEXT"),
-            ("last_conversion_notification_at", "TEXT"),
-            ("last_renewal_offer_notification_at", "TEXT"),
-        ]
-        for order_table in ("orders", ARCHIVE_TABLE_NAME):
-            for column_name, definition in order_column_definitions:
-                ensure_column(order_table, column_name, definition)
-        ensure_column(ARCHIVE_TABLE_NAME, "archived_at", "TEXT")
-        cursor.execute(
-            """
-            UPDATE orders
-            SET usage_credit_mb = 0
-            WHERE usage_credit_mb IS NULL
-            """
-        )
-        cursor.execute(
-            """
-            UPDATE orders
-            SET overused_volume_gb = ROUND(COALESCE(overused_volume_gb, 0) + (COALESCE(usage_credit_mb, 0) / 1024.0), 6)
-            WHERE COALESCE(usage_credit_mb, 0) > 0
-              AND COALESCE(overused_volume_gb, 0) = 0
-            """
-        )
-        cursor.execute(
-            """
-            UPDATE orders
-            SET overused_volume_gb = 0
-            WHERE overused_volume_gb IS NULL
-            """
-        )
-        cursor.execute(
-            """
-            UPDATE orders
-            SET usage_credit_mb = 0
-            WHERE COALESCE(usage_credit_mb, 0) != 0
-            """
-        )
+    ensure_column("plans", "duration_days", "INTEGER")
+    ensure_column("plans", "category", "TEXT DEFAULT 'standard'")
+    ensure_column("plans", "access_level", "TEXT DEFAULT 'all'")
+    ensure_column("plans", "display_context", "TEXT DEFAULT 'all'")
+    ensure_column("plans", "is_archived", "INTEGER DEFAULT 0")
+    ensure_column("plans", "archived_at", "TEXT")
+
+    ensure_column("bank_cards", "show_in_receipt", "INTEGER")
+    cursor.execute("""
+        UPDATE bank_cards
+        SET show_in_receipt = COALESCE(is_active, 0)
+        WHERE show_in_receipt IS NULL
+    """)
+
+    ensure_column("users", "last_name", "TEXT")
+    ensure_column("users", "message_name", "TEXT")
+    ensure_column("users", "referred_by", "INTEGER")
+    ensure_column("users", "max_active_accounts", "INTEGER DEFAULT 3")
+
+    order_column_definitions = [
+        ("volume_gb", "INTEGER DEFAULT 0"),
+        ("extra_volume_gb", "INTEGER DEFAULT 0"),
+        ("auto_renew", "INTEGER DEFAULT 0"),
+        ("usage_sent_mb", "INTEGER DEFAULT 0"),
+        ("usage_received_mb", "INTEGER DEFAULT 0"),
+        ("usage_total_mb", "INTEGER DEFAULT 0"),
+        ("usage_credit_mb", "INTEGER DEFAULT 0"),
+        ("overused_volume_gb", "REAL DEFAULT 0"),
+        ("remaining_volume_mb", "INTEGER DEFAULT 0"),
+        ("usage_last_update", "TEXT"),
+        ("usage_applied_speed", "TEXT"),
+        ("usage_notif_level", "INTEGER DEFAULT 0"),
+        ("usage_lock_applied", "INTEGER DEFAULT 0"),
+        ("eligible_for_conversion", "INTEGER DEFAULT 0"),
+        ("old_limited_service", "INTEGER DEFAULT 0"),
+        ("converted_by_offer", "INTEGER DEFAULT 0"),
+        ("converted_to_service_id", "INTEGER"),
+        ("replaced_from_service_id", "INTEGER"),
+        ("service_source", "TEXT"),
+        ("closed_by_conversion_at", "TEXT"),
+        ("last_conversion_notification_at", "TEXT"),
+        ("last_renewal_offer_notification_at", "TEXT"),
+        ("ibs_time_checked_at", "TEXT"),
+        ("ibs_time_check_attempts", "INTEGER DEFAULT 0"),
+        ("ibs_time_next_check_at", "TEXT"),
+        ("next_usage_refresh_at", "TEXT"),
+        ("usage_rate_history", "TEXT"),
+    ]
+    for order_table in ("orders", ARCHIVE_TABLE_NAME):
+        for column_name, definition in order_column_definitions:
+            ensure_column(order_table, column_name, definition)
+    ensure_column(ARCHIVE_TABLE_NAME, "archived_at", "TEXT")
+    cursor.execute(
+        """
+        UPDATE orders
+        SET usage_credit_mb = 0
+        WHERE usage_credit_mb IS NULL
+        """
+    )
+    cursor.execute(
+        """
+        UPDATE orders
+        SET overused_volume_gb = ROUND(COALESCE(overused_volume_gb, 0) + (COALESCE(usage_credit_mb, 0) / 1024.0), 6)
+        WHERE COALESCE(usage_credit_mb, 0) > 0
+          AND COALESCE(overused_volume_gb, 0) = 0
+        """
+    )
+    cursor.execute(
+        """
+        UPDATE orders
+        SET overused_volume_gb = 0
+        WHERE overused_volume_gb IS NULL
+        """
+    )
+    cursor.execute(
+        """
+        UPDATE orders
+        SET usage_credit_mb = 0
+        WHERE COALESCE(usage_credit_mb, 0) != 0
+        """
+    )
+    cursor.execute(
+        """
+        UPDATE orders
+        SET remaining_volume_mb = 0
+        WHERE remaining_volume_mb IS NULL
+        """
+    )
+    cursor.execute(
+        """
+        UPDATE orders
+        SET remaining_volume_mb = CASE
+            WHEN CAST(ROUND((COALESCE(volume_gb, 0) + COALESCE(extra_volume_gb, 0) + COALESCE(overused_volume_gb, 0)) * 1024, 0) AS INTEGER) > COALESCE(usage_total_mb, 0)
+            THEN CAST(ROUND((COALESCE(volume_gb, 0) + COALESCE(extra_volume_gb, 0) + COALESCE(overused_volume_gb, 0)) * 1024, 0) AS INTEGER) - COALESCE(usage_total_mb, 0)
+            ELSE 0
+        END
+        WHERE COALESCE(status, '') NOT IN ('archived', 'expired', 'renewed', 'canceled', 'converted')
+        """
+    )
+    cursor.execute(
+        """
+        UPDATE orders
+        SET remaining_volume_mb = 0
+        WHERE COALESCE(status, '') IN ('archived', 'expired', 'renewed', 'canceled', 'converted')
+        """
+    )
+
+    ensure_column("transactions", "amount_claimed", "INTEGER DEFAULT 0")
+    ensure_column("transactions", "destination_card_id", "INTEGER")
+    ensure_column("transactions", "destination_card_number", "TEXT")
+    ensure_column("transactions", "destination_card_owner", "TEXT")
+    ensure_column("transactions", "destination_bank_name", "TEXT")
+    ensure_column("transactions", "transfer_date", "TEXT")
+    ensure_column("transactions", "transfer_time", "TEXT")
+    ensure_column("transactions", "source_card_last4", "TEXT")
+    ensure_column("transactions", "submitted_at", "TEXT")
+    ensure_column("transactions", "duplicate_flags", "TEXT")
+    ensure_column("transactions", "duplicate_candidate_ids", "TEXT")
+    ensure_column("transactions", "is_duplicate_suspect", "INTEGER DEFAULT 0")
+    ensure_column("transactions", "admin_reviewed_at", "TEXT")
+    ensure_column("transactions", "admin_reviewed_by", "INTEGER")
+    ensure_column("transactions", "admin_note", "TEXT")
+    ensure_column("transactions", "accounting_reviewed_at", "TEXT")
+    ensure_column("transactions", "accounting_reviewed_by", "INTEGER")
+    ensure_column("transactions", "accounting_note", "TEXT")
+    ensure_column("transactions", "balance_reverted", "INTEGER DEFAULT 0")
+    ensure_column("transactions", "balance_reverted_at", "TEXT")
+    ensure_column("transactions", "balance_reverted_by", "INTEGER")
+    ensure_column("transactions", "balance_reverted_reason", "TEXT")
+
+    ensure_column("ownership_transfers", "username", "TEXT")
+    cursor.execute("""
+        UPDATE plans
+        SET access_level = 'all'
+        WHERE access_level IS NULL OR TRIM(access_level) = ''
+    """)
+    cursor.execute("""
+        UPDATE plans
+        SET display_context = 'all'
+        WHERE display_context IS NULL OR TRIM(display_context) = ''
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_segment_users_user_id ON segment_users(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_plan_segments_plan_id ON plan_segments(plan_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_plan_segments_segment_id ON plan_segments(segment_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_package_segments_package_id ON volume_package_segments(package_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_package_segments_segment_id ON volume_package_segments(segment_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_package_categories_package_id ON volume_package_categories(package_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_package_categories_category ON volume_package_categories(category)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_status_created_at ON transactions(status, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_photo_hash ON transactions(photo_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_username_status ON orders(username, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created_at ON orders(status, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_expires_at ON orders(status, expires_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_auto_renew_status_expires ON orders(auto_renew, status, expires_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_usage_refresh ON orders(status, next_usage_refresh_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_username_status ON orders_archive(username, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_status_created_at ON orders_archive(status, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_archived_at ON orders_archive(archived_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_conversion_eligibility ON orders(user_id, status, eligible_for_conversion)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_old_limited_service ON orders(old_limited_service)")
+    # A plain UNIQUE index is enough here: SQLite allows multiple NULL values,
+    # and this form is compatible with older SQLite builds that do not support partial indexes.
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_replaced_from_service_id ON orders(replaced_from_service_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_volume_allocations_order_id ON order_volume_allocations(order_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_volume_allocations_user_id ON order_volume_allocations(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_packages_archive_active ON volume_packages(is_archived, is_active)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversion_offer_logs_service_status ON conversion_offer_logs(service_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversion_offer_logs_user_status ON conversion_offer_logs(user_id, status)")
+    cursor.execute("DROP TABLE IF EXISTS speed_limits")
+
+    normalize_datetime_column("feedbacks", "created_at")
+    normalize_datetime_column("orders", "created_at")
+    normalize_datetime_column("orders_archive", "created_at")
+    normalize_datetime_column("transactions", "created_at")
+    normalize_datetime_column("transactions", "submitted_at")
+    normalize_datetime_column("transactions", "admin_reviewed_at")
+    normalize_datetime_column("transactions", "accounting_reviewed_at")
+    normalize_datetime_column("transactions", "balance_reverted_at")
+    normalize_datetime_column("users", "created_at")
+    normalize_datetime_column("ownership_transfers", "transferred_at")
+    normalize_datetime_column("orders", "closed_by_conversion_at")
+    normalize_datetime_column("orders", "last_conversion_notification_at")
+    normalize_datetime_column("orders", "last_renewal_offer_notification_at")
+    normalize_datetime_column("orders_archive", "closed_by_conversion_at")
+    normalize_datetime_column("orders_archive", "last_conversion_notification_at")
+    normalize_datetime_column("orders_archive", "last_renewal_offer_notification_at")
+    normalize_datetime_column("orders_archive", "archived_at")
+    normalize_datetime_column("segments", "created_at")
+    normalize_datetime_column("segment_users", "created_at")
+    normalize_datetime_column("plan_segments", "created_at")
+    normalize_datetime_column("volume_package_segments", "created_at")
+    normalize_datetime_column("volume_package_categories", "created_at")
+    normalize_datetime_column("volume_packages", "created_at")
+    normalize_datetime_column("volume_packages", "updated_at")
+    normalize_datetime_column("order_volume_allocations", "created_at")
+    normalize_datetime_column("order_volume_allocations", "applied_at")
+    normalize_datetime_column("conversion_offer_logs", "notification_sent_at")
+    normalize_datetime_column("conversion_offer_logs", "viewed_at")
+    normalize_datetime_column("conversion_offer_logs", "selected_at")
+    normalize_datetime_column("conversion_offer_logs", "confirmed_at")
+    normalize_datetime_column("conversion_offer_logs", "converted_at")
+    normalize_datetime_column("conversion_offer_logs", "created_at")
+    normalize_datetime_column("conversion_offer_logs", "updated_at")
+
+    immediate_placeholders = ", ".join("?" for _ in ARCHIVE_IMMEDIATE_STATUSES)
+    legacy_immediate_rows = cursor.execute(
+        f"SELECT id FROM orders WHERE COALESCE(status, '') IN ({immediate_placeholders})",
+        ARCHIVE_IMMEDIATE_STATUSES,
+    ).fetchall()
+    legacy_immediate_ids = [int(row[0]) for row in legacy_immediate_rows if int(row[0] or 0) > 0]
+    if legacy_immediate_ids:
+        _move_orders_to_archive(cursor, legacy_immediate_ids, archived_at=_now_text())
+
+
+def _migrate_runtime_settings(cursor: sqlite3.Cursor):
+    from services.runtime_settings import initialize_runtime_settings_schema
+
+    initialize_runtime_settings_schema(cursor)
+
+
+# Trigram full-text indexes behind the admin search boxes. rowid is the users/orders id, and
+# triggers keep them in step with the base tables. SQLite builds without FTS5 or the trigram
+# tokenizer (before 3.34) skip them and admin search keeps its LIKE scans.
+ADMIN_SEARCH_INDEXES = {
+    # index table: (base table, ((index column, base column), ...))
+    "users_search": ("users", (("user_id", "id"), ("first_name", "first_name"), ("last_name", "last_name"), ("username", "username"))),
+    "orders_search": ("orders", (("username", "username"),)),
+    "orders_archive_search": (ARCHIVE_TABLE_NAME, (("username", "username"),)),
+}
+ADMIN_SEARCH_MIN_CHARS = 3
+_admin_search_ready: Dict[str, bool] = {}
+
+
+def _admin_search_values(column_map, prefix: str = "") -> str:
+    return ", ".join(f"COALESCE({prefix}{base_column}, '')" for _, base_column in column_map)
+
+
+def _create_admin_search_index(cursor: sqlite3.Cursor, index_table: str) -> bool:
+    base_table, column_map = ADMIN_SEARCH_INDEXES[index_table]
+    column_list = ", ".join(index_column for index_column, _ in column_map)
+    try:
         cursor.execute(
-            """
-            UPDATE orders
-            SET remaining_volume_mb = 0
-            WHERE remaining_volume_mb IS NULL
-            """
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {index_table} USING fts5({column_list}, tokenize='trigram')"
         )
-        cursor.execute(
-            """
-            UPDATE orders
-            SET remaining_volume_mb = CASE
-                WHEN CAST(ROUND((COALESCE(volume_gb, 0) + COALESCE(extra_volume_gb, 0) + COALESCE(overused_volume_gb, 0)) * 1024, 0) AS INTEGER) > COALESCE(usage_total_mb, 0)
-                THEN CAST(ROUND((COALESCE(volume_gb, 0) + COALESCE(extra_volume_gb, 0) + COALESCE(overused_volume_gb, 0)) * 1024, 0) AS INTEGER) - COALESCE(usage_total_mb, 0)
-                ELSE 0
-            END
-            WHERE COALESCE(status, '') NOT IN ('archived', 'expired', 'renewed', 'canceled', 'converted')
-            """
+    except sqlite3.OperationalError as e:
+        print(f"admin search index {index_table} unavailable, keeping LIKE search: {e}")
+        return False
+
+    values = _admin_search_values(column_map, "new.")
+    watched = ", ".join(sorted({"id", *(base_column for _, base_column in column_map)}))
+    # Delete before insert: INSERT OR REPLACE (used by the archive move) does not fire delete triggers.
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {index_table}_ai AFTER INSERT ON {base_table} BEGIN
+            DELETE FROM {index_table} WHERE rowid = new.id;
+            INSERT INTO {index_table} (rowid, {column_list}) VALUES (new.id, {values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {index_table}_au AFTER UPDATE OF {watched} ON {base_table} BEGIN
+            DELETE FROM {index_table} WHERE rowid = old.id;
+            INSERT INTO {index_table} (rowid, {column_list}) VALUES (new.id, {values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {index_table}_ad AFTER DELETE ON {base_table} BEGIN
+            DELETE FROM {index_table} WHERE rowid = old.id;
+        END
+    """)
+    cursor.execute(f"DELETE FROM {index_table}")
+    cursor.execute(
+        f"INSERT INTO {index_table} (rowid, {column_list}) "
+        f"SELECT id, {_admin_search_values(column_map)} FROM {base_table}"
+    )
+    return True
+
+
+def _migrate_admin_search_index(cursor: sqlite3.Cursor):
+    for index_table in ADMIN_SEARCH_INDEXES:
+        _create_admin_search_index(cursor, index_table)
+    # Exact user id lookups in the archive search.
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_orders_archive_user_id ON {ARCHIVE_TABLE_NAME}(user_id)")
+    _admin_search_ready.clear()
+
+
+def _admin_search_index_ready(cursor: sqlite3.Cursor, index_table: str) -> bool:
+    ready = _admin_search_ready.get(index_table)
+    if ready is None:
+        ready = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (index_table,),
+        ).fetchone() is not None
+        _admin_search_ready[index_table] = ready
+    return ready
+
+
+def admin_search_match(cursor: sqlite3.Cursor, index_table: str, keyword: str, columns=None) -> Optional[str]:
+    """FTS5 MATCH expression for ``keyword`` on ``index_table``, or None when LIKE has to be used.
+
+    The trigram tokenizer needs at least three characters; shorter keywords and databases
+    without the index fall back to the callers' LIKE conditions.
+    """
+    clean = (keyword or "").strip()
+    if len(clean) < ADMIN_SEARCH_MIN_CHARS or not _admin_search_index_ready(cursor, index_table):
+        return None
+    phrase = '"' + clean.replace('"', '""') + '"'
+    if columns:
+        return "{" + " ".join(columns) + "} : " + phrase
+    return phrase
+
+
+def _migrate_admin_list_indexes(cursor: sqlite3.Cursor):
+    # Keyset pages in the admin user screens seek on (user_id, sort key, id) and stop after one
+    # page, so each list needs an index that already returns rows in display order.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id, id)")
+    try:
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_transactions_user_sort
+            ON transactions(user_id, COALESCE(submitted_at, created_at, ''), id)
+        """)
+    except sqlite3.OperationalError:
+        # Expression indexes need SQLite 3.9; the plain one still narrows the scan to one user.
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions(user_id, id)")
+
+
+def _migrate_db_maintenance_runs(cursor: sqlite3.Cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS db_maintenance_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            duration_ms INTEGER NOT NULL DEFAULT 0,
+            actions TEXT,
+            page_size INTEGER,
+            page_count_before INTEGER,
+            page_count_after INTEGER,
+            freelist_before INTEGER,
+            freelist_after INTEGER,
+            journal_mode TEXT,
+            auto_vacuum INTEGER,
+            error TEXT
         )
+    """)
+
+
+def _rebuild_with_text_username(cursor: sqlite3.Cursor, table: str):
+    # SQLite cannot change a column's declared type, so the table is rebuilt the documented way:
+    # create the new shape, copy, drop, rename, then recreate its indexes and triggers.
+    columns = cursor.execute(f'PRAGMA table_info("{table}")').fetchall()
+    if not columns or any(col[1] == "username" and str(col[2]).upper() == "TEXT" for col in columns):
+        return
+    create_sql = cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    dependents = [
+        row[0]
+        for row in cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+            (table,),
+        ).fetchall()
+    ]
+    sequence = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone() \
+        if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone() else None
+
+    new_table = f"{table}_text_username"
+    new_sql = re.sub(r'("?username"?\s+)INTEGER', r"\1TEXT", create_sql, count=1)
+    new_sql = re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?\w+"?', f"CREATE TABLE {new_table}", new_sql, count=1)
+    column_list = ", ".join(f'"{col[1]}"' for col in columns)
+    cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+    cursor.execute(new_sql)
+    # TEXT affinity stores the copied integers as their decimal text.
+    cursor.execute(f"INSERT INTO {new_table} ({column_list}) SELECT {column_list} FROM {table}")
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+    for sql in dependents:
+        cursor.execute(sql)
+    if sequence:
         cursor.execute(
-            """
-            UPDATE orders
-            SET remaining_volume_mb = 0
-            WHERE COALESCE(status, '') IN ('archived', 'expired', 'renewed', 'canceled', 'converted')
-            """
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?",
+            (int(sequence[0] or 0), table),
         )
 
-        ensure_column("transactions", "amount_claimed", "INTEGER DEFAULT 0")
-        ensure_column("transactions", "destination_card_id", "INTEGER")
-        ensure_column("transactions", "destination_card_number", "TEXT")
-        ensure_column("transactions", "destination_card_owner", "TEXT")
-        ensure_column("transactions", "destination_bank_name", "TEXT")
-        ensure_column("transactions", "transfer_date", "TEXT")
-        ensure_column("transactions", "transfer_time", "TEXT")
-        ensure_column("transactions", "source_card_last4", "TEXT")
-        ensure_column("transactions", "submitted_at", "TEXT")
-        ensure_column("transactions", "duplicate_flags", "TEXT")
-        ensure_column("transactions", "duplicate_candidate_ids", "TEXT")
-        ensure_column("transactions", "is_duplicate_suspect", "INTEGER DEFAULT 0")
-        ensure_column("transactions", "admin_reviewed_at", "TEXT")
-        ensure_column("transactions", "admin_reviewed_by", "INTEGER")
-        ensure_column("transactions", "admin_note", "TEXT")
-        ensure_column("transactions", "accounting_reviewed_at", "TEXT")
-        ensure_column("transactions", "accounting_reviewed_by", "INTEGER")
-        ensure_column("transactions", "accounting_note", "TEXT")
-        ensure_column("transactions", "balance_reverted", "INTEGER DEFAULT 0")
-        ensure_column("transactions", "balance_reverted_at", "TEXT")
-        ensure_column("transactions", "balance_reverted_by", "INTEGER")
-        ensure_column("transactions", "balance_reverted_reason", "TEXT")
-
-        ensure_column("ownership_transfers", "username", "TEXT")
-        cursor.execute("""
-            UPDATE plans
-            SET access_level = 'all'
-            WHERE access_level IS NULL OR TRIM(access_level) = ''
-        """)
-        cursor.execute("""
-            UPDATE plans
-            SET display_context = 'all'
-            WHERE display_context IS NULL OR TRIM(display_context) = ''
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_segment_users_user_id ON segment_users(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_plan_segments_plan_id ON plan_segments(plan_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_plan_segments_segment_id ON plan_segments(segment_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_package_segments_package_id ON volume_package_segments(package_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_package_segments_segment_id ON volume_package_segments(segment_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_package_categories_package_id ON volume_package_categories(package_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_package_categories_category ON volume_package_categories(category)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_status_created_at ON transactions(status, created_at)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_photo_hash ON transactions(photo_hash)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_username_status ON orders(username, status)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created_at ON orders(status, created_at)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_expires_at ON orders(status, expires_at)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_auto_renew_status_expires ON orders(auto_renew, status, expires_at)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_username_status ON orders_archive(username, status)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_status_created_at ON orders_archive(status, created_at)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_archived_at ON orders_archive(archived_at)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_conversion_eligibility ON orders(user_id, status, eligible_for_conversion)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_old_limited_service ON orders(old_limited_service)")
-        # A plain UNIQUE index is enough here: SQLite allows multiple NULL values,
-        # and this form is compatible with older SQLite builds that do not support partial indexes.
-        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_replaced_from_service_id ON orders(replaced_from_service_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_volume_allocations_order_id ON order_volume_allocations(order_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_volume_allocations_user_id ON order_volume_allocations(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_volume_packages_archive_active ON volume_packages(is_archived, is_active)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversion_offer_logs_service_status ON conversion_offer_logs(service_id, status)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversion_offer_logs_user_status ON conversion_offer_logs(user_id, status)")
-        cursor.execute("DROP TABLE IF EXISTS speed_limits")
-
-        normalize_datetime_column("feedbacks", "created_at")
-        normalize_datetime_column("orders", "created_at")
-        normalize_datetime_column("orders_archive", "created_at")
-        normalize_datetime_column("transactions", "created_at")
-        normalize_datetime_column("transactions", "submitted_at")
-        normalize_datetime_column("transactions", "admin_reviewed_at")
-        normalize_datetime_column("transactions", "accounting_reviewed_at")
-        normalize_datetime_column("transactions", "balance_reverted_at")
-        normalize_datetime_column("users", "created_at")
-        normalize_datetime_column("ownership_transfers", "transferred_at")
-        normalize_datetime_column("orders", "closed_by_conversion_at")
-        normalize_datetime_column("orders", "last_conversion_notification_at")
-        normalize_datetime_column("orders", "last_renewal_offer_notification_at")
-        normalize_datetime_column("orders_archive", "closed_by_conversion_at")
-        normalize_datetime_column("orders_archive", "last_conversion_notification_at")
-        normalize_datetime_column("orders_archive", "last_renewal_offer_notification_at")
-        normalize_datetime_column("orders_archive", "archived_at")
-        normalize_datetime_column("segments", "created_at")
-        normalize_datetime_column("segment_users", "created_at")
-        normalize_datetime_column("plan_segments", "created_at")
-        normalize_datetime_column("volume_package_segments", "created_at")
-        normalize_datetime_column("volume_package_categories", "created_at")
-        normalize_datetime_column("volume_packages", "created_at")
-        normalize_datetime_column("volume_packages", "updated_at")
-        normalize_datetime_column("order_volume_allocations", "created_at")
-        normalize_datetime_column("order_volume_allocations", "applied_at")
-        normalize_datetime_column("conversion_offer_logs", "notification_sent_at")
-        normalize_datetime_column("conversion_offer_logs", "viewed_at")
-        normalize_datetime_column("conversion_offer_logs", "selected_at")
-        normalize_datetime_column("conversion_offer_logs", "confirmed_at")
-        normalize_datetime_column("conversion_offer_logs", "converted_at")
-        normalize_datetime_column("conversion_offer_logs", "created_at")
-        normalize_datetime_column("conversion_offer_logs", "updated_at")
-
-        immediate_placeholders = ", ".join("?" for _ in ARCHIVE_IMMEDIATE_STATUSES)
-        legacy_immediate_rows = cursor.execute(
-            f"SELECT id FROM orders WHERE COALESCE(status, '') IN ({immediate_placeholders})",
-            ARCHIVE_IMMEDIATE_STATUSES,
+
+def _migrate_orders_username_text(cursor: sqlite3.Cursor):
+    # orders.username was declared INTEGER, so an account named '0123' was stored as 123 and only
+    # matched accounts.username through numeric comparison, which cannot use the accounts index.
+    # With TEXT affinity both sides compare as text and the join stays indexed.
+    for table in ("orders", ARCHIVE_TABLE_NAME):
+        _rebuild_with_text_username(cursor, table)
+
+    # Give rows of all-digit accounts with leading zeros their real name back. When the short
+    # form is also an account name the old value was ambiguous, and it is left alone.
+    accounts = {
+        row[0]
+        for row in cursor.execute(
+            "SELECT username FROM accounts WHERE username GLOB '[0-9]*' AND username NOT GLOB '*[^0-9]*'"
         ).fetchall()
-        legacy_immediate_ids = [int(row[0]) for row in legacy_immediate_rows if int(row[0] or 0) > 0]
-        if legacy_immediate_ids:
-            _move_orders_to_archive(cursor, legacy_immediate_ids, archived_at=_now_text())
+    }
+    for username in sorted(accounts):
+        stored = str(int(username))
+        if stored == username or stored in accounts:
+            continue
+        for table in ("orders", ARCHIVE_TABLE_NAME):
+            cursor.execute(f"UPDATE {table} SET username = ? WHERE username = ?", (username, stored))
+
+
+# Numbered schema steps, applied in order and recorded in PRAGMA user_version. Never edit or
+# renumber a released step: put new tables, columns, indexes and data fixes in a new one.
+# Steps must be idempotent (IF NOT EXISTS / ensure-style checks) because databases from before
+# the runner existed start at version 0 with most of the schema already in place. New keys in
+# SETTING_DEFINITIONS need no step (get_setting falls back to the default); re-run
+# _migrate_runtime_settings in a new step when existing values have to be rewritten.
+SCHEMA_MIGRATIONS = [
+    (1, "baseline schema", _migrate_baseline_schema),
+    (2, "runtime settings", _migrate_runtime_settings),
+    (3, "admin search index", _migrate_admin_search_index),
+    (4, "admin list indexes", _migrate_admin_list_indexes),
+    (5, "db maintenance runs", _migrate_db_maintenance_runs),
+    (6, "orders username as text", _migrate_orders_username_text),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+LAST_SCHEMA_REPORT: Dict = {}
+
+
+def get_schema_version() -> int:
+    with sqlite3.connect(DB_PATH) as conn:
+        return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def create_tables() -> Dict:
+    """Bring the database up to SCHEMA_VERSION; a database already there costs one pragma read."""
+    started = time.perf_counter()
+    applied = []
+    with sqlite3.connect(DB_PATH) as conn:
+        from_version = int(conn.execute("PRAGMA user_version").fetchone()[0])
+        for version, name, migrate in SCHEMA_MIGRATIONS:
+            if version <= from_version:
+                continue
+            step_started = time.perf_counter()
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                migrate(cursor)
+                # user_version lives in the database header, so it commits together with the step.
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append({"version": version, "name": name, "ms": int((time.perf_counter() - step_started) * 1000)})
+
+    LAST_SCHEMA_REPORT.clear()
+    LAST_SCHEMA_REPORT.update({
+        "from_version": from_version,
+        "version": max(from_version, SCHEMA_VERSION),
+        "applied": applied,
+        "ms": int((time.perf_counter() - started) * 1000),
+    })
+    return dict(LAST_SCHEMA_REPORT)
 
-        initialize_runtime_settings_schema(cursor)
-        conn.commit()
+
+def format_schema_report(report: Dict) -> str:
+    if not report:
+        return "not run"
+    text = f"schema v{report['version']} in {report['ms']}ms"
+    if report["applied"]:
+        steps = ", ".join(f"{step['version']} {step['name']} ({step['ms']}ms)" for step in report["applied"])
+        text += f", applied from v{report['from_version']}: {steps}"
+    else:
+        text += ", up to date"
+    return text
 
 
 def add_user(user_id, first_name, username, role):
@@ -1019,22 +1376,29 @@ def get_plan_segments(plan_id: int):
         return [dict(row) for row in cursor.fetchall()]
 
 
-def add_users_to_segment(segment_id: int, user_ids: List[int]) -> int:
-    cleaned_ids = sorted({int(user_id) for user_id in user_ids})
-    if not cleaned_ids:
-        return 0
+def _insert_segment_members(conn: sqlite3.Connection, segment_id: int, user_ids: List[int]) -> int:
+    before = conn.total_changes
+    conn.executemany("""
+        INSERT OR IGNORE INTO segment_users (segment_id, user_id)
+        VALUES (?, ?)
+    """, [(segment_id, user_id) for user_id in user_ids])
+    return conn.total_changes - before
+
 
+def add_users_to_segment(segment_id: int, user_ids: Iterable[int], chunk_size: int = 1000) -> int:
+    """Add members in chunks of ``chunk_size``; ``user_ids`` may be a generator over a large upload."""
+    total_added = 0
     with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        total_added = 0
-        for user_id in cleaned_ids:
-            cursor.execute("""
-                INSERT OR IGNORE INTO segment_users (segment_id, user_id)
-                VALUES (?, ?)
-            """, (segment_id, user_id))
-            total_added += cursor.rowcount
+        chunk: List[int] = []
+        for user_id in user_ids:
+            chunk.append(int(user_id))
+            if len(chunk) >= chunk_size:
+                total_added += _insert_segment_members(conn, segment_id, chunk)
+                chunk = []
+        if chunk:
+            total_added += _insert_segment_members(conn, segment_id, chunk)
         conn.commit()
-        return total_added
+    return total_added
 
 
 def remove_users_from_segment(segment_id: int, user_ids: List[int]) -> int:
@@ -1110,58 +1474,80 @@ def update_plan_display_context(plan_id: int, display_context: str):
 
 
 def resolve_user_identifiers(identifiers: List[str], include_offline: bool = True):
-    resolved: List[Dict] = []
-    missing: List[str] = []
-    seen_user_ids = set()
+    # Admins paste thousands of ids and usernames at once. Load them into temp tables and
+    # resolve each kind with one query instead of one SELECT per token.
+    tokens = []
+    for raw_identifier in identifiers:
+        token = (raw_identifier or "").strip()
+        if token:
+            tokens.append(token)
+    if not tokens:
+        return [], []
+
+    user_filter = ""
+    filter_params: List = []
+    if not include_offline:
+        user_filter = "AND u.id > 0 AND COALESCE(u.role, '') != ?"
+        filter_params.append(OFFLINE_USER_ROLE)
 
+    by_id: Dict[int, Dict] = {}
+    by_username: Dict[str, Dict] = {}
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
+        cursor.execute("CREATE TEMP TABLE resolve_ids (id INTEGER PRIMARY KEY)")
+        cursor.execute("CREATE TEMP TABLE resolve_usernames (token TEXT PRIMARY KEY, name TEXT)")
+        cursor.executemany(
+            "INSERT OR IGNORE INTO temp.resolve_ids (id) VALUES (?)",
+            [(int(token),) for token in tokens if token.lstrip("-").isdigit()],
+        )
+        # LOWER() in SQL, not str.lower(): it has to fold case exactly like the users side.
+        cursor.executemany(
+            "INSERT OR IGNORE INTO temp.resolve_usernames (token, name) VALUES (?, LOWER(?))",
+            [(token, token.lstrip("@")) for token in tokens if not token.lstrip("-").isdigit()],
+        )
+        cursor.execute("CREATE INDEX temp.idx_resolve_usernames_name ON resolve_usernames(name)")
 
-        for raw_identifier in identifiers:
-            token = (raw_identifier or "").strip()
-            if not token:
-                continue
-
-            row = None
-            if token.lstrip("-").isdigit():
-                query = """
-                    SELECT id, first_name, last_name, username, role
-                    FROM users
-                    WHERE id = ?
-                """
-                params = [int(token)]
-                if not include_offline:
-                    query += "\nAND id > 0 AND COALESCE(role, '') != ?"
-                    params.append(OFFLINE_USER_ROLE)
-                query += "\nLIMIT 1"
-                cursor.execute(query, params)
-                row = cursor.fetchone()
-            else:
-                username = token.lstrip("@")
-                query = """
-                    SELECT id, first_name, last_name, username, role
-                    FROM users
-                    WHERE LOWER(username) = LOWER(?)
-                """
-                params = [username]
-                if not include_offline:
-                    query += "\nAND id > 0 AND COALESCE(role, '') != ?"
-                    params.append(OFFLINE_USER_ROLE)
-                query += "\nLIMIT 1"
-                cursor.execute(query, params)
-                row = cursor.fetchone()
-
-            if row is None:
-                missing.append(token)
-                continue
+        cursor.execute(f"""
+            SELECT u.id, u.first_name, u.last_name, u.username, u.role
+            FROM users u
+            WHERE u.id IN (SELECT id FROM temp.resolve_ids)
+            {user_filter}
+        """, filter_params)
+        for row in cursor.fetchall():
+            by_id[row["id"]] = dict(row)
 
+        # Several accounts can share a username in different case; keep the oldest like before.
+        cursor.execute(f"""
+            SELECT r.token, u.id, u.first_name, u.last_name, u.username, u.role
+            FROM users u
+            JOIN temp.resolve_usernames r ON r.name = LOWER(u.username)
+            WHERE 1 = 1
+            {user_filter}
+            ORDER BY u.id DESC
+        """, filter_params)
+        for row in cursor.fetchall():
             row_dict = dict(row)
-            if row_dict["id"] in seen_user_ids:
-                continue
+            by_username[row_dict.pop("token")] = row_dict
+
+        cursor.execute("DROP TABLE temp.resolve_ids")
+        cursor.execute("DROP TABLE temp.resolve_usernames")
 
-            seen_user_ids.add(row_dict["id"])
-            resolved.append(row_dict)
+    resolved: List[Dict] = []
+    missing: List[str] = []
+    seen_user_ids = set()
+    for token in tokens:
+        if token.lstrip("-").isdigit():
+            row_dict = by_id.get(int(token))
+        else:
+            row_dict = by_username.get(token)
+        if row_dict is None:
+            missing.append(token)
+            continue
+        if row_dict["id"] in seen_user_ids:
+            continue
+        seen_user_ids.add(row_dict["id"])
+        resolved.append(dict(row_dict))
 
     return resolved, missing
 
@@ -1171,16 +1557,30 @@ def search_users_for_admin(keyword: str, limit: int = 10, include_offline: bool
     if not clean:
         return []
 
-    like_value = f"%{clean.lstrip('@')}%"
+    term = clean.lstrip("@")
+    like_value = f"%{term}%"
     offline_filter = "" if include_offline else "AND u.id > 0 AND COALESCE(u.role, '') != ?"
-    params: list = [clean.lstrip("@"), like_value, like_value, like_value, like_value]
-    if not include_offline:
-        params.append(OFFLINE_USER_ROLE)
-    params.append(int(limit))
 
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
+        match = admin_search_match(cursor, "users_search", term)
+        if match:
+            keyword_filter = "u.id IN (SELECT rowid FROM users_search WHERE users_search MATCH ?)"
+            params: list = [match]
+        else:
+            keyword_filter = """
+                   CAST(u.id AS TEXT) = ?
+                OR CAST(u.id AS TEXT) LIKE ?
+                OR LOWER(COALESCE(u.first_name, '')) LIKE LOWER(?)
+                OR LOWER(COALESCE(u.last_name, '')) LIKE LOWER(?)
+                OR LOWER(COALESCE(u.username, '')) LIKE LOWER(?)
+            """
+            params = [term, like_value, like_value, like_value, like_value]
+        if not include_offline:
+            params.append(OFFLINE_USER_ROLE)
+        params.append(int(limit))
+
         cursor.execute(
             f"""
             SELECT
@@ -1191,13 +1591,7 @@ def search_users_for_admin(keyword: str, limit: int = 10, include_offline: bool
                 u.role,
                 COALESCE(u.balance, 0) AS balance
             FROM users u
-            WHERE (
-                   CAST(u.id AS TEXT) = ?
-                OR CAST(u.id AS TEXT) LIKE ?
-                OR LOWER(COALESCE(u.first_name, '')) LIKE LOWER(?)
-                OR LOWER(COALESCE(u.last_name, '')) LIKE LOWER(?)
-                OR LOWER(COALESCE(u.username, '')) LIKE LOWER(?)
-            )
+            WHERE ({keyword_filter})
             {offline_filter}
             ORDER BY
                 CASE WHEN u.id > 0 THEN 0 ELSE 1 END,
@@ -1209,76 +1603,72 @@ def search_users_for_admin(keyword: str, limit: int = 10, include_offline: bool
         return [dict(row) for row in cursor.fetchall()]
 
 
-def get_all_user_ids_for_messaging() -> List[int]:
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT id
-            FROM users
-            WHERE id > 0
-              AND COALESCE(role, '') != ?
-            ORDER BY id ASC
-            """,
-            (OFFLINE_USER_ROLE,),
-        )
-        return [int(row[0]) for row in cursor.fetchall()]
+def _messaging_audience_query(audience: Dict):
+    """FROM/WHERE clause, user id column and params for a broadcast audience definition.
+
+    ``audience`` is what the messaging FSM stores: ``{"kind": "all"}``, ``{"kind": "user",
+    "user_id": ...}``, ``{"kind": "min_balance", "min_balance": ...}`` or ``{"kind": "segments",
+    "segment_ids": [...], "only_active_segments": True}``. Offline users never receive messages.
+    """
+    kind = audience.get("kind")
+    if kind == "segments":
+        cleaned_ids = sorted({int(segment_id) for segment_id in audience.get("segment_ids") or []}) or [0]
+        placeholders = ", ".join("?" for _ in cleaned_ids)
+        active_join = ""
+        if audience.get("only_active_segments", True):
+            active_join = "JOIN segments s ON s.id = su.segment_id AND COALESCE(s.is_active, 1) = 1"
+        return f"""
+            FROM segment_users su
+            {active_join}
+            JOIN users u ON u.id = su.user_id
+            WHERE su.segment_id IN ({placeholders})
+              AND su.user_id > 0
+              AND COALESCE(u.role, '') != ?
+        """, "su.user_id", [*cleaned_ids, OFFLINE_USER_ROLE]
+
+    clause = """
+        FROM users u
+        WHERE u.id > 0
+          AND COALESCE(u.role, '') != ?
+    """
+    params: List = [OFFLINE_USER_ROLE]
+    if kind == "user":
+        clause += "  AND u.id = ?\n"
+        params.append(int(audience.get("user_id") or 0))
+    elif kind == "min_balance":
+        clause += "  AND COALESCE(u.balance, 0) >= ?\n"
+        params.append(int(audience.get("min_balance") or 0))
+    elif kind != "all":
+        raise ValueError(f"unknown messaging audience: {kind!r}")
+    return clause, "u.id", params
 
 
-def get_user_ids_by_min_balance(min_balance: int) -> List[int]:
+def count_messaging_audience(audience: Dict) -> int:
+    clause, id_column, params = _messaging_audience_query(audience)
     with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT id
-            FROM users
-            WHERE COALESCE(balance, 0) >= ?
-              AND id > 0
-              AND COALESCE(role, '') != ?
-            ORDER BY COALESCE(balance, 0) DESC, id ASC
-            """,
-            (int(min_balance), OFFLINE_USER_ROLE),
-        )
-        return [int(row[0]) for row in cursor.fetchall()]
+        row = conn.execute(f"SELECT COUNT(DISTINCT {id_column}) {clause}", params).fetchone()
+        return int(row[0] or 0) if row else 0
 
 
-def get_user_ids_by_segment_ids(segment_ids: List[int], only_active_segments: bool = True) -> List[int]:
-    cleaned_ids = sorted({int(segment_id) for segment_id in segment_ids})
-    if not cleaned_ids:
-        return []
+def iter_messaging_audience(audience: Dict, chunk_size: int = 500):
+    """Yield the audience's user ids in ascending chunks of at most ``chunk_size``.
 
-    placeholders = ", ".join("?" for _ in cleaned_ids)
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        if only_active_segments:
-            cursor.execute(
-                f"""
-                SELECT DISTINCT su.user_id
-                FROM segment_users su
-                JOIN segments s ON s.id = su.segment_id
-                JOIN users u ON u.id = su.user_id
-                WHERE su.segment_id IN ({placeholders})
-                  AND COALESCE(s.is_active, 1) = 1
-                  AND su.user_id > 0
-                  AND COALESCE(u.role, '') != ?
-                ORDER BY su.user_id ASC
-                """,
-                [*cleaned_ids, OFFLINE_USER_ROLE],
-            )
-        else:
-            cursor.execute(
-                f"""
-                SELECT DISTINCT su.user_id
-                FROM segment_users su
-                JOIN users u ON u.id = su.user_id
-                WHERE su.segment_id IN ({placeholders})
-                  AND su.user_id > 0
-                  AND COALESCE(u.role, '') != ?
-                ORDER BY su.user_id ASC
-                """,
-                [*cleaned_ids, OFFLINE_USER_ROLE],
-            )
-        return [int(row[0]) for row in cursor.fetchall()]
+    Each chunk is its own short query that resumes after the last id sent, so a broadcast
+    that runs for an hour never holds a read transaction open, and users who join or leave
+    the audience meanwhile are picked up or skipped as the walk reaches them.
+    """
+    clause, id_column, params = _messaging_audience_query(audience)
+    query = f"SELECT DISTINCT {id_column} {clause} AND {id_column} > ? ORDER BY {id_column} ASC LIMIT ?"
+    last_id = 0
+    while True:
+        with sqlite3.connect(DB_PATH) as conn:
+            chunk = [int(row[0]) for row in conn.execute(query, [*params, last_id, int(chunk_size)]).fetchall()]
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]
 
 
 def get_all_plans_for_admin_audience():
@@ -1387,10 +1777,12 @@ def insert_renewed_order_with_auto_renew(user_id, plan_id, username, price, stat
         return order_id
 
 
-def update_user_balance(user_id, new_balance):
+def update_user_balance(user_id, new_balance, kind="balance_set", note=None):
+    # Prefer services.wallet debit/credit; this absolute setter is kept for admin edits and
+    # records the difference in the ledger.
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE users SET balance = ? WHERE id = ?", (new_balance, user_id))
+        set_wallet_balance(cursor, user_id, new_balance, kind=kind, note=note)
         conn.commit()
 
 
@@ -1655,23 +2047,54 @@ def get_active_orders_without_time() -> List[Dict]:
     return [dict(row) for row in rows]
 
 
+def record_order_time_check(order_id: int, checked_at: str, attempts: int, next_check_at: Optional[str]):
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.execute("""
+            UPDATE orders
+            SET ibs_time_checked_at = ?,
+                ibs_time_check_attempts = ?,
+                ibs_time_next_check_at = ?
+            WHERE id = ?
+        """, (checked_at, attempts, next_check_at, order_id))
+        conn.commit()
+
+
+def mark_orders_time_checked(order_ids: List[int], checked_at: str):
+    """Move the "no login since" mark forward without touching attempts or backoff."""
+    if not order_ids:
+        return
+    with sqlite3.connect(DB_PATH) as conn:
+        for start in range(0, len(order_ids), 500):
+            chunk = order_ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            conn.execute(
+                f"UPDATE orders SET ibs_time_checked_at = ? WHERE id IN ({placeholders})",
+                (checked_at, *chunk),
+            )
+        conn.commit()
+
+
 def update_order_starts_at(order_id: int, starts_at: str):
+    # Clearing next_usage_refresh_at puts the order at the head of the usage queue.
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("""
                     UPDATE orders
-                    SET starts_at = ?
+                    SET starts_at = ?,
+                        next_usage_refresh_at = NULL
                     WHERE id = ?
                 """, (starts_at, order_id))
         conn.commit()
 
 
 def update_order_expires_at(order_id: int, expires_at: str):
+    # Clearing next_usage_refresh_at puts the order at the head of the usage queue.
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("""
                     UPDATE orders
-                    SET expires_at = ?
+                    SET expires_at = ?,
+                        next_usage_refresh_at = NULL
                     WHERE id = ?
                 """, (expires_at, order_id))
         conn.commit()
@@ -1744,11 +2167,13 @@ def archive_old_orders():
     ).fetchall()
     to_archive_ids.extend(int(row["id"]) for row in immediate_rows if int(row["id"] or 0) > 0)
 
+    moved = 0
     if to_archive_ids:
-        _move_orders_to_archive(cursor, to_archive_ids, archived_at=_now_text())
+        moved = _move_orders_to_archive(cursor, to_archive_ids, archived_at=_now_text())
 
     conn.commit()
     conn.close()
+    return moved
 
 
 def get_active_orders():
@@ -1901,10 +2326,22 @@ def search_orders_for_admin(keyword: str, limit: int = 30, archived_only: bool =
 
     like_value = f"%{clean}%"
     source_table = ARCHIVE_TABLE_NAME if archived_only else "orders"
+    index_table = "orders_archive_search" if archived_only else "orders_search"
     status_filter = "1 = 1" if archived_only else "COALESCE(o.status, '') != 'archived'"
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
+        match = admin_search_match(cursor, index_table, clean)
+        if match:
+            conditions = [f"o.id IN (SELECT rowid FROM {index_table} WHERE {index_table} MATCH ?)"]
+            params: list = [match]
+        else:
+            conditions = ["LOWER(COALESCE(o.username, '')) LIKE LOWER(?)"]
+            params = [like_value]
+        if clean.isdigit():
+            # Kept as separate terms so each one can use its own index.
+            conditions += ["o.id = ?", "o.user_id = ?"]
+            params += [int(clean), int(clean)]
         cursor.execute(f"""
             SELECT
                 o.id,
@@ -1921,15 +2358,11 @@ def search_orders_for_admin(keyword: str, limit: int = 30, archived_only: bool =
             FROM {source_table} o
             LEFT JOIN plans p ON p.id = o.plan_id
             LEFT JOIN users u ON u.id = o.user_id
-            WHERE (
-                   CAST(o.id AS TEXT) = ?
-                OR CAST(o.user_id AS TEXT) = ?
-                OR LOWER(COALESCE(o.username, '')) LIKE LOWER(?)
-            )
-              AND """ + status_filter + """
+            WHERE ({" OR ".join(conditions)})
+              AND {status_filter}
             ORDER BY o.id ASC
             LIMIT ?
-        """, (clean, clean, like_value, int(limit)))
+        """, (*params, int(limit)))
         return [dict(row) for row in cursor.fetchall()]
 
 
@@ -3005,7 +3438,26 @@ def search_accounts_for_admin_transfer(keyword: str, limit: int = 20) -> List[Di
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("""
+        order_match = admin_search_match(cursor, "orders_search", clean)
+        user_match = admin_search_match(cursor, "users_search", clean, columns=("first_name", "last_name", "username"))
+        if order_match and user_match:
+            conditions = [
+                "o.id IN (SELECT rowid FROM orders_search WHERE orders_search MATCH ?)",
+                "o.user_id IN (SELECT rowid FROM users_search WHERE users_search MATCH ?)",
+            ]
+            params: list = [order_match, user_match]
+        else:
+            conditions = [
+                "LOWER(COALESCE(o.username, '')) LIKE LOWER(?)",
+                "LOWER(COALESCE(u.username, '')) LIKE LOWER(?)",
+                "LOWER(COALESCE(u.first_name, '')) LIKE LOWER(?)",
+                "LOWER(COALESCE(u.last_name, '')) LIKE LOWER(?)",
+            ]
+            params = [like_value] * 4
+        if clean.isdigit():
+            conditions += ["o.id = ?", "o.user_id = ?"]
+            params += [int(clean), int(clean)]
+        cursor.execute(f"""
             SELECT
                 MAX(o.id) AS representative_order_id,
                 o.user_id,
@@ -3020,18 +3472,11 @@ def search_accounts_for_admin_transfer(keyword: str, limit: int = 20) -> List[Di
             WHERE o.username IS NOT NULL
               AND TRIM(CAST(o.username AS TEXT)) != ''
               AND COALESCE(o.status, '') NOT IN ('archived', 'renewed', 'converted')
-              AND (
-                     CAST(o.id AS TEXT) = ?
-                  OR CAST(o.user_id AS TEXT) = ?
-                  OR LOWER(COALESCE(o.username, '')) LIKE LOWER(?)
-                  OR LOWER(COALESCE(u.username, '')) LIKE LOWER(?)
-                  OR LOWER(COALESCE(u.first_name, '')) LIKE LOWER(?)
-                  OR LOWER(COALESCE(u.last_name, '')) LIKE LOWER(?)
-              )
+              AND ({" OR ".join(conditions)})
             GROUP BY o.user_id, o.username
             ORDER BY MAX(o.id) DESC
             LIMIT ?
-        """, (clean, clean, like_value, like_value, like_value, like_value, int(limit)))
+        """, (*params, int(limit)))
         return [dict(row) for row in cursor.fetchall()]
 
 
@@ -3131,3 +3576,153 @@ def transfer_orders_by_username_to_another_user(
         conn.commit()
         return True, None, total_orders
 
+
+def record_scheduler_run(
+    job_name: str,
+    status: str,
+    started_at: str,
+    finished_at: str,
+    duration_ms: Optional[int] = None,
+    error: Optional[str] = None,
+):
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO scheduler_runs (job_name) VALUES (?)", (job_name,))
+        if status == "skipped":
+            cursor.execute("""
+                UPDATE scheduler_runs
+                SET skipped_count = skipped_count + 1,
+                    updated_at = ?
+                WHERE job_name = ?
+            """, (finished_at, job_name))
+        else:
+            duration = int(duration_ms or 0)
+            cursor.execute("""
+                UPDATE scheduler_runs
+                SET last_status = ?,
+                    last_started_at = ?,
+                    last_finished_at = ?,
+                    last_success_at = CASE WHEN ? = 'ok' THEN ? ELSE last_success_at END,
+                    last_duration_ms = ?,
+                    last_error = ?,
+                    run_count = run_count + 1,
+                    failure_count = failure_count + CASE WHEN ? = 'error' THEN 1 ELSE 0 END,
+                    timeout_count = timeout_count + CASE WHEN ? = 'timeout' THEN 1 ELSE 0 END,
+                    total_duration_ms = total_duration_ms + ?,
+                    max_duration_ms = MAX(max_duration_ms, ?),
+                    updated_at = ?
+                WHERE job_name = ?
+            """, (
+                status, started_at, finished_at, status, finished_at, duration, error,
+                status, status, duration, duration, finished_at, job_name,
+            ))
+        conn.commit()
+
+
+def get_scheduler_runs() -> List[Dict]:
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT *
+            FROM scheduler_runs
+            ORDER BY job_name ASC
+        """)
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def acquire_job_lease(job_name: str, owner: str, ttl_seconds: float) -> Optional[int]:
+    """Take (or keep) the lease for ``job_name``; return its fencing token, or None if another owner holds it.
+
+    The token only grows when ownership changes hands, so a stale holder can be told apart
+    from the current one even if both believe they own the job.
+    """
+    now = time.time()
+    expires_at = now + float(ttl_seconds)
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR IGNORE INTO scheduler_leases (job_name, fencing_token, expires_at) VALUES (?, 0, 0)",
+            (job_name,),
+        )
+        cursor.execute("""
+            UPDATE scheduler_leases
+            SET fencing_token = CASE WHEN owner = ? AND expires_at > ? THEN fencing_token ELSE fencing_token + 1 END,
+                acquired_at = CASE WHEN owner = ? AND expires_at > ? THEN acquired_at ELSE ? END,
+                owner = ?,
+                heartbeat_at = ?,
+                expires_at = ?
+            WHERE job_name = ?
+              AND (owner IS NULL OR owner = ? OR expires_at <= ?)
+        """, (owner, now, owner, now, now, owner, now, expires_at, job_name, owner, now))
+        if cursor.rowcount != 1:
+            conn.commit()
+            return None
+        cursor.execute("SELECT fencing_token FROM scheduler_leases WHERE job_name = ?", (job_name,))
+        token = cursor.fetchone()[0]
+        conn.commit()
+        return int(token)
+
+
+def renew_job_lease(job_name: str, owner: str, fencing_token: int, ttl_seconds: float) -> bool:
+    now = time.time()
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE scheduler_leases
+            SET heartbeat_at = ?,
+                expires_at = ?
+            WHERE job_name = ?
+              AND owner = ?
+              AND fencing_token = ?
+              AND expires_at > ?
+        """, (now, now + float(ttl_seconds), job_name, owner, fencing_token, now))
+        conn.commit()
+        return cursor.rowcount == 1
+
+
+def release_job_lease(job_name: str, owner: str, fencing_token: int) -> bool:
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE scheduler_leases
+            SET owner = NULL,
+                expires_at = 0
+            WHERE job_name = ?
+              AND owner = ?
+              AND fencing_token = ?
+        """, (job_name, owner, fencing_token))
+        conn.commit()
+        return cursor.rowcount == 1
+
+
+def is_job_lease_current(job_name: str, owner: str, fencing_token: int,
+                         cursor: Optional[sqlite3.Cursor] = None) -> bool:
+    """With ``cursor`` the check runs inside the caller's transaction instead of its own connection."""
+    if cursor is None:
+        with sqlite3.connect(DB_PATH) as conn:
+            return is_job_lease_current(job_name, owner, fencing_token, conn.cursor())
+    cursor.execute("""
+        SELECT 1
+        FROM scheduler_leases
+        WHERE job_name = ?
+          AND owner = ?
+          AND fencing_token = ?
+          AND expires_at > ?
+    """, (job_name, owner, fencing_token, time.time()))
+    return cursor.fetchone() is not None
+
+
+def get_job_leases() -> List[Dict]:
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT *
+            FROM scheduler_leases
+            ORDER BY job_name ASC
+        """)
+        return [dict(row) for row in cursor.fetchall()]
+
+
+instrument_functions(globals(), SQLITE_CALL, "function")
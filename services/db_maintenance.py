@@ -0,0 +1,169 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from config import DB_ANALYZE_EVERY_DAYS, DB_PATH, DB_VACUUM_FREE_PERCENT
+
+# Nightly upkeep of the SQLite file, run by the "db_maintenance" scheduler job in the quiet
+# hours. Archiving deletes order rows all day and the transaction and offer logs only grow, so:
+#   * PRAGMA optimize every night and a full ANALYZE every DB_ANALYZE_EVERY_DAYS keep the
+#     planner's statistics current;
+#   * free pages are returned to the OS with incremental_vacuum once the file uses
+#     auto_vacuum=INCREMENTAL. A file created without it is converted by one full VACUUM the
+#     first night its free list passes DB_VACUUM_FREE_PERCENT;
+#   * in WAL mode the log is checkpointed and truncated.
+# Every run is stored in db_maintenance_runs for the admin environment report.
+
+AUTO_VACUUM_INCREMENTAL = 2
+KEEP_RUNS = 60
+
+
+def _connect() -> sqlite3.Connection:
+    # isolation_level=None: VACUUM and incremental_vacuum cannot run inside a transaction.
+    return sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+
+
+def page_stats(conn: sqlite3.Connection) -> Dict:
+    return {
+        "page_size": int(conn.execute("PRAGMA page_size").fetchone()[0]),
+        "page_count": int(conn.execute("PRAGMA page_count").fetchone()[0]),
+        "freelist": int(conn.execute("PRAGMA freelist_count").fetchone()[0]),
+        "auto_vacuum": int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]),
+        "journal_mode": str(conn.execute("PRAGMA journal_mode").fetchone()[0]),
+    }
+
+
+def incremental_vacuum(max_pages: int = 0) -> int:
+    """Release up to ``max_pages`` free pages (0 = all); a no-op unless auto_vacuum is INCREMENTAL."""
+    conn = _connect()
+    try:
+        stats = page_stats(conn)
+        if stats["auto_vacuum"] != AUTO_VACUUM_INCREMENTAL or not stats["freelist"]:
+            return 0
+        conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+        return stats["freelist"] - int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+    finally:
+        conn.close()
+
+
+def _last_full_analyze(conn: sqlite3.Connection) -> Optional[str]:
+    row = conn.execute("""
+        SELECT MAX(started_at)
+        FROM db_maintenance_runs
+        WHERE (',' || actions) LIKE '%,analyze:%'
+          AND error IS NULL
+    """).fetchone()
+    return row[0] if row else None
+
+
+def run_db_maintenance(force_analyze: bool = False) -> Dict:
+    started = time.perf_counter()
+    started_at = datetime.now().isoformat(sep=" ", timespec="seconds")
+    timings: Dict[str, int] = {}
+    error = None
+
+    conn = _connect()
+    try:
+        before = page_stats(conn)
+
+        def timed(action: str, sql: str):
+            step_started = time.perf_counter()
+            result = conn.execute(sql).fetchall()
+            timings[action] = int((time.perf_counter() - step_started) * 1000)
+            return result
+
+        try:
+            # 0x10002: look at every table, not only the ones this fresh connection has queried.
+            timed("optimize", "PRAGMA optimize=0x10002")
+
+            last_analyze = _last_full_analyze(conn)
+            due = (datetime.now() - timedelta(days=DB_ANALYZE_EVERY_DAYS)).isoformat(sep=" ", timespec="seconds")
+            if force_analyze or not last_analyze or last_analyze < due:
+                timed("analyze", "ANALYZE")
+
+            free_percent = before["freelist"] * 100 / before["page_count"] if before["page_count"] else 0
+            if before["auto_vacuum"] == AUTO_VACUUM_INCREMENTAL:
+                if before["freelist"]:
+                    timed("incremental_vacuum", "PRAGMA incremental_vacuum")
+            elif free_percent >= DB_VACUUM_FREE_PERCENT:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                timed("vacuum", "VACUUM")
+
+            if before["journal_mode"].lower() == "wal":
+                busy, log_pages, checkpointed = timed("checkpoint", "PRAGMA wal_checkpoint(TRUNCATE)")[0]
+                if busy:
+                    print(f"WAL checkpoint was blocked by readers ({checkpointed}/{log_pages} pages copied).")
+        except sqlite3.Error as exc:
+            error = f"{type(exc).__name__}: {exc}"[:300]
+            print(f"Database maintenance failed: {error}")
+
+        after = page_stats(conn)
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        conn.execute("""
+            INSERT INTO db_maintenance_runs (
+                started_at, duration_ms, actions, page_size, page_count_before, page_count_after,
+                freelist_before, freelist_after, journal_mode, auto_vacuum, error
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            started_at, duration_ms,
+            ",".join(f"{action}:{timings[action]}ms" for action in timings),
+            after["page_size"], before["page_count"], after["page_count"],
+            before["freelist"], after["freelist"], after["journal_mode"], after["auto_vacuum"], error,
+        ))
+        conn.execute("""
+            DELETE FROM db_maintenance_runs
+            WHERE id NOT IN (SELECT id FROM db_maintenance_runs ORDER BY id DESC LIMIT ?)
+        """, (KEEP_RUNS,))
+    finally:
+        conn.close()
+
+    report = {
+        "started_at": started_at,
+        "duration_ms": duration_ms,
+        "timings": timings,
+        "before": before,
+        "after": after,
+        "error": error,
+    }
+    print(f"Database maintenance: {format_maintenance_report(report)}")
+    return report
+
+
+def format_maintenance_report(report: Dict) -> str:
+    before, after = report["before"], report["after"]
+    steps = ", ".join(f"{action} {ms}ms" for action, ms in report["timings"].items()) or "nothing to do"
+    text = (
+        f"{steps}; total {report['duration_ms']}ms; "
+        f"pages {before['page_count']}→{after['page_count']}, free {before['freelist']}→{after['freelist']}, "
+        f"{after['journal_mode']}"
+    )
+    if report.get("error"):
+        text += f"; error: {report['error']}"
+    return text
+
+
+def format_maintenance_row(row: Dict) -> str:
+    steps = (row.get("actions") or "nothing to do").replace(":", " ").replace(",", ", ")
+    text = (
+        f"{row['started_at']}: {steps}; total {row['duration_ms']}ms; "
+        f"pages {row['page_count_before']}→{row['page_count_after']}, "
+        f"free {row['freelist_before']}→{row['freelist_after']}, {row['journal_mode']}"
+    )
+    if row.get("error"):
+        text += f"; error: {row['error']}"
+    return text
+
+
+def get_db_maintenance_runs(limit: int = 3) -> List[Dict]:
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT *
+            FROM db_maintenance_runs
+            ORDER BY id DESC
+            LIMIT ?
+        """, (int(limit),))
+        return [dict(row) for row in cursor.fetchall()]
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from config import (
+    EXECUTOR_DB_WORKERS,
+    EXECUTOR_HANDLER_WORKERS,
+    EXECUTOR_IBS_WORKERS,
+    EXECUTOR_NOTIFY_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+IBS = "ibs"
+DB = "db"
+NOTIFY = "notify"
+HANDLERS = "handlers"
+
+EXECUTOR_SIZES = {
+    IBS: EXECUTOR_IBS_WORKERS,
+    DB: EXECUTOR_DB_WORKERS,
+    NOTIFY: EXECUTOR_NOTIFY_WORKERS,
+    HANDLERS: EXECUTOR_HANDLER_WORKERS,
+}
+
+
+class NamedExecutor:
+    """A fixed-size thread pool with its own name and queue-depth counters.
+
+    Each workload class (IBS passes, DB maintenance, notifications, handler offloads)
+    gets a separate pool so a long scheduler pass cannot take the threads a handler needs.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(int(max_workers), 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"exec-{name}")
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.active = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def submit(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        enqueued = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        # Like asyncio.to_thread, carry the caller's context vars into the worker thread.
+        context = contextvars.copy_context()
+        return self._pool.submit(context.run, self._run, enqueued, func, args, kwargs)
+
+    def _run(self, enqueued: float, func: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        wait_ms = (time.perf_counter() - enqueued) * 1000
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        ok = False
+        try:
+            result = func(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                if not ok:
+                    self.failed += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self.completed + self.active
+            return {
+                "name": self.name,
+                "workers": self.max_workers,
+                "active": self.active,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_ms": round(self.total_wait_ms / started, 1) if started else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 1),
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+_executors: Dict[str, NamedExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> NamedExecutor:
+    executor = _executors.get(name)
+    if executor is not None:
+        return executor
+    if name not in EXECUTOR_SIZES:
+        raise KeyError(f"unknown executor {name!r}")
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = NamedExecutor(name, EXECUTOR_SIZES[name])
+            _executors[name] = executor
+    return executor
+
+
+async def run_in_executor(name: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run blocking ``func`` on the named pool and await its result."""
+    future = get_executor(name).submit(func, *args, **kwargs)
+    return await asyncio.wrap_future(future)
+
+
+async def run_blocking(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Offload blocking work from a handler onto the reserved handler pool."""
+    return await run_in_executor(HANDLERS, func, *args, **kwargs)
+
+
+def executor_snapshots() -> List[Dict[str, Any]]:
+    return [get_executor(name).snapshot() for name in EXECUTOR_SIZES]
+
+
+def shutdown_executors(wait: bool = False) -> None:
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        try:
+            executor.shutdown(wait=wait)
+        except Exception:
+            logger.warning("Failed to shut down executor %s.", executor.name, exc_info=True)
+
+
+def format_executor_line(snapshot: Dict[str, Any]) -> str:
+    return (
+        f"{snapshot['name']}: {snapshot['active']}/{snapshot['workers']} busy, "
+        f"queue={snapshot['queued']} (max {snapshot['max_queued']}), "
+        f"wait avg={snapshot['avg_wait_ms']}ms max={snapshot['max_wait_ms']}ms, "
+        f"done={snapshot['completed']} failed={snapshot['failed']}"
+    )
+
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Tuple
+
+from config import (
+    IBS_BREAKER_ENABLED,
+    IBS_BREAKER_ERROR_PERCENT,
+    IBS_BREAKER_MAX_OPEN_SECONDS,
+    IBS_BREAKER_MIN_REQUESTS,
+    IBS_BREAKER_OPEN_SECONDS,
+    IBS_BREAKER_SLOW_SECONDS,
+    IBS_BREAKER_WINDOW_SECONDS,
+    IBS_MAX_CONCURRENCY,
+    IBS_SLOT_WAIT_SECONDS,
+    IBS_USER_RESERVED_SLOTS,
+)
+from services.metrics import IBS_BREAKER, inc
+
+# Every HTTP request to the panel passes through one process-wide breaker. Interactive work
+# (handlers, the IBS outbox) runs as USER; scheduler jobs run as BACKGROUND, which may not
+# take the slots reserved for users and is refused outright while the panel is unhealthy.
+
+USER = "user"
+BACKGROUND = "background"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("ibs_priority", default=USER)
+
+
+class IBSUnavailable(RuntimeError):
+    """Raised instead of calling the panel while the breaker is open or saturated."""
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def set_priority(priority: str) -> contextvars.Token:
+    """Set the priority for the rest of the current task or thread context."""
+    return _priority.set(priority)
+
+
+@contextmanager
+def ibs_priority(priority: str) -> Iterator[None]:
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class CircuitBreaker:
+    """Rolling-window error/latency breaker with a single half-open probe and priority slots.
+
+    A request counts as failed when it raises, returns 5xx or takes longer than
+    ``slow_seconds``. Once the window holds ``min_requests`` samples and the failure share
+    reaches ``error_percent`` the breaker opens for ``open_seconds``; every failed probe
+    doubles that, up to ``max_open_seconds``, and one successful probe closes it again.
+    """
+
+    def __init__(
+        self,
+        *,
+        window_seconds: int = IBS_BREAKER_WINDOW_SECONDS,
+        min_requests: int = IBS_BREAKER_MIN_REQUESTS,
+        error_percent: int = IBS_BREAKER_ERROR_PERCENT,
+        slow_seconds: float = IBS_BREAKER_SLOW_SECONDS,
+        open_seconds: float = IBS_BREAKER_OPEN_SECONDS,
+        max_open_seconds: float = IBS_BREAKER_MAX_OPEN_SECONDS,
+        max_concurrency: int = IBS_MAX_CONCURRENCY,
+        user_reserved: int = IBS_USER_RESERVED_SLOTS,
+        slot_wait_seconds: float = IBS_SLOT_WAIT_SECONDS,
+        enabled: bool = IBS_BREAKER_ENABLED,
+    ):
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_percent = error_percent
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.max_concurrency = max_concurrency
+        self.user_reserved = user_reserved
+        self.slot_wait_seconds = slot_wait_seconds
+        self.enabled = enabled
+
+        self._cond = threading.Condition()
+        self._samples: Deque[Tuple[float, bool, float]] = deque()
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.current_open_seconds = open_seconds
+        self.probe_in_flight = False
+        self.in_flight = {USER: 0, BACKGROUND: 0}
+        self.rejected = {USER: 0, BACKGROUND: 0}
+        self.opened_count = 0
+        self.last_error = ""
+        self.last_change_at = time.time()
+
+    # ------------------------------------------------------------------
+    # State
+    # ------------------------------------------------------------------
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def _window_stats(self, now: float) -> Tuple[int, int, float]:
+        self._prune(now)
+        total = len(self._samples)
+        failures = sum(1 for _, ok, _ in self._samples if not ok)
+        avg_latency = sum(latency for _, _, latency in self._samples) / total if total else 0.0
+        return total, failures, avg_latency
+
+    def _set_state(self, state: str, now: float) -> None:
+        if self.state != state:
+            self.state = state
+            self.last_change_at = now
+            inc(IBS_BREAKER, event=state)
+
+    def _open(self, now: float, longer: bool) -> None:
+        if longer:
+            self.current_open_seconds = min(self.current_open_seconds * 2, self.max_open_seconds)
+        self.open_until = now + self.current_open_seconds
+        self.opened_count += 1
+        self._set_state(OPEN, now)
+
+    def _refresh(self, now: float) -> None:
+        if self.state == OPEN and now >= self.open_until:
+            self._set_state(HALF_OPEN, now)
+
+    def allows(self) -> bool:
+        """Cheap pre-check for loops: False means the next request would be refused."""
+        if not self.enabled:
+            return True
+        with self._cond:
+            now = time.time()
+            self._refresh(now)
+            if self.state == OPEN:
+                return False
+            if self.state == HALF_OPEN:
+                return not self.probe_in_flight
+            return True
+
+    def pace_seconds(self) -> float:
+        """Extra pause background loops add between requests while the panel is slow or erroring."""
+        if not self.enabled:
+            return 0.0
+        with self._cond:
+            total, failures, avg_latency = self._window_stats(time.time())
+        if not total:
+            return 0.0
+        if failures or avg_latency >= self.slow_seconds / 2:
+            return min(avg_latency + failures, 5.0)
+        return 0.0
+
+    # ------------------------------------------------------------------
+    # Calls
+    # ------------------------------------------------------------------
+
+    def _acquire(self, priority: str) -> bool:
+        """Take a slot for ``priority``; returns True when the call is the half-open probe."""
+        deadline = time.monotonic() + self.slot_wait_seconds
+        with self._cond:
+            while True:
+                now = time.time()
+                self._refresh(now)
+                if self.state == OPEN:
+                    self.rejected[priority] += 1
+                    inc(IBS_BREAKER, event="rejected", priority=priority)
+                    raise IBSUnavailable(f"IBS circuit open for another {int(self.open_until - now)}s")
+                if self.state == HALF_OPEN:
+                    if not self.probe_in_flight:
+                        self.probe_in_flight = True
+                        self.in_flight[priority] += 1
+                        return True
+                else:
+                    limit = self.max_concurrency if priority == USER else self.max_concurrency - self.user_reserved
+                    if sum(self.in_flight.values()) < limit:
+                        self.in_flight[priority] += 1
+                        return False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected[priority] += 1
+                    inc(IBS_BREAKER, event="saturated", priority=priority)
+                    raise IBSUnavailable("IBS request slots are busy")
+                self._cond.wait(timeout=remaining)
+
+    def _release(self, priority: str, probe: bool, ok: bool, latency: float, error: str) -> None:
+        with self._cond:
+            now = time.time()
+            self.in_flight[priority] -= 1
+            self._samples.append((now, ok, latency))
+            if not ok:
+                self.last_error = error
+            if probe:
+                self.probe_in_flight = False
+                if ok:
+                    self._samples.clear()
+                    self.current_open_seconds = self.open_seconds
+                    self._set_state(CLOSED, now)
+                else:
+                    self._open(now, longer=True)
+            elif self.state == CLOSED:
+                total, failures, _ = self._window_stats(now)
+                if total >= self.min_requests and failures * 100 >= total * self.error_percent:
+                    self._open(now, longer=False)
+            self._cond.notify_all()
+
+    def call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if not self.enabled:
+            return func(*args, **kwargs)
+        priority = current_priority()
+        probe = self._acquire(priority)
+        started = time.perf_counter()
+        ok = False
+        error = ""
+        try:
+            result = func(*args, **kwargs)
+            status_code = getattr(result, "status_code", 200)
+            latency = time.perf_counter() - started
+            if status_code >= 500:
+                error = f"HTTP {status_code}"
+            elif latency > self.slow_seconds:
+                error = f"slow response {latency:.1f}s"
+            else:
+                ok = True
+            return result
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"[:200]
+            raise
+        finally:
+            self._release(priority, probe, ok, time.perf_counter() - started, error)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.time()
+            self._refresh(now)
+            total, failures, avg_latency = self._window_stats(now)
+            return {
+                "enabled": self.enabled,
+                "state": self.state,
+                "open_for_s": max(int(self.open_until - now), 0) if self.state == OPEN else 0,
+                "window_requests": total,
+                "error_percent": round(failures * 100 / total, 1) if total else 0.0,
+                "avg_latency_ms": int(avg_latency * 1000),
+                "in_flight_user": self.in_flight[USER],
+                "in_flight_background": self.in_flight[BACKGROUND],
+                "rejected_user": self.rejected[USER],
+                "rejected_background": self.rejected[BACKGROUND],
+                "opened_count": self.opened_count,
+                "last_error": self.last_error,
+            }
+
+
+ibs_breaker = CircuitBreaker()
+
+
+def format_breaker_line(snapshot: Dict[str, Any]) -> str:
+    if not snapshot["enabled"]:
+        return "disabled"
+    state = snapshot["state"]
+    if state == OPEN:
+        state = f"{state} ({snapshot['open_for_s']}s)"
+    return (
+        f"{state}, {snapshot['window_requests']} req/{IBS_BREAKER_WINDOW_SECONDS}s, "
+        f"errors {snapshot['error_percent']}%, avg {snapshot['avg_latency_ms']}ms, "
+        f"in flight user={snapshot['in_flight_user']} bg={snapshot['in_flight_background']}, "
+        f"rejected user={snapshot['rejected_user']} bg={snapshot['rejected_background']}, "
+        f"opened {snapshot['opened_count']}x"
+    )
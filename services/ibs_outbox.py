@@ -0,0 +1,350 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from config import (
+    DB_PATH,
+    IBS_OUTBOX_MAX_ATTEMPTS,
+    IBS_OUTBOX_POLL_SECONDS,
+    IBS_OUTBOX_RETRY_BASE_SECONDS,
+    IBS_OUTBOX_RETRY_MAX_SECONDS,
+    IBS_OUTBOX_WORKERS,
+    SCHEDULER_INSTANCE_ID,
+)
+from services.IBSng import UserEdit
+from services.admin_notifier import send_message_to_admins
+from services.executors import DB, IBS, NOTIFY, run_in_executor
+from services.scheduler_services.telegram_safe import send_scheduler_notification
+
+logger = logging.getLogger(__name__)
+
+# Handlers commit their DB change together with an outbox row and answer the user right away;
+# the worker below replays the row against IBSng until it sticks. Rows of one username run
+# strictly in id order, one at a time, so a reset can never overtake an earlier group change.
+
+USER_EDIT = "user_edit"
+EDIT_STEPS = {
+    "reset_times",
+    "reset_relative_exp_date",
+    "reset_first_login",
+    "set_group",
+    "lock",
+    "unlock",
+    "reset_radius_attrs",
+    "set_radius_attrs",
+}
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# A claimed row whose worker died is handed out again after this long.
+CLAIM_SECONDS = 300
+
+CLAIM_QUERY = """
+    SELECT o.*
+    FROM ibs_outbox o
+    WHERE o.status = 'pending'
+      AND o.next_attempt_at <= ?
+      AND NOT EXISTS (
+          SELECT 1
+          FROM ibs_outbox e
+          WHERE e.username = o.username
+            AND e.status IN ('pending', 'running')
+            AND e.id < o.id
+      )
+      AND NOT EXISTS (
+          SELECT 1
+          FROM ibs_outbox r
+          WHERE r.username = o.username
+            AND r.status = 'running'
+      )
+    ORDER BY o.next_attempt_at ASC, o.id ASC
+    LIMIT ?
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _now_text() -> str:
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+def account_reset_steps(group: str = "Starter-Bot") -> List[list]:
+    """The edit ``reset_account_client`` performs, as outbox steps."""
+    return [["reset_times"], ["set_group", group], ["unlock"], ["reset_radius_attrs"]]
+
+
+def enqueue_user_edit(
+    cur: sqlite3.Cursor,
+    username: str,
+    steps: Sequence[Sequence],
+    *,
+    idempotency_key: Optional[str] = None,
+    notify_user_id: Optional[int] = None,
+    description: Optional[str] = None,
+) -> Optional[int]:
+    """Queue a ``UserEdit`` inside the caller's transaction.
+
+    ``steps`` are ``[method, *args]`` lists of ``UserEdit`` methods. A repeated
+    ``idempotency_key`` is ignored and returns None. Call ``wake_ibs_outbox`` after
+    the commit so the worker picks the row up without waiting for its next poll.
+    """
+    for step in steps:
+        if not step or step[0] not in EDIT_STEPS:
+            raise ValueError(f"unsupported IBS edit step: {step!r}")
+    now_text = _now_text()
+    cur.execute(
+        """
+        INSERT OR IGNORE INTO ibs_outbox (
+            username, operation, payload, idempotency_key, status, attempts,
+            next_attempt_at, notify_user_id, description, created_at, updated_at
+        )
+        VALUES (?, ?, ?, ?, 'pending', 0, 0, ?, ?, ?, ?)
+        """,
+        (
+            str(username),
+            USER_EDIT,
+            json.dumps({"steps": [list(step) for step in steps]}, ensure_ascii=False),
+            idempotency_key,
+            notify_user_id,
+            description,
+            now_text,
+            now_text,
+        ),
+    )
+    return cur.lastrowid if cur.rowcount == 1 else None
+
+
+def _recover_stale_claims(cur: sqlite3.Cursor, now: float) -> None:
+    cur.execute(
+        """
+        UPDATE ibs_outbox
+        SET status = 'pending', locked_by = NULL, locked_until = NULL
+        WHERE status = 'running'
+          AND COALESCE(locked_until, 0) < ?
+        """,
+        (now,),
+    )
+
+
+def claim_outbox_entries(owner: str, limit: int) -> List[Dict]:
+    """Mark up to ``limit`` runnable rows (at most one per username) as running for ``owner``."""
+    now = time.time()
+    claimed: List[Dict] = []
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        _recover_stale_claims(cur, now)
+        rows = cur.execute(CLAIM_QUERY, (now, limit)).fetchall()
+        for row in rows:
+            cur.execute(
+                """
+                UPDATE ibs_outbox
+                SET status = 'running', locked_by = ?, locked_until = ?, updated_at = ?
+                WHERE id = ?
+                  AND status = 'pending'
+                """,
+                (owner, now + CLAIM_SECONDS, _now_text(), row["id"]),
+            )
+            if cur.rowcount == 1:
+                claimed.append(dict(row))
+        conn.commit()
+    return claimed
+
+
+def retry_delay_seconds(attempts: int) -> int:
+    return min(IBS_OUTBOX_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), IBS_OUTBOX_RETRY_MAX_SECONDS)
+
+
+def finish_outbox_entry(entry_id: int, owner: str, error: Optional[str]) -> str:
+    """Record one attempt; returns the row's new status."""
+    with _connect() as conn:
+        cur = conn.cursor()
+        row = cur.execute("SELECT attempts FROM ibs_outbox WHERE id = ?", (entry_id,)).fetchone()
+        attempts = int(row["attempts"] or 0) + 1 if row else 1
+        if error is None:
+            status, next_attempt_at = DONE, 0
+        elif attempts >= IBS_OUTBOX_MAX_ATTEMPTS:
+            status, next_attempt_at = FAILED, 0
+        else:
+            status, next_attempt_at = PENDING, time.time() + retry_delay_seconds(attempts)
+        cur.execute(
+            """
+            UPDATE ibs_outbox
+            SET status = ?,
+                attempts = ?,
+                next_attempt_at = ?,
+                last_error = ?,
+                locked_by = NULL,
+                locked_until = NULL,
+                updated_at = ?
+            WHERE id = ?
+              AND status = 'running'
+              AND locked_by = ?
+            """,
+            (status, attempts, next_attempt_at, error, _now_text(), entry_id, owner),
+        )
+        conn.commit()
+        return status if cur.rowcount == 1 else RUNNING
+
+
+def execute_outbox_entry(entry: Dict) -> Optional[str]:
+    """Apply one row against IBSng; returns an error text or None on success."""
+    try:
+        if entry["operation"] != USER_EDIT:
+            return f"unknown operation {entry['operation']!r}"
+        edit = UserEdit(entry["username"])
+        for name, *args in json.loads(entry["payload"] or "{}").get("steps", []):
+            if name not in EDIT_STEPS:
+                return f"unsupported step {name!r}"
+            getattr(edit, name)(*args)
+        if not edit.commit():
+            return "IBS edit was not accepted"
+        return None
+    except Exception as exc:
+        return f"{type(exc).__name__}: {exc}"
+
+
+def retry_failed_entries(entry_ids: Iterable[int]) -> int:
+    ids = [int(entry_id) for entry_id in entry_ids]
+    if not ids:
+        return 0
+    placeholders = ", ".join("?" for _ in ids)
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            UPDATE ibs_outbox
+            SET status = 'pending', attempts = 0, next_attempt_at = 0, updated_at = ?
+            WHERE status = 'failed'
+              AND id IN ({placeholders})
+            """,
+            (_now_text(), *ids),
+        )
+        conn.commit()
+        count = cur.rowcount
+    wake_ibs_outbox()
+    return count
+
+
+def get_outbox_summary() -> Dict:
+    with _connect() as conn:
+        counts = {
+            row["status"]: int(row["count"])
+            for row in conn.execute("SELECT status, COUNT(*) AS count FROM ibs_outbox GROUP BY status").fetchall()
+        }
+        oldest = conn.execute(
+            "SELECT MIN(created_at) FROM ibs_outbox WHERE status IN ('pending', 'running')"
+        ).fetchone()[0]
+        failed = conn.execute(
+            """
+            SELECT id, username, description, attempts, last_error, updated_at
+            FROM ibs_outbox
+            WHERE status = 'failed'
+            ORDER BY id DESC
+            LIMIT 5
+            """
+        ).fetchall()
+        return {"counts": counts, "oldest_open": oldest, "recent_failed": [dict(row) for row in failed]}
+
+
+def purge_finished_entries(days: int = 14) -> int:
+    cutoff = datetime.fromtimestamp(time.time() - days * 86400).isoformat(sep=" ", timespec="seconds")
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM ibs_outbox WHERE status = 'done' AND updated_at < ?", (cutoff,))
+        conn.commit()
+        return cur.rowcount
+
+
+# ----------------------------------------------------------------------------
+# Worker
+# ----------------------------------------------------------------------------
+
+_wakeup: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def wake_ibs_outbox() -> None:
+    """Nudge the worker after an enqueue; safe to call from any thread."""
+    if _wakeup is None or _loop is None or _loop.is_closed():
+        return
+    try:
+        _loop.call_soon_threadsafe(_wakeup.set)
+    except RuntimeError:
+        pass
+
+
+async def _report_permanent_failure(entry: Dict, error: str) -> None:
+    username = entry["username"]
+    description = entry.get("description") or entry["operation"]
+    await send_message_to_admins(
+        "⚠️ اعمال تغییرات روی IBS پس از چند تلاش ناموفق ماند\n"
+        f"🆔 یوزرنیم: <code>{username}</code>\n"
+        f"📌 عملیات: {description}\n"
+        f"🔁 تلاش‌ها: {IBS_OUTBOX_MAX_ATTEMPTS}\n"
+        f"❗️ خطا: <code>{error}</code>\n"
+        f"شناسه صف: {entry['id']}"
+    )
+    if entry.get("notify_user_id"):
+        await run_in_executor(
+            NOTIFY,
+            send_scheduler_notification,
+            chat_id=entry["notify_user_id"],
+            text=(
+                f"⚠️ تنظیم سرویس <code>{username}</code> روی سرور با مشکل مواجه شد.\n"
+                f"پشتیبانی در جریان است و به‌زودی پیگیری می‌کند."
+            ),
+            parse_mode="HTML",
+            timeout=15,
+        )
+
+
+async def _process(entry: Dict, owner: str) -> None:
+    error = await run_in_executor(IBS, execute_outbox_entry, entry)
+    status = await run_in_executor(DB, finish_outbox_entry, entry["id"], owner, error)
+    if error:
+        logger.warning("IBS outbox entry %s (%s) failed: %s -> %s", entry["id"], entry["username"], error, status)
+    if status == FAILED:
+        try:
+            await _report_permanent_failure(entry, error or "")
+        except Exception:
+            logger.warning("Failed to report IBS outbox failure %s.", entry["id"], exc_info=True)
+
+
+async def run_ibs_outbox_worker(owner: str = SCHEDULER_INSTANCE_ID) -> None:
+    """Drain ``ibs_outbox`` until cancelled, ``IBS_OUTBOX_WORKERS`` entries at a time."""
+    global _wakeup, _loop
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    logger.info("IBS outbox worker started (%s workers).", IBS_OUTBOX_WORKERS)
+    try:
+        while True:
+            _wakeup.clear()
+            try:
+                entries = await run_in_executor(DB, claim_outbox_entries, owner, IBS_OUTBOX_WORKERS)
+            except Exception:
+                logger.warning("IBS outbox claim failed.", exc_info=True)
+                entries = []
+            if entries:
+                await asyncio.gather(*(_process(entry, owner) for entry in entries))
+                continue
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=IBS_OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _wakeup = None
+        _loop = None
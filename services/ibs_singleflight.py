@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import copy
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config import IBS_READ_CACHE_SECONDS
+from services.metrics import IBS_READ_CACHE, inc
+
+# log_usage, limit_speed, "my services" and the admin order view often ask IBSng about the
+# same username at the same moment. Identical reads share one in-flight request, and the
+# result stays reusable for IBS_READ_CACHE_SECONDS. Keys start with the username so a write
+# to that user can drop everything cached or in flight for it.
+
+
+class _Flight:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self, ttl_seconds: float = IBS_READ_CACHE_SECONDS, max_entries: int = 4096):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+
+    def do(self, key: Tuple, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        username = key[0]
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self.hits += 1
+                inc(IBS_READ_CACHE, outcome="hit")
+                return copy.copy(cached[1])
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                generation = self._generations.get(username, 0)
+                self.misses += 1
+            else:
+                self.shared += 1
+        inc(IBS_READ_CACHE, outcome="miss" if leader else "shared")
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.copy(flight.result)
+
+        try:
+            flight.result = func(*args, **kwargs)
+            return flight.result
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                stale = self._generations.get(username, 0) != generation
+                if flight.error is None and self.ttl_seconds > 0 and not stale:
+                    if len(self._results) >= self.max_entries:
+                        self._evict_expired()
+                    self._results[key] = (time.monotonic() + self.ttl_seconds, flight.result)
+            flight.event.set()
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, (expires, _) in self._results.items() if expires <= now]:
+            del self._results[key]
+        if len(self._results) >= self.max_entries:
+            self._results.clear()
+
+    def invalidate(self, username: str) -> None:
+        """Forget cached and in-flight reads of ``username`` after a write to it."""
+        username = str(username)
+        with self._lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            for key in [key for key in self._results if key[0] == username]:
+                del self._results[key]
+            # Callers arriving after the write must not join a read that started before it.
+            for key in [key for key in self._inflight if key[0] == username]:
+                del self._inflight[key]
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "shared": self.shared,
+                "misses": self.misses,
+                "cached": len(self._results),
+                "in_flight": len(self._inflight),
+            }
+
+
+ibs_reads = SingleFlight()
+
+
+def coalesced(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Share concurrent identical calls of an IBS read whose first argument is the username."""
+
+    @functools.wraps(func)
+    def wrapper(username, *args, **kwargs):
+        key = (str(username), func.__name__, args, tuple(sorted(kwargs.items())))
+        return ibs_reads.do(key, func, username, *args, **kwargs)
+
+    return wrapper
+
+
+def format_read_cache_line(snapshot: Dict[str, int]) -> str:
+    return (
+        f"hits={snapshot['hits']} shared={snapshot['shared']} misses={snapshot['misses']}, "
+        f"cached={snapshot['cached']} in flight={snapshot['in_flight']}"
+    )
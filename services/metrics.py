@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+from config import METRICS_ENABLED, METRICS_LISTEN_HOST, METRICS_LISTEN_PORT
+
+logger = logging.getLogger(__name__)
+
+# Seconds; wide enough to separate SQLite calls (ms) from slow IBS pages and long scheduler passes.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+IBS_HTTP = "ibs_http_request_seconds"
+IBS_OPERATION = "ibs_operation_seconds"
+SQLITE_CALL = "sqlite_call_seconds"
+HANDLER = "handler_seconds"
+SCHEDULER_JOB = "scheduler_job_seconds"
+NOTIFICATIONS = "notifications_total"
+IBS_BREAKER = "ibs_breaker_events_total"
+IBS_READ_CACHE = "ibs_read_cache_total"
+
+HELP = {
+    IBS_HTTP: "IBSng HTTP request latency by endpoint (time to response headers).",
+    IBS_OPERATION: "IBSng client operation latency, including login and page parsing.",
+    SQLITE_CALL: "services.db function latency.",
+    HANDLER: "aiogram handler latency by router module and event type.",
+    SCHEDULER_JOB: "Scheduler job run duration by job and status.",
+    NOTIFICATIONS: "Notification send outcomes by channel.",
+    IBS_BREAKER: "IBS circuit breaker state changes and refused requests.",
+    IBS_READ_CACHE: "IBS reads served from cache, shared with an in-flight call, or fetched.",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile (good enough to rank hot spots)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return self.max
+
+
+_lock = threading.Lock()
+_histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+_started_at = time.time()
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def observe(name: str, seconds: float, **labels: Any) -> None:
+    if not METRICS_ENABLED:
+        return
+    key = _label_key(labels)
+    with _lock:
+        family = _histograms.setdefault(name, {})
+        histogram = family.get(key)
+        if histogram is None:
+            histogram = family[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def inc(name: str, amount: float = 1, **labels: Any) -> None:
+    if not METRICS_ENABLED:
+        return
+    key = _label_key(labels)
+    with _lock:
+        family = _counters.setdefault(name, {})
+        family[key] = family.get(key, 0) + amount
+
+
+def timed(name: str, **labels: Any) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator recording call latency; returns the function untouched when metrics are off."""
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        if not METRICS_ENABLED:
+            return func
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(name, time.perf_counter() - started, **labels)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_functions(namespace: Dict[str, Any], name: str, label: str) -> None:
+    """Wrap every public function defined in a module with ``timed``.
+
+    Call it at the bottom of the module so ``from module import func`` elsewhere
+    already picks up the wrapped version. No-op when metrics are off.
+    """
+    if not METRICS_ENABLED:
+        return
+    module_name = namespace.get("__name__")
+    for attr, value in list(namespace.items()):
+        if attr.startswith("_") or not inspect.isfunction(value) or value.__module__ != module_name:
+            continue
+        if inspect.isgeneratorfunction(value):
+            continue
+        namespace[attr] = timed(name, **{label: attr})(value)
+
+
+def attach_requests_timing(session: Any, name: str = IBS_HTTP) -> None:
+    """Record ``response.elapsed`` for every request a ``requests.Session`` makes."""
+    if not METRICS_ENABLED:
+        return
+
+    def hook(response: Any, *args: Any, **kwargs: Any) -> None:
+        path = urlsplit(response.request.url).path
+        endpoint = path.rsplit("/", 1)[-1] or path or "/"
+        observe(name, response.elapsed.total_seconds(), endpoint=endpoint, status=response.status_code // 100 * 100)
+
+    session.hooks["response"].append(hook)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware timing each handler; the router label is the handler's module."""
+
+    def __init__(self, event_type: str):
+        self.event_type = event_type
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        router = getattr(callback, "__module__", None) or "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            observe(HANDLER, time.perf_counter() - started, router=router.rsplit(".", 1)[-1], event=self.event_type)
+
+
+def setup_handler_metrics(dispatcher: Any) -> None:
+    if not METRICS_ENABLED:
+        return
+    # Inner middlewares registered on the dispatcher also apply to every included router.
+    dispatcher.message.middleware(HandlerMetricsMiddleware("message"))
+    dispatcher.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    with _lock:
+        histograms = {name: {key: (list(h.counts), h.count, h.total) for key, h in family.items()}
+                      for name, family in _histograms.items()}
+        counters = {name: dict(family) for name, family in _counters.items()}
+
+    lines: List[str] = []
+    for name in sorted(histograms):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, (counts, count, total) in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+    for name in sorted(counters):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(counters[name].items()):
+            lines.append(f"{name}{_format_labels(key)} {value:g}")
+    lines.append("# TYPE process_uptime_seconds gauge")
+    lines.append(f"process_uptime_seconds {time.time() - _started_at:.0f}")
+    return "\n".join(lines) + "\n"
+
+
+def stats_rows(name: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Label sets of one histogram family ordered by total time spent, heaviest first."""
+    with _lock:
+        family = list(_histograms.get(name, {}).items())
+    rows = []
+    for key, histogram in family:
+        rows.append(
+            {
+                "labels": ", ".join(f"{k}={v}" for k, v in key) or "-",
+                "count": histogram.count,
+                "total_s": histogram.total,
+                "avg_ms": histogram.total / histogram.count * 1000 if histogram.count else 0.0,
+                "p95_ms": histogram.quantile(0.95) * 1000,
+                "max_ms": histogram.max * 1000,
+            }
+        )
+    rows.sort(key=lambda row: row["total_s"], reverse=True)
+    return rows[:limit]
+
+
+def counter_rows(name: str) -> List[Tuple[str, float]]:
+    with _lock:
+        family = dict(_counters.get(name, {}))
+    return sorted(((", ".join(f"{k}={v}" for k, v in key), value) for key, value in family.items()), key=lambda r: -r[1])
+
+
+def is_enabled() -> bool:
+    return METRICS_ENABLED
+
+
+async def start_metrics_server() -> Optional[web.AppRunner]:
+    if not METRICS_ENABLED or not METRICS_LISTEN_PORT:
+        return None
+
+    async def metrics_view(_: web.Request) -> web.Response:
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app, handle_signals=False, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=METRICS_LISTEN_HOST, port=METRICS_LISTEN_PORT)
+    await site.start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", METRICS_LISTEN_HOST, METRICS_LISTEN_PORT)
+    return runner
@@ -2,23 +2,27 @@ from __future__ import annotations
 
 import sqlite3
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 import jdatetime
 
 from config import DB_PATH
 from services.IBSng import (
-    change_group,
+    UserEdit,
     get_user_exp_date,
     get_user_start_date,
-    reset_radius_attrs,
     reset_account_client,
     unlock_user,
 )
+from services.ibs_outbox import account_reset_steps, enqueue_user_edit, wake_ibs_outbox
+from services.scheduler_engine import holds_job_lease
+from services.wallet import CHARGE_DUPLICATE, CHARGE_INSUFFICIENT, apply_wallet_delta
 
 FINAL_ORDER_STATUSES = {"canceled", "renewed", "archived", "converted"}
 LIVE_ORDER_STATUSES = {"active", "waiting_for_renewal", "waiting_for_renewal_not_paid", "expired"}
 PAID_ORDER_STATUSES = LIVE_ORDER_STATUSES | {"reserved"}
+RENEWAL_BLOCK_STATUSES = {"waiting_for_renewal", "reserved", "renewed", "waiting_for_renewal_not_paid"}
+RENEWABLE_STATUSES = ("active", "expired")
 
 
 def _connect() -> sqlite3.Connection:
@@ -48,11 +52,12 @@ def _restore_speed_profile(username: Optional[str], group_name: Optional[str], u
     if not username:
         return None
     try:
+        edit = UserEdit(username).reset_radius_attrs()
         if unlock:
-            unlock_user(username)
-        reset_radius_attrs(username)
+            edit.unlock()
         if group_name:
-            change_group(username, group_name)
+            edit.set_group(group_name)
+        edit.commit()
         return None
     except Exception as exc:
         return f"{type(exc).__name__}: {exc}"
@@ -80,7 +85,8 @@ def _update_order_times(order_id: int, starts_at: Optional[str], expires_at: Opt
                 """
                 UPDATE orders
                 SET starts_at = ?,
-                    expires_at = ?
+                    expires_at = ?,
+                    next_usage_refresh_at = NULL
                 WHERE id = ?
                 """,
                 (starts_at, expires_at, order_id),
@@ -89,7 +95,8 @@ def _update_order_times(order_id: int, starts_at: Optional[str], expires_at: Opt
             cur.execute(
                 """
                 UPDATE orders
-                SET starts_at = ?
+                SET starts_at = ?,
+                    next_usage_refresh_at = NULL
                 WHERE id = ?
                 """,
                 (starts_at, order_id),
@@ -98,7 +105,8 @@ def _update_order_times(order_id: int, starts_at: Optional[str], expires_at: Opt
             cur.execute(
                 """
                 UPDATE orders
-                SET expires_at = ?
+                SET expires_at = ?,
+                    next_usage_refresh_at = NULL
                 WHERE id = ?
                 """,
                 (expires_at, order_id),
@@ -383,13 +391,10 @@ def change_order_plan(order_id: int, new_plan_id: int, admin_id: Optional[int] =
         was_usage_locked = bool(int(order["usage_lock_applied"] or 0))
 
         if order["user_id"] and order["status"] in PAID_ORDER_STATUSES and price_diff != 0:
-            cur.execute(
-                """
-                UPDATE users
-                SET balance = COALESCE(balance, 0) - ?
-                WHERE id = ?
-                """,
-                (price_diff, order["user_id"]),
+            apply_wallet_delta(
+                cur, order["user_id"], -price_diff, "plan_change",
+                ref_type="order", ref_id=order_id,
+                note=f"admin={admin_id}" if admin_id else None,
             )
 
         start_text = order["starts_at"]
@@ -603,6 +608,275 @@ def add_manual_extra_volume(order_id: int, volume_gb: int, admin_id: Optional[in
     return result if result.get("ok") else None
 
 
+def purchase_service(user_id: int, plan: dict) -> dict:
+    """Create an active order on a free account, charge its price and queue the IBS group change,
+    all in one transaction.
+
+    If the charge fails nothing is written: the order is not inserted and the account stays free.
+    """
+    price = int(plan["price"] or 0)
+    volume_gb = plan.get("volume_gb")
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        account = cur.execute(
+            """
+            SELECT id, username, password
+            FROM accounts
+            WHERE status = 'free'
+            LIMIT 1
+            """
+        ).fetchone()
+        if not account:
+            conn.rollback()
+            return {"ok": False, "error": "no_free_account"}
+
+        cur.execute(
+            """
+            INSERT INTO orders (user_id, plan_id, username, price, created_at, status, volume_gb, remaining_volume_mb)
+            VALUES (?, ?, ?, ?, ?, 'active', ?, ?)
+            """,
+            (
+                user_id,
+                plan["id"],
+                account["username"],
+                price,
+                _now_text(),
+                volume_gb,
+                int(round(float(volume_gb or 0) * 1024)),
+            ),
+        )
+        order_id = cur.lastrowid
+        cur.execute(
+            """
+            UPDATE accounts
+            SET status = 'assigned',
+                order_id = ?
+            WHERE id = ?
+            """,
+            (order_id, account["id"]),
+        )
+
+        charge = apply_wallet_delta(
+            cur, user_id, -price, "purchase",
+            ref_type="order", ref_id=order_id, require_funds=True,
+            idempotency_key=f"purchase:{order_id}",
+        )
+        if not charge["ok"]:
+            conn.rollback()
+            return {"ok": False, "error": charge["status"]}
+        enqueue_user_edit(
+            cur,
+            account["username"],
+            [["set_group", plan["group_name"]]],
+            idempotency_key=f"purchase:{order_id}",
+            notify_user_id=user_id,
+            description=f"خرید سرویس (سفارش {order_id})",
+        )
+        conn.commit()
+
+    wake_ibs_outbox()
+
+    return {
+        "ok": True,
+        "order_id": order_id,
+        "username": account["username"],
+        "password": account["password"],
+        "new_balance": charge["balance"],
+    }
+
+
+def _record_renewal(
+    cur: sqlite3.Cursor,
+    order_id: int,
+    user_id: int,
+    plan: dict,
+    username: str,
+    activate_now: bool,
+    auto_renew: int,
+    outbox_key: str,
+    description: str,
+) -> Optional[int]:
+    """Mark the order renewed (or waiting for renewal) and insert its renewal, on the caller's cursor.
+
+    An immediate renewal also queues the IBS account reset in the same transaction. Returns None
+    when the order is no longer active or expired, i.e. another renewal already moved it.
+    """
+    if activate_now:
+        cur.execute(
+            "UPDATE orders SET status = 'renewed', remaining_volume_mb = 0 WHERE id = ? AND status IN (?, ?)",
+            (order_id, *RENEWABLE_STATUSES),
+        )
+    else:
+        cur.execute(
+            "UPDATE orders SET status = 'waiting_for_renewal' WHERE id = ? AND status IN (?, ?)",
+            (order_id, *RENEWABLE_STATUSES),
+        )
+    if cur.rowcount != 1:
+        return None
+
+    volume_gb = plan.get("volume_gb") or 0
+    cur.execute(
+        """
+        INSERT INTO orders (
+            user_id, plan_id, username, price, created_at, status,
+            is_renewal_of_order, volume_gb, auto_renew, remaining_volume_mb
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            user_id,
+            plan["id"],
+            username,
+            plan["price"],
+            _now_text(),
+            "active" if activate_now else "reserved",
+            order_id,
+            volume_gb,
+            int(auto_renew or 0),
+            int(round(float(volume_gb) * 1024)),
+        ),
+    )
+    renewal_id = cur.lastrowid
+    if activate_now:
+        enqueue_user_edit(
+            cur,
+            username,
+            account_reset_steps(plan["group_name"]),
+            idempotency_key=outbox_key,
+            notify_user_id=user_id,
+            description=description,
+        )
+    return renewal_id
+
+
+def renew_service(user_id: int, order_id: int, plan: dict, activate_now: bool) -> dict:
+    """Charge a renewal from the wallet and record it, in one transaction.
+
+    Returns ``already_renewed`` when another renewal of the order got there first.
+    """
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        order = cur.execute(
+            "SELECT username, status FROM orders WHERE id = ? AND user_id = ? LIMIT 1",
+            (order_id, user_id),
+        ).fetchone()
+        if not order:
+            conn.rollback()
+            return {"ok": False, "error": "order_not_found"}
+        if order["status"] in RENEWAL_BLOCK_STATUSES:
+            conn.rollback()
+            return {"ok": False, "error": "already_renewed"}
+
+        charge = apply_wallet_delta(
+            cur, user_id, -int(plan["price"] or 0), "renewal",
+            ref_type="order", ref_id=order_id, require_funds=True,
+        )
+        if not charge["ok"]:
+            conn.rollback()
+            return {"ok": False, "error": charge["status"]}
+        renewal_id = _record_renewal(
+            cur, order_id, user_id, plan, str(order["username"]), activate_now,
+            auto_renew=0,
+            outbox_key=f"renewal:{order_id}",
+            description=f"تمدید فوری (سفارش {order_id})",
+        )
+        if renewal_id is None:
+            conn.rollback()
+            return {"ok": False, "error": "already_renewed"}
+        conn.commit()
+
+    if activate_now:
+        wake_ibs_outbox()
+    return {"ok": True, "renewal_id": renewal_id, "new_balance": charge["balance"]}
+
+
+def _auto_renewal_due_now(order: dict) -> bool:
+    if order["status"] == "expired":
+        return True
+    expires_at = jdatetime.datetime.strptime(order["expires_at"], "%Y-%m-%d %H:%M").togregorian()
+    return expires_at < datetime.now()
+
+
+def settle_auto_renewals(candidates: List[Tuple[dict, dict]]) -> List[Dict]:
+    """Charge and record due auto-renewals in one write transaction; return the settled ones.
+
+    Each order gets its own savepoint: the charge, the guarded status change and the renewal
+    either all stay or are all undone. An order another renewal already moved, or whose
+    ``auto_renew:<id>`` charge is already in the ledger, is skipped without a second renewal.
+    The job's lease is checked inside the same transaction, so a run that lost it charges nobody.
+    """
+    settled: List[Dict] = []
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        if not holds_job_lease(cur):
+            conn.rollback()
+            print("auto_renew: lease lost, skipping this settlement.")
+            return []
+        for order, plan in candidates:
+            activate_now = _auto_renewal_due_now(order)
+            cur.execute("SAVEPOINT auto_renew")
+            charge = apply_wallet_delta(
+                cur, order["user_id"], -int(plan["price"] or 0), "auto_renew",
+                ref_type="order", ref_id=order["id"], require_funds=True,
+                idempotency_key=f"auto_renew:{order['id']}",
+            )
+            renewal_id = None
+            if charge["ok"] and charge["status"] != CHARGE_DUPLICATE:
+                renewal_id = _record_renewal(
+                    cur, int(order["id"]), int(order["user_id"]), plan, str(order["username"]), activate_now,
+                    auto_renew=order["auto_renew"],
+                    outbox_key=f"auto_renew:{order['id']}",
+                    description=f"تمدید خودکار (سفارش {order['id']})",
+                )
+            if renewal_id is None:
+                cur.execute("ROLLBACK TO auto_renew")
+                cur.execute("RELEASE auto_renew")
+                continue
+            cur.execute("RELEASE auto_renew")
+            settled.append({
+                "order": order,
+                "plan": plan,
+                "activate_now": activate_now,
+                "renewal_id": renewal_id,
+                "new_balance": charge["balance"],
+            })
+        conn.commit()
+
+    if any(item["activate_now"] for item in settled):
+        wake_ibs_outbox()
+    return settled
+
+
+def activate_stored_order(order_id: int, user_id: int, expiry_str: str) -> None:
+    """End the current period of an order now and queue the account reset in the same transaction."""
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE orders
+            SET expires_at = ?
+            WHERE id = ?
+            """,
+            (expiry_str, order_id),
+        )
+        username = cur.execute("SELECT username FROM orders WHERE id = ? LIMIT 1", (order_id,)).fetchone()
+        if username:
+            enqueue_user_edit(
+                cur,
+                str(username[0]),
+                account_reset_steps(),
+                idempotency_key=f"activate_stored:{order_id}",
+                notify_user_id=user_id,
+                description=f"فعال‌سازی سرویس ذخیره (سفارش {order_id})",
+            )
+        conn.commit()
+
+    wake_ibs_outbox()
+
+
 def purchase_volume_package(user_id: int, order_id: int, package_id: int) -> dict:
     username = None
     group_name = None
@@ -716,10 +990,24 @@ def purchase_volume_package(user_id: int, order_id: int, package_id: int) -> dic
             total_limit_mb=new_total_limit_mb,
         )
 
-        cur.execute(
-            "UPDATE users SET balance = ? WHERE id = ?",
-            (new_balance, user_id),
+        charge = apply_wallet_delta(
+            cur, user_id, -package_price, "volume_package",
+            ref_type="order", ref_id=order_id, require_funds=True,
         )
+        if not charge["ok"]:
+            conn.rollback()
+            if charge["status"] != CHARGE_INSUFFICIENT:
+                return {"ok": False, "error": charge["status"]}
+            balance_row = cur.execute("SELECT balance FROM users WHERE id = ? LIMIT 1", (user_id,)).fetchone()
+            current_balance = int(balance_row["balance"] or 0) if balance_row else 0
+            return {
+                "ok": False,
+                "error": "insufficient_balance",
+                "required": max(package_price - current_balance, 0),
+                "current_balance": current_balance,
+                "package_price": package_price,
+            }
+        new_balance = charge["balance"]
         cur.execute(
             """
             UPDATE orders
@@ -768,10 +1056,24 @@ def purchase_volume_package(user_id: int, order_id: int, package_id: int) -> dic
                 now_text,
             ),
         )
+        allocation_id = cur.lastrowid
+        if live_service and username:
+            steps = [["reset_radius_attrs"]]
+            if was_usage_locked:
+                steps.append(["unlock"])
+            if group_name:
+                steps.append(["set_group", group_name])
+            enqueue_user_edit(
+                cur,
+                username,
+                steps,
+                idempotency_key=f"volume_package:{allocation_id}",
+                notify_user_id=user_id,
+                description=f"خرید بسته حجم (سفارش {order_id})",
+            )
         conn.commit()
 
-    if live_service:
-        ibs_warning = _restore_speed_profile(username, group_name, unlock=was_usage_locked)
+    wake_ibs_outbox()
 
     return {
         "ok": True,
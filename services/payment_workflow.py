@@ -3,6 +3,7 @@ from datetime import datetime
 from typing import Dict, List, Optional
 
 from config import DB_PATH
+from services.wallet import apply_wallet_delta
 
 STATUS_DRAFT = "draft"
 STATUS_PENDING_ADMIN = "pending_admin"
@@ -778,10 +779,7 @@ def approve_transaction_initial(txn_id: int, reviewer_id: int, amount: int, note
             conn.rollback()
             return None
 
-        cur.execute(
-            "UPDATE users SET balance = COALESCE(balance, 0) + ? WHERE id = ?",
-            (approved_amount, user_id),
-        )
+        apply_wallet_delta(cur, user_id, approved_amount, "deposit", ref_type="transaction", ref_id=txn_id)
         conn.commit()
 
     return get_transaction_with_user(txn_id)
@@ -848,10 +846,7 @@ def approve_transaction_with_accounting(
             conn.rollback()
             return None
 
-        cur.execute(
-            "UPDATE users SET balance = COALESCE(balance, 0) + ? WHERE id = ?",
-            (approved_amount, user_id),
-        )
+        apply_wallet_delta(cur, user_id, approved_amount, "deposit", ref_type="transaction", ref_id=txn_id)
         conn.commit()
 
     return get_transaction_with_user(txn_id)
@@ -942,10 +937,7 @@ def reject_transaction_accounting(txn_id: int, reviewer_id: int, reason: str) ->
         balance_reverted = int(row["balance_reverted"] or 0)
 
         if amount > 0 and balance_reverted == 0:
-            cur.execute(
-                "UPDATE users SET balance = COALESCE(balance, 0) - ? WHERE id = ?",
-                (amount, user_id),
-            )
+            apply_wallet_delta(cur, user_id, -amount, "deposit_reversal", ref_type="transaction", ref_id=txn_id)
 
         cur.execute(
             """
@@ -1028,10 +1020,7 @@ def reverse_transaction_balance(txn_id: int, reviewer_id: int, reason: str) -> O
             return None
 
         if amount > 0:
-            cur.execute(
-                "UPDATE users SET balance = COALESCE(balance, 0) - ? WHERE id = ?",
-                (amount, user_id),
-            )
+            apply_wallet_delta(cur, user_id, -amount, "deposit_reversal", ref_type="transaction", ref_id=txn_id)
 
         cur.execute(
             """
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+from urllib.request import pathname2url
+
+from config import (
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_SLEEP_MS,
+    DB_PATH,
+    REPORT_SNAPSHOT,
+    REPORT_SNAPSHOT_MAX_AGE_SECONDS,
+    REPORT_SNAPSHOT_PATH,
+)
+from services.backup import copy_live_database
+
+# The admin reports aggregate whole tables (orders UNION ALL orders_archive, transactions,
+# users). Run against the live file, every one of those reads holds a shared lock for as long
+# as the aggregation takes, and the scheduler's usage updates wait behind it. Reports read
+# from REPORT_SNAPSHOT_PATH instead: a copy taken with the paged backup API (writers only wait
+# for one step at a time) and swapped in with a rename. The copy is opened with immutable=1,
+# so report queries take no locks at all. The "report_snapshot" scheduler job keeps it fresh;
+# a report that finds it missing or older than REPORT_SNAPSHOT_MAX_AGE_SECONDS refreshes it
+# first.
+
+LAST_SNAPSHOT_RESULT: Dict[str, Any] = {}
+_refresh_lock = threading.RLock()
+
+
+def snapshot_age_seconds() -> Optional[float]:
+    try:
+        return max(time.time() - os.path.getmtime(REPORT_SNAPSHOT_PATH), 0.0)
+    except OSError:
+        return None
+
+
+def snapshot_taken_at() -> Optional[datetime]:
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(REPORT_SNAPSHOT_PATH))
+    except OSError:
+        return None
+
+
+def refresh_report_snapshot() -> Dict[str, Any]:
+    """Copy DB_PATH to REPORT_SNAPSHOT_PATH; readers of the previous copy keep their file."""
+    with _refresh_lock:
+        started = time.perf_counter()
+        directory = os.path.dirname(os.path.abspath(REPORT_SNAPSHOT_PATH))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{REPORT_SNAPSHOT_PATH}.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            counters = copy_live_database(temp_path, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP_MS)
+            # A copy of a WAL database is a WAL database; immutable readers need a plain file.
+            conn = sqlite3.connect(temp_path)
+            try:
+                conn.execute("PRAGMA journal_mode = DELETE").fetchone()
+            finally:
+                conn.close()
+            os.replace(temp_path, REPORT_SNAPSHOT_PATH)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        result = {
+            "taken_at": datetime.now().isoformat(sep=" ", timespec="seconds"),
+            "duration_ms": int((time.perf_counter() - started) * 1000),
+            "bytes": os.path.getsize(REPORT_SNAPSHOT_PATH),
+            **counters,
+        }
+        LAST_SNAPSHOT_RESULT.clear()
+        LAST_SNAPSHOT_RESULT.update(result)
+        return result
+
+
+def scheduled_report_snapshot() -> None:
+    result = refresh_report_snapshot()
+    print(f"Report snapshot refreshed: {format_snapshot_result(result)}")
+
+
+def _ensure_fresh_snapshot() -> bool:
+    age = snapshot_age_seconds()
+    if age is not None and age <= REPORT_SNAPSHOT_MAX_AGE_SECONDS:
+        return True
+    try:
+        with _refresh_lock:
+            # Another report may have refreshed it while this one waited for the lock.
+            age = snapshot_age_seconds()
+            if age is not None and age <= REPORT_SNAPSHOT_MAX_AGE_SECONDS:
+                return True
+            refresh_report_snapshot()
+        return True
+    except (OSError, sqlite3.Error) as exc:
+        print(f"Report snapshot refresh failed: {type(exc).__name__}: {exc}")
+        # An old copy is still better for reports than the live file.
+        return snapshot_age_seconds() is not None
+
+
+def connect_live_readonly() -> sqlite3.Connection:
+    """Read-only connection on the live file, for single-row lookups that must be current."""
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(DB_PATH))}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def connect_reports() -> sqlite3.Connection:
+    """Read-only connection for report queries: the snapshot, or the live file when it is off."""
+    if not (REPORT_SNAPSHOT and _ensure_fresh_snapshot()):
+        return connect_live_readonly()
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(REPORT_SNAPSHOT_PATH))}?immutable=1", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def format_snapshot_result(result: Dict[str, Any]) -> str:
+    if not result:
+        return "no snapshot taken by this process yet"
+    text = (
+        f"{result['taken_at']}, {result['duration_ms']}ms in {result['steps']} steps, "
+        f"{result['bytes'] // 1024}KB"
+    )
+    if result.get("restarts"):
+        text += f", {result['restarts']} restarts"
+    if result.get("single_step"):
+        text += ", finished in one step"
+    return text
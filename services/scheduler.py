@@ -1,193 +1,145 @@
-import asyncio
+from typing import Optional
 
 from config import (
     APP_ENV,
+    DB_VACUUM_AFTER_ARCHIVED_ORDERS,
     ENABLE_SCHEDULER,
+    REPORT_SNAPSHOT,
     SCHEDULER_ACTIVATE_RESERVED,
     SCHEDULER_ACTIVATE_WAITING_FOR_PAYMENT,
     SCHEDULER_AUTO_RENEW,
+    SCHEDULER_BACKUP,
+    SCHEDULER_DB_MAINTENANCE,
     SCHEDULER_CANCEL_NOT_PAID,
     SCHEDULER_CONVERSION_NOTIFIER,
     SCHEDULER_EXPIRE_ORDERS,
+    SCHEDULER_INSTANCE_ID,
+    SCHEDULER_LEASES,
+    SCHEDULER_LEASE_TTL_SECONDS,
     SCHEDULER_LIMIT_SPEED,
     SCHEDULER_MEMBERSHIP,
     SCHEDULER_NOTIFIER,
+    SCHEDULER_REPORT_SNAPSHOT,
     SCHEDULER_USAGE_NOTIFIER,
     SCHEDULER_UPDATE_ORDER_TIMES,
     SCHEDULER_USAGE_LOGGER,
 )
-from services.IBSng import get_user_exp_date, get_user_start_date
+from services.backup import scheduled_backup
+from services.db_maintenance import incremental_vacuum, run_db_maintenance
+from services.report_snapshot import scheduled_report_snapshot
+from services.executors import DB, IBS, NOTIFY
+from services.ibs_outbox import purge_finished_entries
+from services.usage_history import compact_usage_history
+from services.scheduler_engine import ScheduledJob, SchedulerEngine
 from services.scheduler_services.activate_reserved_orders import activate_reserved_orders
 from services.scheduler_services.activate_waiting_for_payment_orders import activate_waiting_for_payment_orders
 from services.scheduler_services.cancel_not_paid_waiting_for_payment_orders import \
     cancel_not_paid_waiting_for_payment_orders
 from services.conversion_offer import send_conversion_offer_notifications
 from services.db import expire_old_orders, archive_old_orders
-from services.db import get_active_orders_without_time, update_order_starts_at, update_order_expires_at
 from services.scheduler_services.limit_speed import limit_speed
 from services.scheduler_services.membership import check_membership
 from services.scheduler_services.notifier import notifier
+from services.scheduler_services.order_time_sync import update_orders_time_from_ibs
 from services.scheduler_services.usage_notifier import notify_usage_thresholds
 from services.scheduler_services.usage_logger import log_usage
 from services.scheduler_services.auto_renew import auto_renew
 
+MINUTE = 60
+HOUR = 60 * MINUTE
+
+_engine: Optional[SchedulerEngine] = None
+
+
+def expire_orders():
+    expire_old_orders()
+    archived = archive_old_orders()
+    purge_finished_entries()
+    compact_usage_history()
+    if archived >= DB_VACUUM_AFTER_ARCHIVED_ORDERS:
+        freed = incremental_vacuum()
+        print(f"Archived {archived} orders, released {freed} free pages.")
+
+
+def build_jobs():
+    return [
+        ScheduledJob("update_orders_time_from_ibs", update_orders_time_from_ibs,
+                     interval_seconds=15 * MINUTE, jitter_seconds=60, timeout_seconds=30 * MINUTE,
+                     executor=IBS, enabled=SCHEDULER_UPDATE_ORDER_TIMES),
+        ScheduledJob("notifier", notifier,
+                     interval_seconds=15 * MINUTE, jitter_seconds=60, timeout_seconds=15 * MINUTE,
+                     executor=NOTIFY, enabled=SCHEDULER_NOTIFIER),
+        ScheduledJob("conversion_notifier", send_conversion_offer_notifications,
+                     interval_seconds=15 * MINUTE, jitter_seconds=60, timeout_seconds=15 * MINUTE,
+                     executor=NOTIFY, enabled=SCHEDULER_CONVERSION_NOTIFIER),
+        ScheduledJob("activate_reserved_orders", activate_reserved_orders,
+                     interval_seconds=MINUTE, jitter_seconds=10, timeout_seconds=10 * MINUTE,
+                     enabled=SCHEDULER_ACTIVATE_RESERVED),
+        ScheduledJob("expire_orders", expire_orders,
+                     cron="7 * * * *", jitter_seconds=30, timeout_seconds=30 * MINUTE, run_on_start=False,
+                     executor=DB, enabled=SCHEDULER_EXPIRE_ORDERS),
+        ScheduledJob("usage_logger", log_usage,
+                     interval_seconds=MINUTE, jitter_seconds=10, timeout_seconds=20 * MINUTE,
+                     executor=IBS, enabled=SCHEDULER_USAGE_LOGGER),
+        ScheduledJob("usage_notifier", notify_usage_thresholds,
+                     interval_seconds=5 * MINUTE, jitter_seconds=30, timeout_seconds=10 * MINUTE,
+                     executor=NOTIFY, enabled=SCHEDULER_USAGE_NOTIFIER),
+        ScheduledJob("membership", check_membership,
+                     cron="30 4 * * *", jitter_seconds=10 * MINUTE, timeout_seconds=6 * HOUR,
+                     enabled=SCHEDULER_MEMBERSHIP),
+        ScheduledJob("limit_speed", limit_speed,
+                     interval_seconds=2 * MINUTE, jitter_seconds=15, timeout_seconds=15 * MINUTE,
+                     executor=IBS, enabled=SCHEDULER_LIMIT_SPEED),
+        ScheduledJob("activate_waiting_for_payment", activate_waiting_for_payment_orders,
+                     interval_seconds=MINUTE, jitter_seconds=10, timeout_seconds=10 * MINUTE,
+                     enabled=SCHEDULER_ACTIVATE_WAITING_FOR_PAYMENT),
+        ScheduledJob("cancel_not_paid", cancel_not_paid_waiting_for_payment_orders,
+                     interval_seconds=MINUTE, jitter_seconds=10, timeout_seconds=10 * MINUTE,
+                     executor=DB, enabled=SCHEDULER_CANCEL_NOT_PAID),
+        ScheduledJob("auto_renew", auto_renew,
+                     interval_seconds=MINUTE, jitter_seconds=10, timeout_seconds=10 * MINUTE,
+                     enabled=SCHEDULER_AUTO_RENEW),
+        # Quiet hours, before the membership sweep at 04:30.
+        ScheduledJob("db_maintenance", run_db_maintenance,
+                     cron="10 4 * * *", jitter_seconds=5 * MINUTE, timeout_seconds=HOUR, run_on_start=False,
+                     executor=DB, enabled=SCHEDULER_DB_MAINTENANCE),
+        ScheduledJob("backup", scheduled_backup,
+                     cron="40 * * * *", jitter_seconds=60, timeout_seconds=30 * MINUTE, run_on_start=False,
+                     executor=DB, enabled=SCHEDULER_BACKUP),
+        ScheduledJob("report_snapshot", scheduled_report_snapshot,
+                     interval_seconds=10 * MINUTE, jitter_seconds=30, timeout_seconds=10 * MINUTE,
+                     executor=DB, enabled=SCHEDULER_REPORT_SNAPSHOT and REPORT_SNAPSHOT),
+    ]
+
 
-async def update_orders_time_from_ibs():
-    while True:
-        print("update times started")
-        orders = get_active_orders_without_time()
-        for order in orders:
-            try:
-                username = order['username']
-                starts_at = await asyncio.to_thread(get_user_start_date, username)
-                expires_at = await asyncio.to_thread(get_user_exp_date, username)
-
-                if starts_at:
-                    update_order_starts_at(order['id'], starts_at)
-                if expires_at:
-                    update_order_expires_at(order['id'], expires_at)
-
-            except Exception as e:
-                print(f"خطا در دریافت اطلاعات برای سفارش {order['id']}: {e}")
-        print("Update orders time from ibs loop finished.")
-        await asyncio.sleep(15 * 60)
-
-
-async def expire_orders_loop():
-    while True:
-        await asyncio.sleep(60 * 60)
-        try:
-            await asyncio.to_thread(expire_old_orders)
-            await asyncio.to_thread(archive_old_orders)
-        except Exception as e:
-            print(f"خطا در expire کردن سفارش‌ها: {e}")
-        print("Expire orders loop finished.")
-
-
-async def activate_reserved_orders_loop():
-    while True:
-        try:
-            await asyncio.to_thread(activate_reserved_orders)
-        except Exception as e:
-            print(f"خطا در فعال کردن سفارش‌های رزرو شده: {e}")
-        print("Activate reserved orders loop finished.")
-        await asyncio.sleep(60)
-
-
-async def notifier_loop():
-    while True:
-        try:
-            await asyncio.to_thread(notifier)
-        except Exception as e:
-            print(f"خطا در ارسال پیغام: {e}")
-        await asyncio.sleep(15 * 60)
-
-
-async def conversion_notifier_loop():
-    while True:
-        try:
-            await asyncio.to_thread(send_conversion_offer_notifications)
-        except Exception as e:
-            print(f"خطا در ارسال پیام طرح تبدیل: {e}")
-        await asyncio.sleep(15 * 60)
-
-
-async def log_usage_loop():
-    while True:
-        try:
-            print("Log Usage Loop Starded")
-            await asyncio.to_thread(log_usage)
-        except Exception as e:
-            print(f"خطا در ثبت مصرف کاربر: {e}")
-        await asyncio.sleep(1 * 60)
-
-
-async def usage_notifier_loop():
-    while True:
-        try:
-            await asyncio.to_thread(notify_usage_thresholds)
-        except Exception as e:
-            print(f"خطا در ارسال هشدار مصرف حجم: {e}")
-        await asyncio.sleep(5 * 60)
-
-
-async def check_membership_loop():
-    while True:
-        try:
-            await check_membership()
-            print("Check MemberShip loop Finished.")
-        except Exception as e:
-            print(f"خطا در ثبت عضویت کاربر: {e}")
-        await asyncio.sleep(60 * 60 * 24)
-
-
-async def limit_speed_loop():
-    while True:
-        try:
-            await asyncio.to_thread(limit_speed)
-            print("limit speed loop Finished.")
-        except Exception as e:
-            print("Error during scheduler:", e)
-        await asyncio.sleep(2 * 60)
-
-
-async def activate_waiting_for_payment_orders_loop():
-    while True:
-        try:
-            await asyncio.to_thread(activate_waiting_for_payment_orders)
-        except Exception as e:
-            print(f"خطا در فعال کردن سفارش‌های پرداخت نشده: {e}")
-        print("Activate Waiting For Payment orders loop finished.")
-        await asyncio.sleep(60)
-
-
-async def cancel_not_paid_waiting_for_payment_orders_loop():
-    while True:
-        try:
-            await asyncio.to_thread(cancel_not_paid_waiting_for_payment_orders)
-        except Exception as e:
-            print(f"خطا در کنسل کردن سفارش‌های پرداخت نشده: {e}")
-        print("Cancel Not Paid Waiting For Payment orders loop finished.")
-        await asyncio.sleep(60)
-
-
-async def auto_renew_loop():
-    while True:
-        try:
-            # pass
-            await auto_renew()
-        except Exception as e:
-            print(f"خطا در اجرای تمدید خودکار: {e}")
-        print("َAuto renew loop finished.")
-        await asyncio.sleep(60)
+def get_scheduler_engine() -> Optional[SchedulerEngine]:
+    return _engine
 
 
 async def scheduler():
+    global _engine
+
     if not ENABLE_SCHEDULER:
         print(f"Scheduler disabled for APP_ENV={APP_ENV}.")
         return
 
-    job_configs = [
-        ("update_orders_time_from_ibs", SCHEDULER_UPDATE_ORDER_TIMES, update_orders_time_from_ibs),
-        ("notifier", SCHEDULER_NOTIFIER, notifier_loop),
-        ("conversion_notifier", SCHEDULER_CONVERSION_NOTIFIER, conversion_notifier_loop),
-        ("activate_reserved_orders", SCHEDULER_ACTIVATE_RESERVED, activate_reserved_orders_loop),
-        ("expire_orders", SCHEDULER_EXPIRE_ORDERS, expire_orders_loop),
-        ("usage_logger", SCHEDULER_USAGE_LOGGER, log_usage_loop),
-        ("usage_notifier", SCHEDULER_USAGE_NOTIFIER, usage_notifier_loop),
-        ("membership", SCHEDULER_MEMBERSHIP, check_membership_loop),
-        ("limit_speed", SCHEDULER_LIMIT_SPEED, limit_speed_loop),
-        ("activate_waiting_for_payment", SCHEDULER_ACTIVATE_WAITING_FOR_PAYMENT, activate_waiting_for_payment_orders_loop),
-        ("cancel_not_paid", SCHEDULER_CANCEL_NOT_PAID, cancel_not_paid_waiting_for_payment_orders_loop),
-        ("auto_renew", SCHEDULER_AUTO_RENEW, auto_renew_loop),
-    ]
-
-    enabled_jobs = [factory() for _, enabled, factory in job_configs if enabled]
-    enabled_names = [name for name, enabled, _ in job_configs if enabled]
-
-    if not enabled_jobs:
+    engine = SchedulerEngine(
+        build_jobs(),
+        lease_owner=SCHEDULER_INSTANCE_ID if SCHEDULER_LEASES else None,
+        lease_ttl_seconds=SCHEDULER_LEASE_TTL_SECONDS,
+    )
+    if not engine.jobs:
         print(f"Scheduler enabled but no jobs selected for APP_ENV={APP_ENV}.")
         return
 
-    print(f"Scheduler started for APP_ENV={APP_ENV} with jobs: {', '.join(enabled_names)}")
-    await asyncio.gather(*enabled_jobs)
+    _engine = engine
+    print(
+        f"Scheduler started for APP_ENV={APP_ENV} as {engine.lease_owner or 'unleased'} "
+        f"with jobs: {', '.join(job.name for job in engine.jobs)}"
+    )
+    await engine.run()
+
+
+async def shutdown_scheduler():
+    if _engine is not None:
+        await _engine.shutdown()
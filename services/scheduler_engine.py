@@ -0,0 +1,472 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import inspect
+import logging
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from services.db import (
+    acquire_job_lease,
+    is_job_lease_current,
+    record_scheduler_run,
+    release_job_lease,
+    renew_job_lease,
+)
+from services.executors import DB, run_in_executor
+from services.ibs_circuit import BACKGROUND, set_priority
+from services.metrics import SCHEDULER_JOB, observe
+
+logger = logging.getLogger(__name__)
+
+CRON_FIELD_RANGES = (
+    (0, 59),  # minute
+    (0, 23),  # hour
+    (1, 31),  # day of month
+    (1, 12),  # month
+    (0, 6),  # day of week (0 = Sunday)
+)
+CRON_SEARCH_LIMIT_DAYS = 366 * 4
+
+# (job_name, owner, fencing_token) of the lease the current job run holds.
+_current_lease: contextvars.ContextVar[Optional[Tuple[str, str, int]]] = contextvars.ContextVar(
+    "scheduler_current_lease", default=None
+)
+
+
+def holds_job_lease(cursor: Optional[sqlite3.Cursor] = None) -> bool:
+    """Fencing check for jobs: False once another instance has taken over this job's lease.
+
+    Outside a leased run (leases disabled, manual call) this is always True. Jobs with side
+    effects that must not happen twice (wallet charges) pass the cursor of the BEGIN IMMEDIATE
+    transaction that makes them: the check then holds until that transaction commits, because a
+    takeover has to write scheduler_leases and waits for the lock.
+    """
+    lease = _current_lease.get()
+    if lease is None:
+        return True
+    try:
+        return is_job_lease_current(*lease, cursor=cursor)
+    except Exception:
+        logger.warning("Could not verify scheduler lease for %s.", lease[0], exc_info=True)
+        return False
+
+
+def _parse_cron_field(raw: str, low: int, high: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            raise ValueError(f"empty cron field segment in {raw!r}")
+
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f"invalid cron step in {raw!r}")
+
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+
+        if start < low or end > high or start > end:
+            raise ValueError(f"cron field {raw!r} out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Minimal five-field cron expression: ``minute hour day month weekday``.
+
+    Supports ``*``, ``a-b``, ``a,b`` and ``*/n`` / ``a-b/n``. Weekday 7 is accepted as Sunday.
+    Like classic cron, when both day-of-month and weekday are restricted a day matches either.
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression must have 5 fields: {expression!r}")
+
+        fields[4] = ",".join("0" if token.strip() == "7" else token for token in fields[4].split(","))
+        parsed = [_parse_cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELD_RANGES)]
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        self._day_restricted = fields[2] != "*"
+        self._weekday_restricted = fields[4] != "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        cron_weekday = (moment.weekday() + 1) % 7
+        day_ok = moment.day in self.days
+        weekday_ok = cron_weekday in self.weekdays
+        if self._day_restricted and self._weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        deadline = moment + timedelta(days=CRON_SEARCH_LIMIT_DAYS)
+        while candidate <= deadline:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"cron expression never fires: {self.expression!r}")
+
+
+class ScheduledJob:
+    """A periodic job: either every ``interval_seconds`` or on a ``cron`` expression.
+
+    Sync callables run on the named ``executor`` pool, async callables are awaited directly. A tick
+    that comes due while the previous run is still in progress is skipped, not queued.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        *,
+        interval_seconds: Optional[float] = None,
+        cron: Optional[str] = None,
+        jitter_seconds: float = 0,
+        timeout_seconds: Optional[float] = None,
+        executor: str = DB,
+        run_on_start: bool = True,
+        enabled: bool = True,
+    ):
+        if (interval_seconds is None) == (cron is None):
+            raise ValueError(f"job {name!r} needs exactly one of interval_seconds / cron")
+
+        self.name = name
+        self.func = func
+        self.interval_seconds = float(interval_seconds) if interval_seconds is not None else None
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter_seconds = max(float(jitter_seconds or 0), 0.0)
+        self.timeout_seconds = float(timeout_seconds) if timeout_seconds else None
+        self.executor = executor
+        self.run_on_start = run_on_start
+        self.enabled = enabled
+        self.is_async = inspect.iscoroutinefunction(func)
+
+        self.running = False
+        self.run_count = 0
+        self.failure_count = 0
+        self.timeout_count = 0
+        self.skipped_count = 0
+        self.standby_count = 0
+        self.lease_lost_count = 0
+        self.fencing_token: Optional[int] = None
+        self.last_started_at: Optional[str] = None
+        self.last_status: Optional[str] = None
+        self.last_duration_ms: Optional[int] = None
+        self.next_run_at: Optional[str] = None
+
+    @property
+    def schedule_label(self) -> str:
+        if self.cron:
+            return f"cron {self.cron.expression}"
+        return f"every {int(self.interval_seconds)}s"
+
+    def seconds_until_next(self, first: bool = False) -> float:
+        if first and self.run_on_start:
+            delay = 0.0
+        elif self.cron:
+            now = datetime.now()
+            delay = (self.cron.next_after(now) - now).total_seconds()
+        else:
+            delay = self.interval_seconds
+        if self.jitter_seconds:
+            delay += random.uniform(0, self.jitter_seconds)
+        return max(delay, 0.0)
+
+    def period_seconds(self) -> float:
+        """Upper bound on the gap until the next tick, used to size how long a lease is kept."""
+        if self.cron:
+            now = datetime.now()
+            gap = (self.cron.next_after(now) - now).total_seconds()
+        else:
+            gap = self.interval_seconds
+        return gap + self.jitter_seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "schedule": self.schedule_label,
+            "executor": None if self.is_async else self.executor,
+            "running": self.running,
+            "run_count": self.run_count,
+            "failure_count": self.failure_count,
+            "timeout_count": self.timeout_count,
+            "skipped_count": self.skipped_count,
+            "standby_count": self.standby_count,
+            "lease_lost_count": self.lease_lost_count,
+            "fencing_token": self.fencing_token,
+            "last_started_at": self.last_started_at,
+            "last_status": self.last_status,
+            "last_duration_ms": self.last_duration_ms,
+            "next_run_at": self.next_run_at,
+        }
+
+
+def _now_text() -> str:
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+class SchedulerEngine:
+    """Runs each enabled job on its own loop.
+
+    With ``lease_owner`` set, a job only runs while this instance holds its lease in
+    ``scheduler_leases``. The lease is heartbeated during a run and then kept for one more
+    period, so the same instance keeps the job until it stops or dies and the lease expires.
+    """
+
+    def __init__(
+        self,
+        jobs: List[ScheduledJob],
+        shutdown_timeout_seconds: float = 30,
+        lease_owner: Optional[str] = None,
+        lease_ttl_seconds: float = 90,
+    ):
+        self.jobs = [job for job in jobs if job.enabled]
+        self.shutdown_timeout_seconds = shutdown_timeout_seconds
+        self.lease_owner = lease_owner
+        self.lease_ttl_seconds = float(lease_ttl_seconds)
+        self._stop_event: Optional[asyncio.Event] = None
+        self._loop_tasks: List[asyncio.Task] = []
+        self._run_tasks: Set[asyncio.Future] = set()
+
+    def get_job(self, name: str) -> Optional[ScheduledJob]:
+        return next((job for job in self.jobs if job.name == name), None)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [job.snapshot() for job in self.jobs]
+
+    async def run(self) -> None:
+        self._stop_event = asyncio.Event()
+        self._loop_tasks = [asyncio.create_task(self._job_loop(job), name=f"scheduler:{job.name}") for job in self.jobs]
+        try:
+            await asyncio.gather(*self._loop_tasks)
+        finally:
+            await self.shutdown()
+
+    async def _sleep(self, seconds: float) -> bool:
+        """Sleep for ``seconds``; return False when the engine is stopping."""
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), timeout=seconds)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def _job_loop(self, job: ScheduledJob) -> None:
+        first = True
+        while not self._stop_event.is_set():
+            delay = job.seconds_until_next(first=first)
+            first = False
+            job.next_run_at = (datetime.now() + timedelta(seconds=delay)).isoformat(sep=" ", timespec="seconds")
+            if not await self._sleep(delay):
+                break
+
+            if job.running:
+                job.skipped_count += 1
+                logger.warning("Scheduler job %s still running; skipping this tick.", job.name)
+                await self._persist(job, status="skipped", duration_ms=None, error=None, started_at=_now_text())
+                continue
+
+            if self.lease_owner and not await self._acquire_lease(job):
+                continue
+
+            job.running = True
+            run_task = asyncio.create_task(self._execute(job), name=f"scheduler-run:{job.name}")
+            self._run_tasks.add(run_task)
+            run_task.add_done_callback(self._run_tasks.discard)
+
+    async def _acquire_lease(self, job: ScheduledJob) -> bool:
+        try:
+            token = await run_in_executor(DB, acquire_job_lease, job.name, self.lease_owner, self.lease_ttl_seconds)
+        except Exception:
+            logger.warning("Could not acquire scheduler lease for %s; skipping tick.", job.name, exc_info=True)
+            return False
+        if token is None:
+            if job.fencing_token is not None:
+                logger.warning("Scheduler lease for %s is now held by another instance.", job.name)
+            job.fencing_token = None
+            job.standby_count += 1
+            return False
+        if token != job.fencing_token:
+            logger.info("Acquired scheduler lease for %s (token=%s).", job.name, token)
+        job.fencing_token = token
+        return True
+
+    async def _heartbeat(self, job: ScheduledJob, token: int, work: asyncio.Future) -> None:
+        interval = max(self.lease_ttl_seconds / 3, 1.0)
+        while not work.done():
+            await asyncio.sleep(interval)
+            if work.done():
+                return
+            try:
+                renewed = await run_in_executor(
+                    DB, renew_job_lease, job.name, self.lease_owner, token, self.lease_ttl_seconds
+                )
+            except Exception:
+                logger.warning("Scheduler lease heartbeat failed for %s.", job.name, exc_info=True)
+                continue
+            if not renewed:
+                job.lease_lost_count += 1
+                job.fencing_token = None
+                logger.error("Scheduler job %s lost its lease while running (token=%s).", job.name, token)
+                if job.is_async:
+                    work.cancel()
+                return
+
+    async def _hold_lease(self, job: ScheduledJob, token: int) -> None:
+        # Keep the lease through the idle gap so the next tick stays on this instance.
+        try:
+            await run_in_executor(
+                DB, renew_job_lease, job.name, self.lease_owner, token,
+                job.period_seconds() + self.lease_ttl_seconds,
+            )
+        except Exception:
+            logger.warning("Could not extend scheduler lease for %s.", job.name, exc_info=True)
+
+    def _start_work(self, job: ScheduledJob) -> Awaitable[Any]:
+        if job.is_async:
+            return asyncio.ensure_future(job.func())
+        return asyncio.ensure_future(run_in_executor(job.executor, job.func))
+
+    async def _execute(self, job: ScheduledJob) -> None:
+        started_at = _now_text()
+        started = time.perf_counter()
+        job.last_started_at = started_at
+        status = "ok"
+        error: Optional[str] = None
+
+        token = job.fencing_token if self.lease_owner else None
+        if token is not None:
+            _current_lease.set((job.name, self.lease_owner, token))
+        # Scheduler passes yield IBS capacity to handlers and the outbox (see ibs_circuit).
+        set_priority(BACKGROUND)
+
+        work = self._start_work(job)
+        work.add_done_callback(lambda _: setattr(job, "running", False))
+        heartbeat = asyncio.create_task(self._heartbeat(job, token, work)) if token is not None else None
+        try:
+            if job.timeout_seconds:
+                await asyncio.wait_for(asyncio.shield(work), timeout=job.timeout_seconds)
+            else:
+                await work
+        except asyncio.TimeoutError:
+            status = "timeout"
+            error = f"exceeded {job.timeout_seconds:g}s"
+            job.timeout_count += 1
+            if job.is_async:
+                work.cancel()
+            # Thread-based work cannot be interrupted; ``running`` stays set until it returns,
+            # so following ticks keep being skipped instead of piling up.
+            logger.error("Scheduler job %s timed out after %ss.", job.name, job.timeout_seconds)
+        except asyncio.CancelledError:
+            work.cancel()
+            if heartbeat is not None:
+                heartbeat.cancel()
+            lease_lost = token is not None and job.fencing_token != token
+            if not lease_lost or asyncio.current_task().cancelling():
+                raise
+            status = "lease_lost"
+            error = "lease taken over by another instance"
+        except Exception as exc:
+            status = "error"
+            error = str(exc)[:500]
+            job.failure_count += 1
+            logger.exception("Scheduler job %s failed.", job.name)
+
+        if heartbeat is not None:
+            if work.done():
+                heartbeat.cancel()
+            else:
+                # A timed-out thread is still running: keep heartbeating until it returns.
+                self._run_tasks.add(heartbeat)
+                heartbeat.add_done_callback(self._run_tasks.discard)
+        if token is not None and job.fencing_token != token and status == "ok":
+            status = "lease_lost"
+            error = "lease taken over by another instance"
+        if token is not None and job.fencing_token == token and work.done():
+            await self._hold_lease(job, token)
+
+        elapsed = time.perf_counter() - started
+        observe(SCHEDULER_JOB, elapsed, job=job.name, status=status)
+        duration_ms = int(elapsed * 1000)
+        job.run_count += 1
+        job.last_status = status
+        job.last_duration_ms = duration_ms
+        if status == "ok":
+            logger.info("Scheduler job %s finished in %sms.", job.name, duration_ms)
+        await self._persist(job, status=status, duration_ms=duration_ms, error=error, started_at=started_at)
+
+    async def _persist(
+        self,
+        job: ScheduledJob,
+        *,
+        status: str,
+        duration_ms: Optional[int],
+        error: Optional[str],
+        started_at: str,
+    ) -> None:
+        try:
+            await run_in_executor(
+                DB,
+                record_scheduler_run,
+                job.name,
+                status=status,
+                started_at=started_at,
+                finished_at=_now_text(),
+                duration_ms=duration_ms,
+                error=error,
+            )
+        except Exception:
+            logger.warning("Failed to persist scheduler run for %s.", job.name, exc_info=True)
+
+    async def shutdown(self) -> None:
+        if self._stop_event is None or self._stop_event.is_set():
+            return
+        self._stop_event.set()
+
+        running = [task for task in self._run_tasks if not task.done()]
+        if running:
+            logger.info("Waiting up to %ss for %s running scheduler jobs.", self.shutdown_timeout_seconds, len(running))
+            _, still_running = await asyncio.wait(running, timeout=self.shutdown_timeout_seconds)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                await asyncio.gather(*still_running, return_exceptions=True)
+
+        for task in self._loop_tasks:
+            if not task.done():
+                task.cancel()
+
+        if self.lease_owner:
+            await self._release_leases()
+
+    async def _release_leases(self) -> None:
+        for job in self.jobs:
+            token = job.fencing_token
+            if token is None or job.running:
+                continue
+            try:
+                await run_in_executor(DB, release_job_lease, job.name, self.lease_owner, token)
+                job.fencing_token = None
+            except Exception:
+                logger.warning("Could not release scheduler lease for %s.", job.name, exc_info=True)
@@ -1,105 +1,15 @@
-import datetime
-from typing import Optional
-
-import jdatetime
-
-from services import IBSng
-from services.IBSng import change_group
-from services.db import (
-    get_reserved_orders,
-    get_order_data,
-    update_order_status,
-    get_order_plan_duration, get_order_plan_group_name,
-)
-from services.scheduler_services.telegram_safe import send_scheduler_notification
-from services.usage_policy import get_volume_policy_alert
+from services.scheduler_services.activation_engine import run_activation
 
 
 # ----------------------------------------------------------------------------
 # Public API – called by scheduler/cron
 # ----------------------------------------------------------------------------
 
-def activate_reserved_orders() -> None:
+async def activate_reserved_orders() -> None:
     """Activate reserved renewal orders whose previous cycle has finished.
 
-    This function should be executed periodically (e.g. every 5‑10 minutes).
-    It performs three simple steps:
-
-    1. Fetch all orders with status = "reserved".
-    2. For each one, fetch its linked *previous* order (via ``is_renewal_of_order``).
-    3. If the previous order has truly expired, mark it expired, activate the
-       reserved order, reset the account in IBSng and assign the proper group.
+    Candidates, their previous order and plan group come from one joined query; the
+    previous order is marked renewed and the reserved one active in a single transaction,
+    with the IBSng reset queued to the IBS outbox in that same transaction (see ``activation_engine``).
     """
-
-    for reserved in get_reserved_orders():
-        _maybe_activate_reserved_order(reserved)
-
-
-# ----------------------------------------------------------------------------
-# Internal helpers
-# ----------------------------------------------------------------------------
-
-def _maybe_activate_reserved_order(reserved_order: dict) -> None:
-    prev_id: Optional[int] = reserved_order.get("is_renewal_of_order")
-    if not prev_id:
-        return  # No linked order → nothing to do
-
-    previous = get_order_data(prev_id)
-    if not previous:
-        return  # Previous order missing
-
-    if not _is_previous_order_expired(previous):
-        return  # Still active – wait for next run
-
-    # Previous order renewed → activate reserved one
-    update_order_status(order_id=previous["id"], new_status="renewed")
-    update_order_status(order_id=reserved_order["id"], new_status="active")
-
-    # Sync IBSng group according to plan duration
-    duration_info = get_order_plan_duration(order_id=reserved_order["id"]) or {}
-    duration_months = duration_info.get("duration_months", 1)
-    # group_name = f"{duration_months}-Month"
-    group_info = get_order_plan_group_name(order_id=reserved_order["id"]) or {}
-    group_name = group_info.get("group_name", "Starter-Bot")
-    IBSng.reset_account_client(username=reserved_order["username"])
-    change_group(reserved_order["username"], group_name)
-    # Notify the user via Telegram
-    _notify_user_activation(reserved_order, duration_months)
-
-
-def _is_previous_order_expired(order: dict) -> bool:
-    """Return True if previous order expired (status or timestamp)."""
-
-    if order.get("status") == "expired":
-        return True
-
-    exp_str: Optional[str] = order.get("expires_at")
-    if not exp_str:
-        return False
-
-    exp_jdt = jdatetime.datetime.strptime(exp_str, "%Y-%m-%d %H:%M")
-    exp_greg = exp_jdt.togregorian()
-    return exp_greg < datetime.datetime.now()
-
-
-def _notify_user_activation(reserved_order: dict, duration_months: int) -> None:
-    if int(reserved_order.get("user_id") or 0) <= 0:
-        return
-
-    plan_name = reserved_order.get("plan_name", "سرویس شما")
-    username = reserved_order["username"]
-    volume_gb = reserved_order.get("volume_gb")   # حجم سرویس
-
-    msg = (
-        f"✅ دوست عزیز،\n"
-        f"سرویس رزرو شما با نام کاربری <code>{username}</code> با موفقیت فعال شد.\n"
-        f"{get_volume_policy_alert()}\n\n"
-        f"✨ در صورت بروز هرگونه مشکل با پشتیبانی در تماس باشید."
-    )
-
-    send_scheduler_notification(
-        chat_id=reserved_order["user_id"],
-        text=msg,
-        parse_mode="HTML",
-        timeout=15,
-    )
+    await run_activation(("reserved",))
@@ -1,138 +1,6 @@
-import datetime
-from typing import Optional, Union
+from services.scheduler_services.activation_engine import run_activation
 
-import jdatetime
 
-from services import IBSng
-from services.IBSng import change_group
-from services.db import (
-    get_waiting_for_payment_orders,
-    get_user_balance,
-    get_order_data,
-    update_order_status,
-    get_order_plan_group_name,
-    update_user_balance,
-    get_plan_name,
-    get_account_credentials_by_username,
-)
-from services.scheduler_services.telegram_safe import send_scheduler_notification
-from services.usage_policy import get_volume_policy_alert
-
-
-def activate_waiting_for_payment_orders() -> None:
-    for waiting_for_payment in get_waiting_for_payment_orders():
-        _maybe_waiting_for_payment_order(waiting_for_payment)
-
-
-def _maybe_waiting_for_payment_order(waiting_for_payment: dict) -> None:
-    user_id = waiting_for_payment.get("user_id")
-    plan_price = int(waiting_for_payment.get("price") or 0)
-    current_balance = int(get_user_balance(user_id=user_id) or 0)
-    if current_balance < plan_price:
-        return
-
-    prev_id: Optional[int] = waiting_for_payment.get("is_renewal_of_order")
-    if prev_id:
-        previous = get_order_data(prev_id)
-        if not previous:
-            return
-
-        new_balance = current_balance - plan_price
-        update_user_balance(user_id, new_balance)
-
-        if _is_previous_order_expired(previous):
-            update_order_status(order_id=previous["id"], new_status="renewed")
-            update_order_status(order_id=waiting_for_payment["id"], new_status="active")
-
-            group_info = get_order_plan_group_name(order_id=waiting_for_payment["id"]) or {}
-            group_name = group_info.get("group_name", "Starter-Bot")
-
-            IBSng.reset_account_client(username=waiting_for_payment["username"])
-            change_group(waiting_for_payment["username"], group_name)
-            _notify_user_renewal_activated(order=waiting_for_payment, new_balance=new_balance)
-        else:
-            update_order_status(order_id=previous["id"], new_status="waiting_for_renewal")
-            update_order_status(order_id=waiting_for_payment["id"], new_status="reserved")
-            _notify_user_renewal_reserved(order=waiting_for_payment, new_balance=new_balance)
-        return
-
-    new_balance = current_balance - plan_price
-    update_user_balance(user_id, new_balance)
-    update_order_status(order_id=waiting_for_payment["id"], new_status="active")
-
-    group_info = get_order_plan_group_name(order_id=waiting_for_payment["id"]) or {}
-    group_name = group_info.get("group_name", "Starter-Bot")
-    change_group(waiting_for_payment["username"], group_name)
-    _notify_user_purchase_activated(order=waiting_for_payment, new_balance=new_balance)
-
-
-def _is_previous_order_expired(order: dict) -> bool:
-    exp_str: Optional[str] = order.get("expires_at")
-    if not exp_str:
-        return False
-
-    exp_jdt = jdatetime.datetime.strptime(exp_str, "%Y-%m-%d %H:%M")
-    exp_greg = exp_jdt.togregorian()
-    return exp_greg < datetime.datetime.now()
-
-
-def format_price(amount: Union[int, float]) -> str:
-    try:
-        return f"{int(amount):,}"
-    except Exception:
-        return str(amount)
-
-
-def _send_notification(user_id: int, msg: str) -> None:
-    if int(user_id or 0) <= 0:
-        return
-    send_scheduler_notification(chat_id=user_id, text=msg, parse_mode="HTML", timeout=15)
-
-
-def _notify_user_purchase_activated(order: dict, new_balance: int) -> None:
-    plan_name = get_plan_name(plan_id=order.get("plan_id"))
-    username = order["username"]
-    account = get_account_credentials_by_username(username)
-    password = account.get("password") if account else None
-
-    lines = [
-        "✅ پرداخت شما تأیید شد و سرویس جدیدتان فعال گردید.",
-        "",
-        f"🔸 پلن: {plan_name}",
-        f"👤 نام کاربری: <code>{username}</code>",
-    ]
-    if password:
-        lines.append(f"🔐 رمز عبور: <code>{password}</code>")
-    lines.extend([
-        f"💰 موجودی: {format_price(new_balance)} تومان",
-        get_volume_policy_alert(),
-    ])
-    _send_notification(order["user_id"], "\n".join(lines))
-
-
-def _notify_user_renewal_activated(order: dict, new_balance: int) -> None:
-    plan_name = get_plan_name(plan_id=order.get("plan_id"))
-    username = order["username"]
-    msg = (
-        f"✅ پرداخت شما با موفقیت ثبت شد و سرویس شما فعال گردید.\n\n"
-        f"🔸 پلن: {plan_name}\n"
-        f"👤 نام کاربری: <code>{username}</code>\n"
-        f"💰 موجودی: {format_price(new_balance)} تومان\n"
-        f"{get_volume_policy_alert()}"
-    )
-    _send_notification(order["user_id"], msg)
-
-
-def _notify_user_renewal_reserved(order: dict, new_balance: int) -> None:
-    plan_name = get_plan_name(plan_id=order.get("plan_id"))
-    username = order["username"]
-    msg = (
-        f"✅ پرداخت شما با موفقیت ثبت شد.\n"
-        f"سرویس شما پس از پایان دوره‌ی فعلی به‌صورت خودکار فعال می‌گردد.\n"
-        f"برای فعال‌سازی سرویس جدید پیش از موعد، از منوی ربات گزینه «🚀 فعال‌سازی سرویس ذخیره» را بزنید.\n\n"
-        f"🔸 پلن: {plan_name}\n"
-        f"👤 نام کاربری: <code>{username}</code>\n"
-        f"💰 موجودی: {format_price(new_balance)} تومان\n"
-        f"{get_volume_policy_alert()}"
-    )
-    _send_notification(order["user_id"], msg)
+async def activate_waiting_for_payment_orders() -> None:
+    """Charge and activate waiting_for_payment orders whose owners now have enough balance."""
+    await run_activation(("waiting_for_payment",))
@@ -0,0 +1,240 @@
+import asyncio
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Union
+
+import jdatetime
+
+from config import DB_PATH
+from services.executors import DB, NOTIFY, run_in_executor
+from services.ibs_outbox import account_reset_steps, enqueue_user_edit, wake_ibs_outbox
+from services.scheduler_engine import holds_job_lease
+from services.scheduler_services.telegram_safe import send_scheduler_notification
+from services.usage_policy import get_volume_policy_alert
+from services.wallet import apply_wallet_delta
+
+DEFAULT_GROUP_NAME = "Starter-Bot"
+
+# expires_at is stored as zero-padded Jalali "YYYY-MM-DD HH:MM", so it compares correctly as text
+# against the current Jalali time and the expiry check can stay in SQL.
+CANDIDATES_QUERY = """
+    SELECT o.*,
+           p.name AS plan_name,
+           p.group_name AS plan_group_name,
+           p.duration_months AS plan_duration_months,
+           prev.id AS prev_id,
+           prev.status AS prev_status,
+           CASE
+               WHEN prev.id IS NULL THEN 0
+               WHEN prev.status = 'expired' THEN 1
+               WHEN COALESCE(prev.expires_at, '') != '' AND prev.expires_at < ? THEN 1
+               ELSE 0
+           END AS prev_expired,
+           COALESCE(u.balance, 0) AS user_balance,
+           (SELECT a.password FROM accounts a WHERE a.username = o.username LIMIT 1) AS account_password
+    FROM orders o
+    LEFT JOIN orders prev ON prev.id = o.is_renewal_of_order
+    LEFT JOIN plans p ON p.id = o.plan_id
+    LEFT JOIN users u ON u.id = o.user_id
+    WHERE o.status IN ({placeholders})
+    ORDER BY o.created_at ASC, o.id ASC
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _now_jalali_text() -> str:
+    return jdatetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+
+
+def format_price(amount: Union[int, float]) -> str:
+    try:
+        return f"{int(amount):,}"
+    except Exception:
+        return str(amount)
+
+
+def fetch_activation_candidates(statuses: Iterable[str]) -> List[Dict]:
+    statuses = tuple(statuses)
+    placeholders = ", ".join("?" for _ in statuses)
+    with _connect() as conn:
+        rows = conn.execute(
+            CANDIDATES_QUERY.format(placeholders=placeholders),
+            (_now_jalali_text(), *statuses),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def _set_status(cur: sqlite3.Cursor, order_id: int, new_status: str, expected_status: str) -> bool:
+    zero_remaining = ", remaining_volume_mb = 0" if new_status in ("renewed", "expired") else ""
+    cur.execute(
+        f"UPDATE orders SET status = ?{zero_remaining} WHERE id = ? AND status = ?",
+        (new_status, order_id, expected_status),
+    )
+    return cur.rowcount == 1
+
+
+def _plan_transition(order: Dict) -> Optional[Dict]:
+    """Decide what an activatable order turns into; None means "not yet"."""
+    if order["status"] == "reserved":
+        if not order["prev_id"] or not order["prev_expired"]:
+            return None
+        return {"order_status": "active", "prev_status": "renewed", "reset": True, "notice": "reserved_activated"}
+
+    # waiting_for_payment
+    if order["is_renewal_of_order"] and not order["prev_id"]:
+        return None  # predecessor vanished
+    if int(order["user_balance"] or 0) < int(order["price"] or 0):
+        return None
+    if not order["is_renewal_of_order"]:
+        return {"order_status": "active", "prev_status": None, "reset": False, "notice": "purchase_activated"}
+    if order["prev_expired"]:
+        return {"order_status": "active", "prev_status": "renewed", "reset": True, "notice": "renewal_activated"}
+    return {"order_status": "reserved", "prev_status": "waiting_for_renewal", "reset": False, "notice": "renewal_reserved"}
+
+
+def apply_transitions(candidates: List[Dict]) -> List[Dict]:
+    """Charge and move every ready order in one write transaction; return the applied ones.
+
+    The job's lease is checked inside that transaction, so a run that lost it changes nothing.
+    """
+    applied: List[Dict] = []
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        if not holds_job_lease(cur):
+            conn.rollback()
+            print("activation: lease lost, skipping this pass.")
+            return applied
+        for order in candidates:
+            plan = _plan_transition(order)
+            if not plan:
+                continue
+
+            cur.execute("SAVEPOINT activation")
+            new_balance = None
+            if order["status"] == "waiting_for_payment":
+                charge = apply_wallet_delta(
+                    cur, order["user_id"], -int(order["price"] or 0), "order_payment",
+                    ref_type="order", ref_id=order["id"], require_funds=True,
+                    idempotency_key=f"order_payment:{order['id']}",
+                )
+                if not charge["ok"]:
+                    cur.execute("ROLLBACK TO activation")
+                    cur.execute("RELEASE activation")
+                    continue
+                new_balance = charge["balance"]
+
+            moved = _set_status(cur, order["id"], plan["order_status"], order["status"])
+            if moved and plan["prev_status"]:
+                _set_status(cur, order["prev_id"], plan["prev_status"], order["prev_status"])
+            if not moved:
+                # Another run already handled it; undo the charge for this order only.
+                cur.execute("ROLLBACK TO activation")
+                cur.execute("RELEASE activation")
+                continue
+
+            _enqueue_ibs_sync(cur, order, plan)
+            cur.execute("RELEASE activation")
+            applied.append({**order, **plan, "new_balance": new_balance})
+        conn.commit()
+    if applied:
+        wake_ibs_outbox()
+    return applied
+
+
+def _enqueue_ibs_sync(cur: sqlite3.Cursor, order: Dict, plan: Dict) -> None:
+    group = order.get("plan_group_name") or DEFAULT_GROUP_NAME
+    if plan["reset"]:
+        steps = account_reset_steps(group)
+    elif plan["order_status"] == "active":
+        steps = [["set_group", group]]
+    else:
+        return
+    enqueue_user_edit(
+        cur,
+        str(order["username"]),
+        steps,
+        idempotency_key=f"activation:{order['id']}",
+        notify_user_id=order.get("user_id"),
+        description=f"فعال‌سازی سفارش {order['id']}",
+    )
+
+
+def _notify_safely(item: Dict) -> Optional[str]:
+    try:
+        _notify(item)
+    except Exception as exc:
+        return f"order {item['id']}: {type(exc).__name__}: {exc}"
+    return None
+
+
+async def run_activation(statuses: Iterable[str]) -> Dict[str, int]:
+    candidates = await run_in_executor(DB, fetch_activation_candidates, statuses)
+    if not candidates:
+        return {"candidates": 0, "applied": 0, "notify_failed": 0}
+
+    # IBS resets/regroups are queued in the same transaction and applied by the IBS outbox worker.
+    applied = await run_in_executor(DB, apply_transitions, candidates)
+    results = await asyncio.gather(*(run_in_executor(NOTIFY, _notify_safely, item) for item in applied))
+    failures = [error for error in results if error]
+    for error in failures:
+        print(f"[!] activation notify failed: {error}")
+    return {"candidates": len(candidates), "applied": len(applied), "notify_failed": len(failures)}
+
+
+# ----------------------------------------------------------------------------
+# User notifications
+# ----------------------------------------------------------------------------
+
+def _notify(item: Dict) -> None:
+    if int(item.get("user_id") or 0) <= 0:
+        return
+
+    notice = item["notice"]
+    username = item["username"]
+    plan_name = item.get("plan_name")
+    if notice == "reserved_activated":
+        msg = (
+            f"✅ دوست عزیز،\n"
+            f"سرویس رزرو شما با نام کاربری <code>{username}</code> با موفقیت فعال شد.\n"
+            f"{get_volume_policy_alert()}\n\n"
+            f"✨ در صورت بروز هرگونه مشکل با پشتیبانی در تماس باشید."
+        )
+    elif notice == "purchase_activated":
+        lines = [
+            "✅ پرداخت شما تأیید شد و سرویس جدیدتان فعال گردید.",
+            "",
+            f"🔸 پلن: {plan_name}",
+            f"👤 نام کاربری: <code>{username}</code>",
+        ]
+        if item.get("account_password"):
+            lines.append(f"🔐 رمز عبور: <code>{item['account_password']}</code>")
+        lines.extend([
+            f"💰 موجودی: {format_price(item['new_balance'])} تومان",
+            get_volume_policy_alert(),
+        ])
+        msg = "\n".join(lines)
+    elif notice == "renewal_activated":
+        msg = (
+            f"✅ پرداخت شما با موفقیت ثبت شد و سرویس شما فعال گردید.\n\n"
+            f"🔸 پلن: {plan_name}\n"
+            f"👤 نام کاربری: <code>{username}</code>\n"
+            f"💰 موجودی: {format_price(item['new_balance'])} تومان\n"
+            f"{get_volume_policy_alert()}"
+        )
+    else:
+        msg = (
+            f"✅ پرداخت شما با موفقیت ثبت شد.\n"
+            f"سرویس شما پس از پایان دوره‌ی فعلی به‌صورت خودکار فعال می‌گردد.\n"
+            f"برای فعال‌سازی سرویس جدید پیش از موعد، از منوی ربات گزینه «🚀 فعال‌سازی سرویس ذخیره» را بزنید.\n\n"
+            f"🔸 پلن: {plan_name}\n"
+            f"👤 نام کاربری: <code>{username}</code>\n"
+            f"💰 موجودی: {format_price(item['new_balance'])} تومان\n"
+            f"{get_volume_policy_alert()}"
+        )
+
+    send_scheduler_notification(chat_id=item["user_id"], text=msg, parse_mode="HTML", timeout=15)
@@ -11,6 +11,7 @@ from services.IBSng import (
     get_user_radius_attribute,
     unlock_user,
 )
+from services.ibs_circuit import IBSUnavailable, ibs_breaker
 from services.scheduler_services.telegram_safe import send_scheduler_notification
 from services.usage_policy import (
     get_limit_speed_display,
@@ -348,6 +349,10 @@ def limit_speed():
         if limit_mb <= 0:
             continue
 
+        if not ibs_breaker.allows():
+            print("[!] IBS circuit open, ending limit pass early.")
+            break
+
         # Migrate previously locked users to the new policy: always keep them online.
         if usage_lock_applied:
             try:
@@ -417,5 +422,8 @@ def limit_speed():
                     except Exception as exc:
                         print(f"[!] failed pre-limit notify admin {admin}: {exc}")
 
+        except IBSUnavailable as exc:
+            print(f"[!] IBS unavailable, ending limit pass early: {exc}")
+            break
         except Exception as exc:
             print(f"[!] failed to apply limit for order_id={order_id}, username={username}: {exc}")
@@ -0,0 +1,101 @@
+from datetime import timedelta
+
+import jdatetime
+
+from config import ORDER_TIME_CHECK_BASE_MINUTES, ORDER_TIME_CHECK_MAX_MINUTES
+from services.IBSng import get_user_exp_date, get_user_start_date, get_usernames_logged_in_since
+from services.db import (
+    get_active_orders_without_time,
+    mark_orders_time_checked,
+    record_order_time_check,
+    update_order_expires_at,
+    update_order_starts_at,
+)
+from services.ibs_circuit import IBSUnavailable, ibs_breaker
+
+# Most orders without starts_at/expires_at belong to accounts nobody has logged into yet, and
+# asking IBSng about each of them every run is wasted work. Each order remembers when it was
+# last checked and how many checks came back empty. One connection report per run says which
+# accounts logged in since the oldest check; only those (plus never-checked orders) get the
+# per-user lookup. When the report cannot be read, orders fall back to their backoff schedule.
+
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def _backoff_minutes(attempts: int) -> int:
+    return min(ORDER_TIME_CHECK_BASE_MINUTES * 2 ** max(attempts - 1, 0), ORDER_TIME_CHECK_MAX_MINUTES)
+
+
+def _logged_in_since(orders):
+    checked = [order['ibs_time_checked_at'] for order in orders if order.get('ibs_time_checked_at')]
+    if not checked:
+        return None
+    try:
+        return get_usernames_logged_in_since(min(checked))
+    except IBSUnavailable:
+        raise
+    except Exception as e:
+        print(f"Connection report failed, using per-order backoff: {e}")
+        return None
+
+
+def update_orders_time_from_ibs():
+    orders = get_active_orders_without_time()
+    if not orders:
+        return
+    if not ibs_breaker.allows():
+        print("IBS circuit open, postponing order time sync.")
+        return
+
+    now = jdatetime.datetime.now()
+    checked_at = now.strftime(TIME_FORMAT)
+    try:
+        logged_in = _logged_in_since(orders)
+    except IBSUnavailable as e:
+        print(f"IBS unavailable, postponing order time sync: {e}")
+        return
+
+    quiet_ids = []
+    fetched = found = 0
+    for order in orders:
+        username = str(order['username'])
+        if order.get('ibs_time_checked_at'):
+            if logged_in is not None:
+                if username not in logged_in:
+                    quiet_ids.append(order['id'])
+                    continue
+            elif (order.get('ibs_time_next_check_at') or '') > checked_at:
+                continue
+
+        if not ibs_breaker.allows():
+            print("IBS circuit open, postponing order time sync.")
+            break
+        try:
+            starts_at = get_user_start_date(username)
+            expires_at = get_user_exp_date(username)
+            fetched += 1
+
+            if starts_at:
+                update_order_starts_at(order['id'], starts_at)
+            if expires_at:
+                update_order_expires_at(order['id'], expires_at)
+            if starts_at and expires_at:
+                found += 1
+                record_order_time_check(order['id'], checked_at, 0, None)
+            else:
+                attempts = (order.get('ibs_time_check_attempts') or 0) + 1
+                next_check_at = (now + timedelta(minutes=_backoff_minutes(attempts))).strftime(TIME_FORMAT)
+                record_order_time_check(order['id'], checked_at, attempts, next_check_at)
+
+        except IBSUnavailable as e:
+            print(f"IBS unavailable, postponing order time sync: {e}")
+            break
+        except Exception as e:
+            print(f"خطا در دریافت اطلاعات برای سفارش {order['id']}: {e}")
+
+    # The report covered these up to checked_at, so the next report can start from there.
+    mark_orders_time_checked(quiet_ids, checked_at)
+    print(
+        f"Order time sync: {len(orders)} without times, {fetched} fetched, {found} completed, "
+        f"{len(quiet_ids)} skipped (no login)"
+    )
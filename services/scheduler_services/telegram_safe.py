@@ -5,6 +5,7 @@ from typing import Any
 import requests
 
 from config import BOT_TOKEN
+from services.metrics import NOTIFICATIONS, inc
 
 _IGNORABLE_ERROR_TOKENS = (
     "bot was blocked by the user",
@@ -45,9 +46,11 @@ def send_scheduler_notification(chat_id: int, text: str, *, parse_mode: str = "H
         response = requests.post(url, data=data, timeout=timeout)
     except Exception as exc:
         print(f"[!] scheduler notify network error chat_id={chat_id}: {exc}")
+        inc(NOTIFICATIONS, channel="scheduler", outcome="network_error")
         return False
 
     if response.ok:
+        inc(NOTIFICATIONS, channel="scheduler", outcome="sent")
         return True
 
     description = _extract_description(response)
@@ -56,8 +59,10 @@ def send_scheduler_notification(chat_id: int, text: str, *, parse_mode: str = "H
             f"[i] scheduler notify skipped chat_id={chat_id}, "
             f"status={response.status_code}, reason={description or '-'}"
         )
+        inc(NOTIFICATIONS, channel="scheduler", outcome="unreachable")
         return False
 
+    inc(NOTIFICATIONS, channel="scheduler", outcome="failed")
     print(
         f"[!] scheduler notify failed chat_id={chat_id}, "
         f"status={response.status_code}, reason={description or '-'}"
@@ -1,3 +1,4 @@
+import json
 import sqlite3
 import time
 from datetime import datetime, timedelta
@@ -6,16 +7,24 @@ import jdatetime
 
 from config import DB_PATH
 from services.IBSng import get_usage_from_ibs
+from services.ibs_circuit import IBSUnavailable, ibs_breaker
+from services.usage_history import append_usage_sample
 
 REQUEST_DELAY_SECONDS = 0.4
-PRIORITY_BATCH_SIZE = 160
-FAIRNESS_BATCH_SIZE = 90
+REFRESH_BATCH_SIZE = 250
 MAX_STALENESS_MINUTES = 6 * 60
 FAST_UPDATE_INTERVAL_MINUTES = 10
 MEDIUM_UPDATE_INTERVAL_MINUTES = 60
 SLOW_UPDATE_INTERVAL_MINUTES = 120
 NEAR_LIMIT_RATIO = 0.90
 MID_LIMIT_RATIO = 0.75
+# Polls are scheduled just before the next of these usage ratios (limit_speed's pre-limit
+# and hard limit) could be crossed at the order's recent consumption rate.
+FORECAST_THRESHOLDS = (0.95, 1.0)
+FORECAST_SAFETY_FACTOR = 0.5
+PEAK_RATE_MB_PER_HOUR = 4 * 1024
+RATE_HISTORY_SIZE = 6
+RATE_HISTORY_WINDOW_HOURS = 48
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 JALALI_MINUTE_FORMAT = "%Y-%m-%d %H:%M"
 
@@ -54,84 +63,119 @@ def _pick_update_interval_minutes(limit_mb: int, usage_effective_mb: int) -> int
     return SLOW_UPDATE_INTERVAL_MINUTES
 
 
-def _fetch_priority_orders_for_usage_update(cur: sqlite3.Cursor):
-    cur.execute(
-        f"""
-        SELECT
-            id,
-            username,
-            starts_at,
-            expires_at,
-            usage_last_update,
-            volume_gb,
-            extra_volume_gb,
-            overused_volume_gb,
-            usage_total_mb,
-            usage_applied_speed
-        FROM orders
-        WHERE status IN ('active', 'waiting_for_renewal', 'waiting_for_renewal_not_paid')
-          AND starts_at IS NOT NULL
-          AND username IS NOT NULL
-        ORDER BY
-            CASE
-                WHEN (COALESCE(volume_gb, 0) + COALESCE(extra_volume_gb, 0) + COALESCE(overused_volume_gb, 0)) > 0
-                     AND COALESCE(usage_total_mb, 0) >= ((COALESCE(volume_gb, 0) + COALESCE(extra_volume_gb, 0) + COALESCE(overused_volume_gb, 0)) * 1024 * {NEAR_LIMIT_RATIO})
-                THEN 0
-                WHEN (COALESCE(volume_gb, 0) + COALESCE(extra_volume_gb, 0) + COALESCE(overused_volume_gb, 0)) > 0
-                     AND COALESCE(usage_total_mb, 0) >= ((COALESCE(volume_gb, 0) + COALESCE(extra_volume_gb, 0) + COALESCE(overused_volume_gb, 0)) * 1024 * {MID_LIMIT_RATIO})
-                THEN 1
-                ELSE 2
-            END,
-            CASE WHEN usage_last_update IS NULL THEN 0 ELSE 1 END,
-            usage_last_update ASC
-        LIMIT {PRIORITY_BATCH_SIZE}
-        """
-    )
-    return cur.fetchall()
+ORDER_COLUMNS = """
+    id,
+    username,
+    starts_at,
+    expires_at,
+    usage_last_update,
+    volume_gb,
+    extra_volume_gb,
+    overused_volume_gb,
+    usage_total_mb,
+    usage_applied_speed,
+    usage_rate_history
+"""
+REFRESHABLE_STATUSES = "('active', 'waiting_for_renewal', 'waiting_for_renewal_not_paid')"
+
+
+def _rate_samples(history_json):
+    try:
+        samples = json.loads(history_json or "[]")
+        return [(float(at), int(total_mb)) for at, total_mb in samples]
+    except (TypeError, ValueError):
+        return []
+
+
+def _append_rate_sample(samples, at: float, total_mb: int):
+    # A drop in the counter means the account was reset (renewal, conversion); start over.
+    if samples and total_mb < samples[-1][1]:
+        samples = []
+    samples = [sample for sample in samples if at - sample[0] <= RATE_HISTORY_WINDOW_HOURS * 3600]
+    samples.append((at, total_mb))
+    return samples[-RATE_HISTORY_SIZE:]
+
+
+def _forecast_rate_mb_per_hour(samples):
+    """Consumption rate used for scheduling: the faster of the whole window and the last interval."""
+    if len(samples) < 2:
+        return None
+    rates = []
+    for (start_at, start_mb), (end_at, end_mb) in ((samples[0], samples[-1]), (samples[-2], samples[-1])):
+        hours = (end_at - start_at) / 3600
+        if hours > 0:
+            rates.append(max(end_mb - start_mb, 0) / hours)
+    return max(rates) if rates else None
+
+
+def _pick_next_refresh_minutes(limit_mb: int, usage_effective_mb: int, rate_mb_per_hour) -> float:
+    """Minutes until the next poll, early enough to catch the next threshold being crossed."""
+    if limit_mb <= 0:
+        return MAX_STALENESS_MINUTES
+    if rate_mb_per_hour is None:
+        return _pick_update_interval_minutes(limit_mb=limit_mb, usage_effective_mb=usage_effective_mb)
+
+    usage_mb = max(usage_effective_mb, 0)
+    target_mb = next((limit_mb * ratio for ratio in FORECAST_THRESHOLDS if usage_mb < limit_mb * ratio), None)
+    if target_mb is None:
+        # Already past the limit; limit_speed has done its part, only keep the numbers fresh.
+        return MEDIUM_UPDATE_INTERVAL_MINUTES
 
+    headroom_mb = target_mb - usage_mb
+    # An idle account can start a large download at any time, so never wait longer than it
+    # would take to cover the headroom at PEAK_RATE_MB_PER_HOUR.
+    minutes = headroom_mb / PEAK_RATE_MB_PER_HOUR * 60
+    if rate_mb_per_hour > 0:
+        minutes = min(minutes, headroom_mb / rate_mb_per_hour * 60 * FORECAST_SAFETY_FACTOR)
+    return min(max(minutes, FAST_UPDATE_INTERVAL_MINUTES), MAX_STALENESS_MINUTES)
 
-def _fetch_fairness_orders_for_usage_update(cur: sqlite3.Cursor):
+
+def _jalali_after(now: datetime, minutes: float) -> str:
+    return jdatetime.datetime.fromgregorian(datetime=now + timedelta(minutes=minutes)).strftime(DATETIME_FORMAT)
+
+
+def _fetch_due_orders_for_usage_update(cur: sqlite3.Cursor, now_jalali: str):
+    # Two range scans on idx_orders_usage_refresh: never scheduled first, then the most overdue.
     cur.execute(
         f"""
-        SELECT
-            id,
-            username,
-            starts_at,
-            expires_at,
-            usage_last_update,
-            volume_gb,
-            extra_volume_gb,
-            overused_volume_gb,
-            usage_total_mb,
-            usage_applied_speed
+        SELECT {ORDER_COLUMNS}
         FROM orders
-        WHERE status IN ('active', 'waiting_for_renewal', 'waiting_for_renewal_not_paid')
+        WHERE status IN {REFRESHABLE_STATUSES}
+          AND next_usage_refresh_at IS NULL
           AND starts_at IS NOT NULL
           AND username IS NOT NULL
-        ORDER BY
-            CASE WHEN usage_last_update IS NULL THEN 0 ELSE 1 END,
-            usage_last_update ASC
-        LIMIT {FAIRNESS_BATCH_SIZE}
+        LIMIT {REFRESH_BATCH_SIZE}
         """
     )
-    return cur.fetchall()
+    orders = cur.fetchall()
+    if len(orders) < REFRESH_BATCH_SIZE:
+        cur.execute(
+            f"""
+            SELECT {ORDER_COLUMNS}
+            FROM orders
+            WHERE status IN {REFRESHABLE_STATUSES}
+              AND next_usage_refresh_at <= ?
+              AND starts_at IS NOT NULL
+              AND username IS NOT NULL
+            ORDER BY next_usage_refresh_at ASC
+            LIMIT {REFRESH_BATCH_SIZE - len(orders)}
+            """,
+            (now_jalali,),
+        )
+        orders.extend(cur.fetchall())
+    return orders
+
+
+def _schedule_next_refresh(cur: sqlite3.Cursor, order_id: int, next_refresh_at: str):
+    cur.execute("UPDATE orders SET next_usage_refresh_at = ? WHERE id = ?", (next_refresh_at, order_id))
 
 
 def update_usages_by_volume():
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
 
-    priority_orders = _fetch_priority_orders_for_usage_update(cur)
-    fairness_orders = _fetch_fairness_orders_for_usage_update(cur)
-    orders = []
-    seen_order_ids = set()
-    for row in priority_orders + fairness_orders:
-        order_id = int(row[0] or 0)
-        if order_id <= 0 or order_id in seen_order_ids:
-            continue
-        seen_order_ids.add(order_id)
-        orders.append(row)
     now = datetime.now()
+    orders = _fetch_due_orders_for_usage_update(cur, get_now_local_jalali_str())
 
     for row in orders:
         (
@@ -145,20 +189,29 @@ def update_usages_by_volume():
             overused_volume_gb,
             usage_total_mb,
             usage_applied_speed,
+            usage_rate_history,
         ) = row
 
         if not username:
             continue
         if not starts_at or not expires_at:
+            # order_time_sync fills expires_at soon; look again on a fast pass.
+            _schedule_next_refresh(cur, order_id, _jalali_after(now, FAST_UPDATE_INTERVAL_MINUTES))
+            conn.commit()
             continue
 
         try:
             exp_dt = parse_jalali_datetime_flexible(expires_at)
         except Exception as exc:
             print(f"[!] invalid expires_at for order_id={order_id}: {expires_at} | {exc}")
+            _schedule_next_refresh(cur, order_id, _jalali_after(now, MAX_STALENESS_MINUTES))
+            conn.commit()
             continue
 
         if exp_dt < now and usage_last_update is not None:
+            # Waiting for expire_orders; keep it out of the head of the queue meanwhile.
+            _schedule_next_refresh(cur, order_id, _jalali_after(now, MAX_STALENESS_MINUTES))
+            conn.commit()
             continue
 
         limit_mb = _get_limit_mb(
@@ -166,17 +219,10 @@ def update_usages_by_volume():
             extra_volume_gb=extra_volume_gb,
             overused_volume_gb=float(overused_volume_gb or 0),
         )
-        usage_effective_mb = _effective_usage_mb(usage_total_mb=int(usage_total_mb or 0))
-        refresh_interval = _pick_update_interval_minutes(limit_mb=limit_mb, usage_effective_mb=usage_effective_mb)
-
-        if usage_last_update:
-            try:
-                last_update_dt = parse_jalali_datetime_flexible(usage_last_update)
-                elapsed_minutes = (now - last_update_dt).total_seconds() / 60
-                if elapsed_minutes < refresh_interval and elapsed_minutes < MAX_STALENESS_MINUTES:
-                    continue
-            except Exception as exc:
-                print(f"[!] invalid usage_last_update for order_id={order_id}: {usage_last_update} | {exc}")
+
+        if not ibs_breaker.allows():
+            print("[!] IBS circuit open, ending usage pass early.")
+            break
 
         try:
             usage = get_usage_from_ibs(username, starts_at, expires_at)
@@ -187,10 +233,24 @@ def update_usages_by_volume():
             sent_mb = int(sent_mb or 0)
             recv_mb = int(recv_mb or 0)
             total_mb = sent_mb + recv_mb
+        except IBSUnavailable as exc:
+            print(f"[!] IBS unavailable, ending usage pass early: {exc}")
+            break
         except Exception as exc:
             print(f"[!] IBS error for order_id={order_id}, username={username}: {exc}")
+            _schedule_next_refresh(cur, order_id, _jalali_after(now, FAST_UPDATE_INTERVAL_MINUTES))
+            conn.commit()
             continue
 
+        fetched_at = datetime.now()
+        samples = _append_rate_sample(_rate_samples(usage_rate_history), fetched_at.timestamp(), total_mb)
+        refresh_minutes = _pick_next_refresh_minutes(
+            limit_mb=limit_mb,
+            usage_effective_mb=_effective_usage_mb(usage_total_mb=total_mb),
+            rate_mb_per_hour=_forecast_rate_mb_per_hour(samples),
+        )
+        next_refresh_dt = min(fetched_at + timedelta(minutes=refresh_minutes), max(exp_dt, fetched_at))
+
         cur.execute(
             """
             UPDATE orders
@@ -199,7 +259,9 @@ def update_usages_by_volume():
                 usage_received_mb = ?,
                 usage_total_mb = ?,
                 remaining_volume_mb = ?,
-                usage_last_update = ?
+                usage_last_update = ?,
+                usage_rate_history = ?,
+                next_usage_refresh_at = ?
             WHERE id = ?
             """,
             (
@@ -208,14 +270,17 @@ def update_usages_by_volume():
                 total_mb,
                 max(limit_mb - total_mb, 0),
                 get_now_local_jalali_str(),
+                json.dumps([[int(at), mb] for at, mb in samples]),
+                _jalali_after(next_refresh_dt, 0),
                 order_id,
             ),
         )
+        append_usage_sample(cur, order_id, total_mb, fetched_at)
 
         conn.commit()
         print(f"[+] usage updated for order_id={order_id}, username={username}, total_mb={total_mb}")
 
-        time.sleep(REQUEST_DELAY_SECONDS)
+        time.sleep(REQUEST_DELAY_SECONDS + ibs_breaker.pace_seconds())
 
     conn.close()
 
@@ -0,0 +1,187 @@
+import sqlite3
+import sys
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import jdatetime
+
+from config import DB_PATH
+
+# One row per order per (local, gregorian) day. ``samples`` packs the day's readings as int32
+# pairs (minute of day, change in usage_total_mb since the previous reading), so a day polled
+# every ten minutes is about a kilobyte. ``base_total_mb`` is the total before the first
+# reading of the day, which makes every row decodable on its own, and ``used_mb`` keeps the
+# day's consumption so the 7-day views never touch the blobs. Older days are thinned out by
+# compact_usage_history(): hourly after RAW_DAYS, one reading per day after HOURLY_DAYS, and
+# dropped after RETENTION_DAYS.
+
+RAW_DAYS = 2
+HOURLY_DAYS = 30
+RETENTION_DAYS = 180
+DAY_FORMAT = "%Y-%m-%d"
+
+
+def _pack(pairs: List[Tuple[int, int]]) -> bytes:
+    values = array("i")
+    for minute, delta in pairs:
+        values.append(minute)
+        values.append(delta)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack(blob) -> List[Tuple[int, int]]:
+    values = array("i")
+    if blob:
+        values.frombytes(bytes(blob))
+        if sys.byteorder != "little":
+            values.byteswap()
+    return [(values[index], values[index + 1]) for index in range(0, len(values) - 1, 2)]
+
+
+def _clamp_int32(value: int) -> int:
+    return max(min(int(value), 2 ** 31 - 1), -(2 ** 31))
+
+
+def append_usage_sample(cur: sqlite3.Cursor, order_id: int, total_mb: int, at: datetime = None):
+    """Record one usage_total_mb reading; runs on the caller's cursor and leaves the commit to it."""
+    at = at or datetime.now()
+    day = at.strftime(DAY_FORMAT)
+    minute = at.hour * 60 + at.minute
+    total_mb = int(total_mb or 0)
+
+    row = cur.execute(
+        "SELECT base_total_mb, last_total_mb, used_mb, samples FROM usage_history WHERE order_id = ? AND day = ?",
+        (order_id, day),
+    ).fetchone()
+    if row is None:
+        previous = cur.execute(
+            "SELECT last_total_mb FROM usage_history WHERE order_id = ? AND day < ? ORDER BY day DESC LIMIT 1",
+            (order_id, day),
+        ).fetchone()
+        base_total_mb = previous[0] if previous else total_mb
+        pairs, last_total_mb, used_mb = [], base_total_mb, 0
+    else:
+        base_total_mb, last_total_mb, used_mb, blob = row
+        pairs = _unpack(blob)
+
+    delta = _clamp_int32(total_mb - last_total_mb)
+    if pairs and pairs[-1][0] == minute:
+        # Two readings in the same minute: keep one, with the combined change.
+        delta = _clamp_int32(pairs[-1][1] + delta)
+        used_mb -= max(pairs[-1][1], 0)
+        pairs[-1] = (minute, delta)
+    else:
+        pairs.append((minute, delta))
+    # A negative change is a counter reset (renewal); it is not consumption.
+    used_mb += max(delta, 0)
+
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO usage_history (
+            order_id, day, resolution_minutes, base_total_mb, last_total_mb, used_mb, sample_count, samples
+        )
+        VALUES (?, ?, 0, ?, ?, ?, ?, ?)
+        """,
+        (order_id, day, base_total_mb, total_mb, used_mb, len(pairs), _pack(pairs)),
+    )
+
+
+def _downsample(pairs: List[Tuple[int, int]], bucket_minutes: int) -> List[Tuple[int, int]]:
+    """Keep the last reading of each bucket, carrying the skipped changes into it."""
+    result: List[Tuple[int, int]] = []
+    for minute, delta in pairs:
+        bucket = minute // bucket_minutes
+        if result and result[-1][0] // bucket_minutes == bucket:
+            result[-1] = (minute, _clamp_int32(result[-1][1] + delta))
+        else:
+            result.append((minute, delta))
+    return result
+
+
+def compact_usage_history(now: datetime = None) -> Dict[str, int]:
+    now = now or datetime.now()
+    raw_before = (now - timedelta(days=RAW_DAYS)).strftime(DAY_FORMAT)
+    hourly_before = (now - timedelta(days=HOURLY_DAYS)).strftime(DAY_FORMAT)
+    retention_before = (now - timedelta(days=RETENTION_DAYS)).strftime(DAY_FORMAT)
+    stats = {"hourly": 0, "daily": 0, "deleted": 0}
+
+    with sqlite3.connect(DB_PATH) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM usage_history WHERE day < ?", (retention_before,))
+        stats["deleted"] = cur.rowcount
+
+        for label, day_before, resolution in (("daily", hourly_before, 24 * 60), ("hourly", raw_before, 60)):
+            rows = cur.execute(
+                """
+                SELECT order_id, day, samples
+                FROM usage_history
+                WHERE day < ? AND resolution_minutes < ?
+                """,
+                (day_before, resolution),
+            ).fetchall()
+            for order_id, day, blob in rows:
+                pairs = _downsample(_unpack(blob), resolution)
+                cur.execute(
+                    """
+                    UPDATE usage_history
+                    SET resolution_minutes = ?, sample_count = ?, samples = ?
+                    WHERE order_id = ? AND day = ?
+                    """,
+                    (resolution, len(pairs), _pack(pairs), order_id, day),
+                )
+            stats[label] = len(rows)
+        conn.commit()
+    return stats
+
+
+def get_daily_usage(order_id: int, days: int = 7, today: datetime = None) -> List[Dict]:
+    """Consumption per day for the last ``days`` days (oldest first, missing days as zero)."""
+    today = today or datetime.now()
+    first_day = today - timedelta(days=days - 1)
+    with sqlite3.connect(DB_PATH) as conn:
+        rows = dict(conn.execute(
+            "SELECT day, used_mb FROM usage_history WHERE order_id = ? AND day >= ? ORDER BY day",
+            (order_id, first_day.strftime(DAY_FORMAT)),
+        ).fetchall())
+    result = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        result.append({
+            "day": day.strftime(DAY_FORMAT),
+            "jalali_day": jdatetime.date.fromgregorian(date=day.date()).strftime("%m/%d"),
+            "used_mb": int(rows.get(day.strftime(DAY_FORMAT), 0)),
+        })
+    return result
+
+
+def get_usage_series(order_id: int, days: int = 7, today: datetime = None) -> List[Tuple[datetime, int]]:
+    """(time, usage_total_mb) readings for the last ``days`` days at whatever resolution is stored."""
+    today = today or datetime.now()
+    first_day = (today - timedelta(days=days - 1)).strftime(DAY_FORMAT)
+    with sqlite3.connect(DB_PATH) as conn:
+        rows = conn.execute(
+            "SELECT day, base_total_mb, samples FROM usage_history WHERE order_id = ? AND day >= ? ORDER BY day",
+            (order_id, first_day),
+        ).fetchall()
+    series = []
+    for day, total_mb, blob in rows:
+        day_start = datetime.strptime(day, DAY_FORMAT)
+        for minute, delta in _unpack(blob):
+            total_mb += delta
+            series.append((day_start + timedelta(minutes=minute), total_mb))
+    return series
+
+
+def format_daily_usage(daily: List[Dict], width: int = 10) -> str:
+    """Text bar chart of get_daily_usage() for Telegram messages."""
+    peak = max((day["used_mb"] for day in daily), default=0)
+    lines = []
+    for day in daily:
+        used_mb = day["used_mb"]
+        bar = "▇" * (round(used_mb / peak * width) if peak else 0)
+        amount = f"{used_mb / 1024:.2f} گیگ" if used_mb >= 1024 else f"{used_mb} مگ"
+        lines.append(f"<code>{day['jalali_day']}</code> {bar or '▫️'} {amount}")
+    return "\n".join(lines)
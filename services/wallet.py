@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import DB_PATH
+
+# users.balance is the materialized balance; every change to it goes through this
+# module and leaves a row in the append-only wallet_ledger with the balance it produced.
+
+CHARGE_OK = "ok"
+CHARGE_INSUFFICIENT = "insufficient_balance"
+CHARGE_DUPLICATE = "duplicate"
+CHARGE_USER_NOT_FOUND = "user_not_found"
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _now_text() -> str:
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
+
+
+def _append_ledger(
+    cur: sqlite3.Cursor,
+    user_id: int,
+    amount: int,
+    kind: str,
+    ref_type: Optional[str],
+    ref_id: Optional[int],
+    note: Optional[str],
+    idempotency_key: Optional[str],
+) -> int:
+    cur.execute(
+        """
+        INSERT INTO wallet_ledger (
+            user_id, amount, balance_after, kind, ref_type, ref_id, note, idempotency_key, created_at
+        )
+        SELECT id, ?, COALESCE(balance, 0), ?, ?, ?, ?, ?, ?
+        FROM users
+        WHERE id = ?
+        """,
+        (amount, kind, ref_type, ref_id, note, idempotency_key, _now_text(), user_id),
+    )
+    row = cur.execute("SELECT balance_after FROM wallet_ledger WHERE id = ?", (cur.lastrowid,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def apply_wallet_delta(
+    cur: sqlite3.Cursor,
+    user_id: int,
+    delta: int,
+    kind: str,
+    *,
+    ref_type: Optional[str] = None,
+    ref_id: Optional[int] = None,
+    note: Optional[str] = None,
+    require_funds: bool = False,
+    idempotency_key: Optional[str] = None,
+) -> Dict:
+    """Change a balance inside the caller's transaction and append the matching ledger row.
+
+    With ``require_funds`` a debit is one conditional UPDATE (``balance >= amount``), so two
+    concurrent charges can never take the same money twice. An ``idempotency_key`` already
+    present in the ledger makes the call a no-op reported as ``duplicate``; a missing user
+    row is reported as ``user_not_found``.
+    """
+    delta = int(delta or 0)
+    if idempotency_key:
+        existing = cur.execute(
+            "SELECT balance_after FROM wallet_ledger WHERE idempotency_key = ? LIMIT 1",
+            (idempotency_key,),
+        ).fetchone()
+        if existing:
+            return {"ok": True, "status": CHARGE_DUPLICATE, "user_id": user_id, "balance": int(existing[0])}
+
+    if require_funds and delta < 0:
+        cur.execute(
+            """
+            UPDATE users
+            SET balance = COALESCE(balance, 0) + ?
+            WHERE id = ?
+              AND COALESCE(balance, 0) >= ?
+            """,
+            (delta, user_id, -delta),
+        )
+    else:
+        cur.execute(
+            "UPDATE users SET balance = COALESCE(balance, 0) + ? WHERE id = ?",
+            (delta, user_id),
+        )
+    if cur.rowcount == 0:
+        exists = cur.execute("SELECT 1 FROM users WHERE id = ? LIMIT 1", (user_id,)).fetchone()
+        status = CHARGE_INSUFFICIENT if exists and require_funds and delta < 0 else CHARGE_USER_NOT_FOUND
+        return {"ok": False, "status": status, "user_id": user_id, "balance": None}
+
+    balance = _append_ledger(cur, user_id, delta, kind, ref_type, ref_id, note, idempotency_key)
+    return {"ok": True, "status": CHARGE_OK, "user_id": user_id, "balance": balance}
+
+
+def set_wallet_balance(
+    cur: sqlite3.Cursor,
+    user_id: int,
+    new_balance: int,
+    kind: str = "admin_set",
+    note: Optional[str] = None,
+) -> Optional[int]:
+    row = cur.execute("SELECT COALESCE(balance, 0) FROM users WHERE id = ?", (user_id,)).fetchone()
+    if not row:
+        return None
+    delta = int(new_balance) - int(row[0])
+    if delta == 0:
+        return int(row[0])
+    return apply_wallet_delta(cur, user_id, delta, kind, note=note)["balance"]
+
+
+def debit_wallet(
+    user_id: int,
+    amount: int,
+    kind: str,
+    *,
+    ref_type: Optional[str] = None,
+    ref_id: Optional[int] = None,
+    note: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+) -> Dict:
+    with _connect() as conn:
+        cur = conn.cursor()
+        result = apply_wallet_delta(
+            cur, user_id, -abs(int(amount)), kind,
+            ref_type=ref_type, ref_id=ref_id, note=note,
+            require_funds=True, idempotency_key=idempotency_key,
+        )
+        conn.commit()
+        return result
+
+
+def credit_wallet(
+    user_id: int,
+    amount: int,
+    kind: str,
+    *,
+    ref_type: Optional[str] = None,
+    ref_id: Optional[int] = None,
+    note: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+) -> Dict:
+    with _connect() as conn:
+        cur = conn.cursor()
+        result = apply_wallet_delta(
+            cur, user_id, abs(int(amount)), kind,
+            ref_type=ref_type, ref_id=ref_id, note=note, idempotency_key=idempotency_key,
+        )
+        conn.commit()
+        return result
+
+
+def get_wallet_ledger(user_id: int, limit: int = 20) -> List[Dict]:
+    with _connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT *
+            FROM wallet_ledger
+            WHERE user_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+            """,
+            (user_id, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def find_wallet_mismatches(limit: int = 50) -> List[Dict]:
+    """Users whose materialized balance differs from the sum of their ledger rows."""
+    with _connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT u.id AS user_id,
+                   COALESCE(u.balance, 0) AS balance,
+                   COALESCE(l.total, 0) AS ledger_total
+            FROM users u
+            LEFT JOIN (
+                SELECT user_id, SUM(amount) AS total
+                FROM wallet_ledger
+                GROUP BY user_id
+            ) l ON l.user_id = u.id
+            WHERE COALESCE(u.balance, 0) != COALESCE(l.total, 0)
+            LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import secrets
+import signal
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (
+    WEBHOOK_BASE_URL,
+    WEBHOOK_DRAIN_TIMEOUT_SECONDS,
+    WEBHOOK_LISTEN_HOST,
+    WEBHOOK_LISTEN_PORT,
+    WEBHOOK_MAX_CONCURRENT_UPDATES,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_MAX_PENDING_UPDATES,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+)
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PATH = "/healthz"
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Webhook handler that acknowledges Telegram immediately and feeds updates in the background.
+
+    At most ``max_concurrent`` updates run through the dispatcher at once; beyond
+    ``max_pending`` accepted-but-unfinished updates the endpoint answers 503 so
+    Telegram redelivers later. ``close()`` stops accepting and drains in-flight
+    updates for up to ``drain_timeout`` seconds before closing the bot session.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        *,
+        max_concurrent: int = WEBHOOK_MAX_CONCURRENT_UPDATES,
+        max_pending: int = WEBHOOK_MAX_PENDING_UPDATES,
+        drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT_SECONDS,
+        secret_token: Optional[str] = None,
+        **data: Any,
+    ) -> None:
+        super().__init__(
+            dispatcher=dispatcher,
+            bot=bot,
+            handle_in_background=True,
+            secret_token=secret_token,
+            **data,
+        )
+        self.max_concurrent = max(int(max_concurrent), 1)
+        self.max_pending = max(int(max_pending), self.max_concurrent)
+        self.drain_timeout = max(float(drain_timeout), 0.0)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._accepting = True
+        self.accepted_count = 0
+        self.rejected_count = 0
+        self.failed_count = 0
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._semaphore:
+            try:
+                await super()._background_feed_update(bot=bot, update=update)
+            except Exception:
+                self.failed_count += 1
+                logger.exception("Webhook update %s failed.", update.get("update_id"))
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if not self._accepting or self.pending_count >= self.max_pending:
+            # Any non-2xx answer makes Telegram keep the update and retry it later.
+            self.rejected_count += 1
+            return web.Response(status=503, text="Busy")
+        self.accepted_count += 1
+        return await super()._handle_request_background(bot=bot, request=request)
+
+    async def drain(self) -> None:
+        self._accepting = False
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+
+        logger.info("Draining %s in-flight webhook updates (timeout=%ss).", len(tasks), self.drain_timeout)
+        _, still_running = await asyncio.wait(tasks, timeout=self.drain_timeout)
+        if still_running:
+            logger.warning("Cancelling %s webhook updates still running after drain timeout.", len(still_running))
+            for task in still_running:
+                task.cancel()
+            await asyncio.gather(*still_running, return_exceptions=True)
+
+    async def close(self) -> None:
+        await self.drain()
+        await super().close()
+
+
+def build_webhook_url() -> str:
+    if not WEBHOOK_BASE_URL:
+        return ""
+    return f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}"
+
+
+def build_webhook_app(dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str] = None) -> web.Application:
+    app = web.Application()
+    handler = BoundedRequestHandler(dispatcher=dispatcher, bot=bot, secret_token=secret_token)
+    handler.register(app, path=WEBHOOK_PATH)
+    app["webhook_handler"] = handler
+
+    async def health(_: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "ok": True,
+                "pending": handler.pending_count,
+                "accepted": handler.accepted_count,
+                "rejected": handler.rejected_count,
+                "failed": handler.failed_count,
+            }
+        )
+
+    app.router.add_get(HEALTH_PATH, health)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def _register_webhook(dispatcher: Dispatcher, bot: Bot, secret_token: str) -> None:
+    webhook_url = build_webhook_url()
+    if not webhook_url:
+        logger.warning("WEBHOOK_BASE_URL is not set; skipping setWebhook (local mode).")
+        return
+
+    await bot.set_webhook(
+        url=webhook_url,
+        secret_token=secret_token,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    logger.info("Webhook registered at %s (max_connections=%s).", webhook_url, WEBHOOK_MAX_CONNECTIONS)
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot) -> None:
+    secret_token = WEBHOOK_SECRET
+    if not secret_token:
+        secret_token = secrets.token_urlsafe(32)
+        logger.warning("WEBHOOK_SECRET is not set; using a one-off secret for this process.")
+
+    app = build_webhook_app(dispatcher, bot, secret_token=secret_token)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_LISTEN_HOST, port=WEBHOOK_LISTEN_PORT)
+    await site.start()
+    logger.info(
+        "Webhook server listening on %s:%s%s (concurrency=%s, pending cap=%s).",
+        WEBHOOK_LISTEN_HOST,
+        WEBHOOK_LISTEN_PORT,
+        WEBHOOK_PATH,
+        WEBHOOK_MAX_CONCURRENT_UPDATES,
+        WEBHOOK_MAX_PENDING_UPDATES,
+    )
+    await _register_webhook(dispatcher, bot, secret_token)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Stopping webhook server ...")
+        await runner.cleanup()
@@ -0,0 +1,170 @@
+"""
+Time the admin search functions with the trigram index against the LIKE scans they replace.
+
+Usage:
+    python -m tools.bench_admin_search --users 100000
+    python -m tools.bench_admin_search --users 100000 --orders-per-user 2 --repeat 20 --output search.json
+
+A throwaway SQLite database is migrated with the real create_tables(), so the triggers fill
+the search indexes while it is seeded, then every keyword is searched through
+search_users_for_admin, search_orders_for_admin (active and archive),
+search_accounts_for_admin_transfer and the admin panel's search_users, once with the index
+and once with the LIKE fallback. The JSON report has median/p95 milliseconds per function and
+whether both paths returned the same rows.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+FIRST_NAMES = ("علی", "محمد", "رضا", "زهرا", "فاطمه", "مریم", "Sara", "John", "Reza", "Amir", "Nima", "Parisa")
+LAST_NAMES = ("احمدی", "محمدی", "حسینی", "کریمی", "Rahimi", "Smith", "Karimi", "Moradi", "Jafari", None)
+DEFAULT_KEYWORDS = ("ahmad", "reza", "محمد", "کریمی", "4123", "user0123", "zz_nomatch", "am")
+
+
+def seed_database(db_path: str, user_count: int, orders_per_user: float, seed: int) -> Dict[str, int]:
+    from services.db import ARCHIVE_TABLE_NAME, create_tables
+
+    create_tables()
+    rng = random.Random(seed)
+    now = datetime.now().isoformat(sep=" ", timespec="minutes")
+    users = []
+    orders = []
+    archived = []
+    order_id = 0
+    for index in range(1, user_count + 1):
+        user_id = 100000000 + index * 37 + rng.randint(0, 36)
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        username = f"{first_name.lower()}_{rng.randint(1, 99999)}" if rng.random() < 0.6 else None
+        users.append((user_id, first_name, last_name, username, "user", rng.randint(0, 500000), now))
+        for _ in range(int(orders_per_user) + (1 if rng.random() < orders_per_user % 1 else 0)):
+            order_id += 1
+            row = (order_id, user_id, 1, f"user{order_id:07d}", rng.choice(("active", "expired")), 100000, now)
+            (archived if rng.random() < 0.2 else orders).append(row)
+
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO users (id, first_name, last_name, username, role, balance, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            users,
+        )
+        conn.executemany(
+            "INSERT INTO orders (id, user_id, plan_id, username, status, price, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            orders,
+        )
+        conn.executemany(
+            f"INSERT INTO {ARCHIVE_TABLE_NAME} (id, user_id, plan_id, username, status, price, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            archived,
+        )
+        conn.commit()
+    return {"users": len(users), "orders": len(orders), "archived_orders": len(archived)}
+
+
+def _searches() -> Dict[str, Callable[[str], List[Any]]]:
+    from handlers.admin.user_managment import search_users
+    from services.db import search_accounts_for_admin_transfer, search_orders_for_admin, search_users_for_admin
+
+    return {
+        "search_users_for_admin": lambda keyword: search_users_for_admin(keyword, limit=10),
+        "search_orders_for_admin": lambda keyword: search_orders_for_admin(keyword),
+        "search_orders_for_admin_archive": lambda keyword: search_orders_for_admin(keyword, archived_only=True),
+        "search_accounts_for_admin_transfer": lambda keyword: search_accounts_for_admin_transfer(keyword),
+        "admin_panel_search_users": lambda keyword: search_users(keyword),
+    }
+
+
+def _time_call(func: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(int(len(timings) * 0.95), len(timings) - 1)], 3),
+        "rows": len(result or []),
+        "result": result,
+    }
+
+
+def _row_key(row: Any) -> Any:
+    return tuple(dict(row).items()) if isinstance(row, dict) else tuple(row)
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="bench-search-")
+    db_path = args.db or os.path.join(workdir, "bench.db")
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+
+    started = time.perf_counter()
+    seeded = seed_database(db_path, args.users, args.orders_per_user, args.seed)
+    seed_seconds = time.perf_counter() - started
+
+    from services import db
+
+    searches = _searches()
+    keywords = [keyword for keyword in args.keywords.split(",") if keyword]
+    results: List[Dict[str, Any]] = []
+    for keyword in keywords:
+        for name, search in searches.items():
+            db._admin_search_ready.clear()
+            indexed = _time_call(lambda: search(keyword), args.repeat)
+            db._admin_search_ready.update({table: False for table in db.ADMIN_SEARCH_INDEXES})
+            scanned = _time_call(lambda: search(keyword), args.repeat)
+            db._admin_search_ready.clear()
+            results.append({
+                "keyword": keyword,
+                "search": name,
+                "indexed": {key: value for key, value in indexed.items() if key != "result"},
+                "like_scan": {key: value for key, value in scanned.items() if key != "result"},
+                "same_rows": sorted(map(_row_key, indexed["result"] or []), key=repr)
+                == sorted(map(_row_key, scanned["result"] or []), key=repr),
+            })
+
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "sqlite_version": sqlite3.sqlite_version,
+        "seeded": seeded,
+        "seed_seconds": round(seed_seconds, 2),
+        "repeat": args.repeat,
+        "db_path": db_path,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark admin search: trigram index vs LIKE scans.")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--orders-per-user", type=float, default=1.5)
+    parser.add_argument("--keywords", default=",".join(DEFAULT_KEYWORDS), help="comma separated search terms")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--db", help="SQLite file to seed (default: a fresh temp file)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+        print(f"report written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Time the data-layer hot paths on synthetic databases of growing size.
+
+Usage:
+    python -m tools.bench_data_layer
+    python -m tools.bench_data_layer --scales 1,10 --repeat 10 --output bench-data.json
+    python -m tools.bench_data_layer --baseline bench-data-main.json --output bench-data.json
+
+For each scale a fresh database is built with ``tools.synthetic_dataset`` (scale 1 is the live
+size) and every path from ``tools.check_query_plans`` runs against it: the user hot paths
+(``get_user_services``, ``get_buy_plans``, ``get_active_volume_packages`` ...), the scheduler
+batch queries, the payment queues and the admin reports. Per path the report keeps the median
+and max of ``--repeat`` calls, the query plans and any plan regression. The JSON is written
+with sorted keys and one value per line, so two runs diff cleanly; ``--baseline`` also prints
+the change against an earlier report.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+DEFAULT_SCALES = "1,10,100"
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _scale_key(scale: float) -> str:
+    return f"{scale:g}x"
+
+
+def bench_scale(db_path: str, scale: float, seed: int, repeat: int) -> Dict:
+    from tools.check_query_plans import run_checks
+    from tools.synthetic_dataset import SCALE_USERS, build_dataset
+
+    # Every scale reuses the same path: services read DB_PATH once, at import.
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    started = time.perf_counter()
+    counts = build_dataset(db_path, users=max(int(SCALE_USERS * scale), 1), seed=seed)
+    build_s = time.perf_counter() - started
+    print(f"{_scale_key(scale)}: built in {build_s:.1f}s ({counts['users']} users, {counts['orders']} orders, "
+          f"{counts['orders_archive']} archived, {counts['transactions']} transactions)")
+
+    checks = run_checks(db_path, repeat=repeat)
+    return {
+        "users": counts["users"],
+        "rows": counts,
+        "db_bytes": os.path.getsize(db_path),
+        "build_s": round(build_s, 1),
+        "paths": {
+            item["name"]: {
+                "median_ms": item["median_ms"],
+                "max_ms": item["max_ms"],
+                "plans": [step for statement in item["statements"] for step in statement["plan"]],
+                "regressions": item["regressions"],
+            }
+            for item in checks["paths"]
+        },
+        "regressions": checks["regressions"],
+    }
+
+
+def print_summary(report: Dict, baseline: Optional[Dict] = None) -> None:
+    scales = list(report["scales"])
+    names = list(next(iter(report["scales"].values()))["paths"]) if scales else []
+    print(f"{'path':<36}" + "".join(f"{key:>12}" for key in scales))
+    for name in names:
+        cells = []
+        for key in scales:
+            current = report["scales"][key]["paths"].get(name, {}).get("median_ms")
+            previous = ((baseline or {}).get("scales", {}).get(key, {}).get("paths", {}).get(name) or {}).get("median_ms")
+            if current is None:
+                cells.append(f"{'-':>12}")
+            elif previous:
+                cells.append(f"{current:>8.1f}{(current / previous - 1) * 100:>+4.0f}%")
+            else:
+                cells.append(f"{current:>10.2f}ms")
+        print(f"{name:<36}" + "".join(cells))
+    if baseline:
+        print(f"(change against {baseline.get('meta', {}).get('git_revision') or 'baseline'})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the data layer on synthetic databases.")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help=f"comma separated multiples of the live size (default: {DEFAULT_SCALES})")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per path")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workdir", help="where to build the databases (default: a temporary directory)")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+    # Reports would otherwise read a snapshot of the previous dataset; check the file itself.
+    os.environ.setdefault("REPORT_SNAPSHOT", "0")
+
+    scales: List[float] = [float(value) for value in args.scales.split(",") if value.strip()]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+
+    report = {
+        "meta": {
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "scales": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="bench-data-") as tmpdir:
+        db_path = os.path.join(args.workdir or tmpdir, "bench.db")
+        for scale in scales:
+            report["scales"][_scale_key(scale)] = bench_scale(db_path, scale, args.seed, max(1, args.repeat))
+
+    print_summary(report, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2, sort_keys=True)
+            fh.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Run the IBS-heavy scheduler jobs against the fake IBSng panel and report throughput.
+
+Usage:
+    python -m tools.bench_scheduler --users 3000
+    python -m tools.bench_scheduler --users 5000 --latency-ms 40 --error-rate 0.02 --output bench.json
+    python -m tools.bench_scheduler --jobs log_usage,limit_speed --rounds 3
+
+A throwaway SQLite database is seeded with one order per synthetic IBS user (mostly active,
+some reserved renewals, some waiting for payment), the fake panel from
+``tools.fake_ibs_server`` is started in-process with usage matching the seeded orders, and
+each job runs with the real code paths. Telegram sends are replaced with a no-op; nothing
+leaves the machine.
+The JSON report has wall time, panel requests per endpoint and rows touched per job.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from tools.fake_ibs_server import USERNAME_FORMAT, FakeIBSServer, FakeIBSState, build_state
+
+JOBS = ("log_usage", "limit_speed", "activation")
+JALALI_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def _jalali(dt: datetime) -> str:
+    import jdatetime
+
+    return jdatetime.datetime.fromgregorian(datetime=dt).strftime(JALALI_FORMAT)
+
+
+def seed_database(db_path: str, user_count: int, seed: int) -> Dict[str, int]:
+    from services.db import create_tables
+
+    create_tables()
+    rng = random.Random(seed)
+    now = datetime.now()
+    counts = {"active": 0, "reserved": 0, "waiting_for_payment": 0}
+    with sqlite3.connect(db_path) as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO plans (id, name, volume_gb, duration_months, price, group_name) VALUES (?, ?, ?, ?, ?, ?)",
+            [(1, "bench-1m", 50, 1, 100000, "1-Month"), (2, "bench-3m", 150, 3, 250000, "3-Month")],
+        )
+        for index in range(1, user_count + 1):
+            username = USERNAME_FORMAT.format(index)
+            user_id = 500000 + index
+            plan_id = rng.choice((1, 2))
+            cur.execute("INSERT INTO users (id, first_name, balance) VALUES (?, ?, ?)", (user_id, f"bench{index}", 0))
+            roll = rng.random()
+            if roll < 0.05:
+                # renewal reserved behind an already finished order
+                cur.execute(
+                    """
+                    INSERT INTO orders (user_id, plan_id, username, status, price, created_at, starts_at, expires_at, volume_gb)
+                    VALUES (?, ?, ?, 'waiting_for_renewal', 100000, ?, ?, ?, 50)
+                    """,
+                    (user_id, plan_id, username, now.isoformat(), _jalali(now - timedelta(days=31)), _jalali(now - timedelta(hours=1))),
+                )
+                cur.execute(
+                    """
+                    INSERT INTO orders (user_id, plan_id, username, status, price, created_at, is_renewal_of_order, volume_gb)
+                    VALUES (?, ?, ?, 'reserved', 100000, ?, ?, 50)
+                    """,
+                    (user_id, plan_id, username, now.isoformat(), cur.lastrowid),
+                )
+                counts["reserved"] += 1
+            elif roll < 0.10:
+                cur.execute("UPDATE users SET balance = 1000000 WHERE id = ?", (user_id,))
+                cur.execute(
+                    """
+                    INSERT INTO orders (user_id, plan_id, username, status, price, created_at, volume_gb)
+                    VALUES (?, ?, ?, 'waiting_for_payment', 100000, ?, 50)
+                    """,
+                    (user_id, plan_id, username, now.isoformat()),
+                )
+                counts["waiting_for_payment"] += 1
+            else:
+                volume_gb = 50 if plan_id == 1 else 150
+                # spread usage so some orders sit past the pre-limit and hard-limit thresholds
+                usage_mb = int(volume_gb * 1024 * rng.choice((0.1, 0.5, 0.8, 0.96, 1.2)))
+                cur.execute(
+                    """
+                    INSERT INTO orders (
+                        user_id, plan_id, username, status, price, created_at, starts_at, expires_at,
+                        volume_gb, usage_total_mb
+                    )
+                    VALUES (?, ?, ?, 'active', 100000, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        user_id, plan_id, username, now.isoformat(),
+                        _jalali(now - timedelta(days=rng.randint(1, 25))),
+                        _jalali(now + timedelta(days=rng.randint(1, 60))),
+                        volume_gb, usage_mb,
+                    ),
+                )
+                counts["active"] += 1
+        conn.commit()
+    return counts
+
+
+def align_panel_usage(state: FakeIBSState, db_path: str) -> None:
+    """Make the fake panel report each active order's seeded usage, so log_usage keeps the spread."""
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT username, starts_at, expires_at, usage_total_mb FROM orders WHERE status = 'active'"
+        ).fetchall()
+    now = time.time()
+    for username, starts_at, expires_at, usage_mb in rows:
+        user = state.users.get(username)
+        if user is None:
+            continue
+        user.first_login = starts_at
+        user.expiration = expires_at
+        user.created = now
+        # the panel reports mb_per_hour * (hours since created + 24)
+        user.mb_per_hour = (usage_mb or 0) / 24
+
+
+def _drain_outbox() -> Dict[str, int]:
+    from services.ibs_outbox import claim_outbox_entries, execute_outbox_entry, finish_outbox_entry
+
+    done = failed = 0
+    while True:
+        entries = claim_outbox_entries("bench", 50)
+        if not entries:
+            break
+        for entry in entries:
+            error = execute_outbox_entry(entry)
+            finish_outbox_entry(entry["id"], "bench", error)
+            if error:
+                failed += 1
+            else:
+                done += 1
+    return {"outbox_done": done, "outbox_failed": failed}
+
+
+def _job_runners() -> Dict[str, Callable[[], Dict[str, Any]]]:
+    from services.scheduler_services.activation_engine import run_activation
+    from services.scheduler_services.limit_speed import limit_speed
+    from services.scheduler_services.usage_logger import log_usage
+
+    def run_log_usage() -> Dict[str, Any]:
+        log_usage()
+        return {}
+
+    def run_limit_speed() -> Dict[str, Any]:
+        limit_speed()
+        return {}
+
+    def run_activation_jobs() -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        for statuses in (("reserved",), ("waiting_for_payment",)):
+            for key, value in asyncio.run(run_activation(statuses)).items():
+                result[key] = result.get(key, 0) + value
+        result.update(_drain_outbox())
+        return result
+
+    return {"log_usage": run_log_usage, "limit_speed": run_limit_speed, "activation": run_activation_jobs}
+
+
+def _db_counters(db_path: str) -> Dict[str, int]:
+    with sqlite3.connect(db_path) as conn:
+        return {
+            "orders_with_usage": conn.execute("SELECT COUNT(*) FROM orders WHERE usage_last_update IS NOT NULL").fetchone()[0],
+            "orders_with_speed": conn.execute("SELECT COUNT(*) FROM orders WHERE usage_applied_speed IS NOT NULL").fetchone()[0],
+            "active_orders": conn.execute("SELECT COUNT(*) FROM orders WHERE status = 'active'").fetchone()[0],
+        }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    state = build_state(
+        args.users,
+        seed=args.seed,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+    )
+    server = FakeIBSServer(state).start()
+    workdir = tempfile.mkdtemp(prefix="bench-scheduler-")
+    db_path = args.db or os.path.join(workdir, "bench.db")
+    os.environ.update(server.env)
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("BOT_TOKEN", "0:bench")
+    os.environ.setdefault("ADMINS", "")
+
+    try:
+        seeded = seed_database(db_path, args.users, args.seed)
+        align_panel_usage(state, db_path)
+
+        from services.scheduler_services import activation_engine, limit_speed, usage_logger
+
+        def no_send(*_: Any, **__: Any) -> bool:
+            return True
+
+        limit_speed.send_scheduler_notification = no_send
+        activation_engine.send_scheduler_notification = no_send
+        if not args.keep_delay:
+            usage_logger.REQUEST_DELAY_SECONDS = 0
+
+        runners = _job_runners()
+        selected = [job for job in args.jobs.split(",") if job]
+        results: List[Dict[str, Any]] = []
+        for round_index in range(1, args.rounds + 1):
+            for job in selected:
+                before = _db_counters(db_path)
+                state.reset_counters()
+                started = time.perf_counter()
+                error = None
+                extra: Dict[str, Any] = {}
+                try:
+                    extra = runners[job]() or {}
+                except Exception as exc:
+                    error = f"{type(exc).__name__}: {exc}"
+                elapsed = time.perf_counter() - started
+                panel = state.snapshot()
+                total_requests = sum(panel["requests"].values())
+                after = _db_counters(db_path)
+                results.append(
+                    {
+                        "job": job,
+                        "round": round_index,
+                        "seconds": round(elapsed, 3),
+                        "ibs_requests": total_requests,
+                        "ibs_requests_per_second": round(total_requests / elapsed, 1) if elapsed else 0.0,
+                        "ibs_requests_by_endpoint": panel["requests"],
+                        "ibs_injected_errors": panel["errors"],
+                        "db_delta": {key: after[key] - before[key] for key in after},
+                        "error": error,
+                        **extra,
+                    }
+                )
+        return {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "users": args.users,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+            "seeded_orders": seeded,
+            "db_path": db_path,
+            "results": results,
+        }
+    finally:
+        server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark scheduler IBS jobs against the fake panel.")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--jobs", default=",".join(JOBS), help=f"comma separated subset of {', '.join(JOBS)}")
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--db", help="SQLite file to seed (default: a fresh temp file)")
+    parser.add_argument("--keep-delay", action="store_true", help="keep usage_logger's per-request sleep")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    unknown = set(args.jobs.split(",")) - set(JOBS) - {""}
+    if unknown:
+        parser.error(f"unknown jobs: {', '.join(sorted(unknown))}")
+
+    report = run_benchmark(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+        print(f"report written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
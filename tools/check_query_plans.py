@@ -0,0 +1,298 @@
+"""
+Check that the hot queries still use their indexes, and time them on a synthetic dataset.
+
+Usage:
+    python -m tools.check_query_plans
+    python -m tools.check_query_plans --users 20000 --repeat 10 --output plans.json
+    python -m tools.check_query_plans --db /tmp/copy-of-production.db
+
+Each hot path below is called with the real code. Every SELECT/UPDATE/DELETE it sends to SQLite
+is captured through a trace callback (with the bound values inlined) and run again under
+EXPLAIN QUERY PLAN. A ``SCAN`` of one of the big tables is a regression unless the path
+allows it: the admin reports aggregate whole tables on purpose, a user-facing lookup or a
+scheduler batch query should be a ``SEARCH``. The exit status is 1 when a regression is found,
+so the command can run before a deploy. Without ``--db`` the data comes from
+``tools.synthetic_dataset`` in a temporary directory.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Tables that grow with the user base; a full scan of one of them is what this check is for.
+WATCHED_TABLES = (
+    "orders",
+    "orders_archive",
+    "transactions",
+    "users",
+    "usage_history",
+    "conversion_offer_logs",
+    "segment_users",
+    "accounts",
+    "wallet_ledger",
+)
+ALL_TABLES = "*"
+
+# Batch queries whose whole point is one particular index. A status-prefixed sibling index can
+# still give a SEARCH when one of these is dropped, so the index itself is pinned.
+EXPECTED_INDEXES = {
+    "get_orders_for_notifications": "idx_orders_status_expires_at",
+    "get_auto_renew_orders": "idx_orders_auto_renew_status_expires",
+    "usage_logger_due_orders": "idx_orders_usage_refresh",
+    "get_orders_for_limitation": "idx_orders_usage_refresh",
+    "list_transactions_pending_admin": "idx_transactions_status_created_at",
+    "get_duplicate_candidates": "idx_transactions_photo_hash",
+}
+
+_real_connect = sqlite3.connect
+_captured: Optional[List[str]] = None
+
+TABLE_REF_RE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.IGNORECASE)
+SQL_KEYWORDS = {
+    "where", "join", "left", "inner", "cross", "on", "group", "order", "limit", "union", "set",
+    "using", "natural", "outer", "having", "window", "values", "select", "as", "indexed", "not",
+}
+
+
+def _record(statement: str) -> None:
+    if _captured is not None:
+        _captured.append(statement)
+
+
+def _traced_connect(*args, **kwargs) -> sqlite3.Connection:
+    conn = _real_connect(*args, **kwargs)
+    conn.set_trace_callback(_record)
+    return conn
+
+
+def _table_aliases(sql: str) -> Dict[str, str]:
+    """Map the names EXPLAIN QUERY PLAN prints (alias or table) to table names."""
+    aliases = {}
+    for table, alias in TABLE_REF_RE.findall(sql):
+        aliases[table] = table
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def explain(conn: sqlite3.Connection, sql: str) -> List[str]:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def find_scans(sql: str, plan: List[str]) -> List[str]:
+    """Watched tables that the plan reads in full."""
+    aliases = _table_aliases(sql)
+    scans = []
+    for step in plan:
+        match = re.match(r"SCAN (\w+)", step)
+        if not match:
+            continue
+        table = aliases.get(match.group(1), match.group(1))
+        if table in WATCHED_TABLES:
+            scans.append(table)
+    return scans
+
+
+def _is_checked_statement(statement: str) -> bool:
+    head = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return head in ("SELECT", "WITH", "UPDATE", "DELETE")
+
+
+def sample_values(db_path: str) -> Dict:
+    with _real_connect(db_path) as conn:
+        user_id, = conn.execute("""
+            SELECT user_id FROM orders GROUP BY user_id ORDER BY COUNT(*) DESC, user_id LIMIT 1
+        """).fetchone()
+        order_id, username = conn.execute("""
+            SELECT id, username FROM orders WHERE user_id = ? AND status = 'active' ORDER BY id LIMIT 1
+        """, (user_id,)).fetchone() or conn.execute("SELECT id, username FROM orders ORDER BY id LIMIT 1").fetchone()
+        txn = conn.execute("""
+            SELECT id FROM transactions WHERE status = 'pending_admin' ORDER BY id LIMIT 1
+        """).fetchone() or conn.execute("SELECT id FROM transactions ORDER BY id LIMIT 1").fetchone()
+    return {"user_id": user_id, "order_id": order_id, "username": username, "txn_id": txn[0] if txn else 0}
+
+
+def hot_paths(values: Dict) -> List[Tuple[str, Callable[[], object], object]]:
+    """(name, call, allowed scans) for every checked path; imported late so DB_PATH is already set."""
+    import jdatetime
+
+    from handlers.admin import reports
+    from services import db, payment_workflow
+    from services.conversion_offer import _fetch_active_services_for_user
+    from services.scheduler_services.limit_speed import get_orders_for_limitation
+    from services.scheduler_services.usage_logger import _fetch_due_orders_for_usage_update
+
+    user_id = values["user_id"]
+    now_jalali = jdatetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    in_three_days = (jdatetime.datetime.now() + jdatetime.timedelta(days=3)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def with_conn(fn, *args):
+        def call():
+            with _traced_connect(os.environ["DB_PATH"]) as conn:
+                conn.row_factory = sqlite3.Row
+                return fn(conn, *args)
+        return call
+
+    def usage_batch():
+        with _traced_connect(os.environ["DB_PATH"]) as conn:
+            conn.row_factory = sqlite3.Row
+            return _fetch_due_orders_for_usage_update(conn.cursor(), now_jalali)
+
+    def report(builder):
+        def call():
+            with reports._connect() as conn:
+                return builder(conn)
+        return call
+
+    paths = [
+        ("get_user_info", lambda: db.get_user_info(user_id), ()),
+        ("get_user_balance", lambda: db.get_user_balance(user_id), ()),
+        ("get_buy_plans", lambda: db.get_buy_plans(user_id), ()),
+        ("get_renew_plans", lambda: db.get_renew_plans(user_id), ()),
+        ("get_user_services", lambda: db.get_user_services(user_id), ()),
+        ("get_volume_services_for_user", lambda: db.get_volume_services_for_user(user_id), ()),
+        ("get_active_volume_packages", lambda: db.get_active_volume_packages(user_id, values["order_id"]), ()),
+        ("count_user_active_orders", lambda: db.count_user_active_orders(user_id), ()),
+        ("get_unpaid_orders", lambda: db.get_unpaid_orders(user_id), ()),
+        ("get_user_pending_purchase_orders", lambda: db.get_user_pending_purchase_orders(user_id), ()),
+        ("get_services_waiting_for_renew", lambda: db.get_services_waiting_for_renew(user_id), ()),
+        ("get_distinct_usernames_by_user_id", lambda: db.get_distinct_usernames_by_user_id(user_id), ()),
+        ("get_order_with_plan", lambda: db.get_order_with_plan(values["order_id"]), ()),
+        ("get_open_orders_by_username", lambda: db.get_open_orders_by_username(values["username"]), ()),
+        ("conversion_active_services", with_conn(_fetch_active_services_for_user, user_id), ()),
+        ("get_orders_for_notifications", lambda: db.get_orders_for_notifications(in_three_days), ()),
+        ("get_orders_for_usage_notifications", db.get_orders_for_usage_notifications, ()),
+        ("get_auto_renew_orders", db.get_auto_renew_orders, ()),
+        ("get_reserved_orders", db.get_reserved_orders, ()),
+        ("get_waiting_for_payment_orders", db.get_waiting_for_payment_orders, ()),
+        ("get_active_orders_without_time", db.get_active_orders_without_time, ()),
+        ("usage_logger_due_orders", usage_batch, ()),
+        ("get_orders_for_limitation", get_orders_for_limitation, ()),
+        ("list_transactions_pending_admin", lambda: payment_workflow.list_transactions_by_status("pending_admin"), ()),
+        ("get_transaction_with_user", lambda: payment_workflow.get_transaction_with_user(values["txn_id"]), ()),
+        ("get_duplicate_candidates", lambda: payment_workflow.get_duplicate_candidates(values["txn_id"]), ()),
+        ("search_users_for_admin", lambda: db.search_users_for_admin(str(user_id)), ()),
+        ("search_orders_for_admin", lambda: db.search_orders_for_admin(values["username"] or str(user_id)), ()),
+        ("report_user_detail", lambda: reports.build_user_detail_report(user_id), ()),
+    ]
+    # The dashboards aggregate over whole tables by design; they are timed, not plan-checked.
+    for name in (
+        "management_snapshot", "volume_commitment", "dashboard_month", "orders_overview", "wallet_overview",
+        "top_plans", "users_overview", "expiring_overview", "feedback_overview", "user_balances",
+    ):
+        paths.append((f"report_{name}", report(getattr(reports, f"build_{name}_report")), ALL_TABLES))
+    return paths
+
+
+def check_path(plan_conn: sqlite3.Connection, name: str, call: Callable[[], object], allowed, repeat: int) -> Dict:
+    global _captured
+
+    _captured = []
+    try:
+        call()
+    finally:
+        statements, _captured = _captured, None
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    checked = []
+    regressions = []
+    for sql in dict.fromkeys(s for s in statements if _is_checked_statement(s)):
+        plan = explain(plan_conn, sql)
+        scans = find_scans(sql, plan)
+        unexpected = [] if allowed == ALL_TABLES else [table for table in scans if table not in allowed]
+        checked.append({"sql": " ".join(sql.split())[:400], "plan": plan, "scans": scans})
+        regressions.extend(f"SCAN {table}" for table in unexpected)
+    expected_index = EXPECTED_INDEXES.get(name)
+    if expected_index and not any(
+        f"INDEX {expected_index} " in f"{step} " for statement in checked for step in statement["plan"]
+    ):
+        regressions.append(f"no {expected_index}")
+    return {
+        "name": name,
+        "median_ms": round(statistics.median(timings), 3) if timings else None,
+        "max_ms": round(max(timings), 3) if timings else None,
+        "statements": checked,
+        "regressions": sorted(set(regressions)),
+    }
+
+
+def run_checks(db_path: str, repeat: int = 5, only: Optional[List[str]] = None) -> Dict:
+    values = sample_values(db_path)
+    sqlite3.connect = _traced_connect
+    try:
+        paths = hot_paths(values)
+        results = []
+        with _real_connect(db_path) as plan_conn:
+            for name, call, allowed in paths:
+                if only and name not in only:
+                    continue
+                results.append(check_path(plan_conn, name, call, allowed, repeat))
+    finally:
+        sqlite3.connect = _real_connect
+    return {
+        "db_path": db_path,
+        "sample": values,
+        "repeat": repeat,
+        "paths": results,
+        "regressions": sum(len(item["regressions"]) for item in results),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN check for the hot queries.")
+    parser.add_argument("--db", help="existing database to check (default: build a synthetic one)")
+    parser.add_argument("--users", type=int, default=5000, help="synthetic dataset size")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per path")
+    parser.add_argument("--paths", default="", help="comma separated subset of path names")
+    parser.add_argument("--output", help="write the full report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="print every statement with its plan")
+    args = parser.parse_args()
+    # Reports would otherwise read a snapshot of the previous dataset; check the file itself.
+    os.environ.setdefault("REPORT_SNAPSHOT", "0")
+
+    with tempfile.TemporaryDirectory(prefix="query-plans-") as workdir:
+        if args.db:
+            db_path = args.db
+            os.environ["DB_PATH"] = db_path
+            os.environ.setdefault("BOT_TOKEN", "0:synthetic")
+        else:
+            from tools.synthetic_dataset import build_dataset
+
+            db_path = os.path.join(workdir, "synthetic.db")
+            counts = build_dataset(db_path, users=args.users, seed=args.seed)
+            print("dataset: " + ", ".join(f"{table}={count}" for table, count in counts.items()))
+
+        report = run_checks(db_path, repeat=max(1, args.repeat), only=[p for p in args.paths.split(",") if p])
+
+    for item in report["paths"]:
+        status = "FAIL " + ", ".join(item["regressions"]) if item["regressions"] else "ok"
+        print(f"{item['name']:<36} {item['median_ms']:>9.2f}ms  {status}")
+        if args.verbose or item["regressions"]:
+            for statement in item["statements"]:
+                print(f"    {statement['sql'][:160]}")
+                for step in statement["plan"]:
+                    print(f"      {step}")
+    print(f"{len(report['paths'])} paths, {report['regressions']} plan regressions")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+    raise SystemExit(1 if report["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
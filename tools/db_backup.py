@@ -0,0 +1,47 @@
+"""
+Take or restore an online snapshot of the bot database (see ``services.backup``).
+
+Usage:
+    python -m tools.db_backup backup
+    python -m tools.db_backup backup --dir /home/ftp/backup/Site000-Bot_v2 --full
+    python -m tools.db_backup restore database/backups/vpn_bot-20260101-040000.delta.gz /tmp/restored.db
+
+``backup`` copies DB_PATH while the bot keeps running, stores a full snapshot or a page delta
+against the latest full and applies the BACKUP_KEEP_* retention. ``restore`` rebuilds a
+standalone database file from a full snapshot, or from a delta plus the full next to it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+
+from config import BACKUP_COMPRESS, BACKUP_DIR
+from services.backup import format_backup_result, restore_backup, run_backup
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Online SQLite snapshots of the bot database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backup = commands.add_parser("backup", help="take a snapshot now")
+    backup.add_argument("--dir", default=BACKUP_DIR, help=f"backup directory (default: {BACKUP_DIR})")
+    backup.add_argument("--full", action="store_true", help="always write a full snapshot")
+    backup.add_argument("--no-compress", action="store_true", help="store files without gzip")
+    backup.add_argument("--json", action="store_true", help="print the result as JSON")
+
+    restore = commands.add_parser("restore", help="rebuild a database file from a backup")
+    restore.add_argument("backup_file")
+    restore.add_argument("target", help="path of the new database file (must not exist)")
+
+    args = parser.parse_args()
+    if args.command == "backup":
+        result = run_backup(args.dir, compress=BACKUP_COMPRESS and not args.no_compress, force_full=args.full)
+        print(json.dumps(result, indent=2) if args.json else format_backup_result(result))
+    else:
+        result = restore_backup(args.backup_file, args.target)
+        print(f"restored {result['path']} ({result['bytes']} bytes, {result['applied_pages']} delta pages)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Local stand-in for the IBSng admin panel, for offline runs and load tests.
+
+Usage:
+    python -m tools.fake_ibs_server --users 5000 --port 8765 --latency-ms 40 --error-rate 0.02
+
+then point the bot at it:
+    IBS_URL_BASE=http://127.0.0.1:8765/IBSng/admin/
+    IBS_URL_INFO=http://127.0.0.1:8765/IBSng/admin/user/user_info.php
+    IBS_URL_EDIT=http://127.0.0.1:8765/IBSng/admin/plugins/edit.php
+    IBS_URL_CONNECTIONS=http://127.0.0.1:8765/IBSng/admin/report/connections.php
+    IBS_URL_DELETE=http://127.0.0.1:8765/IBSng/admin/user/del_user.php
+
+Pages are rendered from small templates that carry exactly the markup ``services.IBSng``
+parses (label/value table rows, the group link, the radius textarea cell and the
+``list_col`` report totals). Users are synthetic (``user00001`` ...) and usage grows with
+time, so repeated usage passes see changing numbers.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from aiohttp import web
+
+USERNAME_FORMAT = "user{:05d}"
+EMPTY_DATE = "---------------"
+
+INFO_TEMPLATE = """<html><body><table>
+<tr><td class="Form_Content_Row_Left"></td><td>User ID</td><td>{user_id}</td></tr>
+<tr><td class="Form_Content_Row_Left"></td><td>Normal Username</td><td>{username}</td></tr>
+<tr><td class="Form_Content_Row_Left"></td><td>Group</td><td><a href="/IBSng/admin/group/group_info.php?group_name={group}">{group}</a></td></tr>
+<tr><td class="Form_Content_Row_Left"></td><td>Locked</td><td>{locked}</td></tr>
+<tr><td class="Form_Content_Row_Left"></td><td>First Login</td><td>{first_login}</td></tr>
+<tr><td class="Form_Content_Row_Left"></td><td>Nearest Expiration Date</td><td>{expiration}</td></tr>
+<tr><td class="Form_Content_Row_Left"></td><td>Radius Attributes</td><td class="Form_Content_Row_Right_textarea_td_dark">{radius_attrs}</td></tr>
+</table></body></html>"""
+
+NOT_FOUND_TEMPLATE = "<html><body><table><tr><td></td><td>Error</td><td>User not found</td></tr></table></body></html>"
+
+GROUP_TEMPLATE = """<html><body><table>
+<tr><td>Group Name</td><td>{group}</td></tr>
+<tr><td>Radius Attributes</td><td class="Form_Content_Row_Right_textarea_td_dark">{radius_attrs}</td></tr>
+</table></body></html>"""
+
+CONNECTION_LOG_TEMPLATE = """<html><body><table>
+<tr><th>Row</th><th>Username</th><th>Login Time</th><th>Successful</th></tr>
+{rows}
+</table></body></html>"""
+
+CONNECTION_LOG_ROW = "<tr><td>{row}</td><td>{username}</td><td>{login_time}</td><td>Yes</td></tr>"
+
+CONNECTIONS_TEMPLATE = """<html><body><table>
+<tr><td class="list_col">Report Total In Bytes:</td><td class="list_col">{received}</td></tr>
+<tr><td class="list_col">Report Total Out Bytes:</td><td class="list_col">{sent}</td></tr>
+<tr><td class="list_col">Report Total Duration:</td><td class="list_col">{duration}</td></tr>
+</table></body></html>"""
+
+
+@dataclass
+class FakeUser:
+    user_id: int
+    username: str
+    group: str = "Starter-Bot"
+    locked: bool = False
+    first_login: Optional[str] = None
+    expiration: Optional[str] = None
+    radius_attrs: str = ""
+    mb_per_hour: float = 0.0
+    created: float = field(default_factory=time.time)
+
+
+@dataclass
+class FakeIBSState:
+    users: Dict[str, FakeUser] = field(default_factory=dict)
+    by_id: Dict[str, FakeUser] = field(default_factory=dict)
+    group_attrs: Dict[str, str] = field(default_factory=dict)
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    requests: Counter = field(default_factory=Counter)
+    errors: Counter = field(default_factory=Counter)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def add_user(self, user: FakeUser) -> None:
+        self.users[user.username] = user
+        self.by_id[str(user.user_id)] = user
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {"requests": dict(self.requests), "errors": dict(self.errors)}
+
+    def reset_counters(self) -> None:
+        with self.lock:
+            self.requests.clear()
+            self.errors.clear()
+
+
+def build_state(
+    user_count: int,
+    *,
+    seed: int = 7,
+    logged_in_ratio: float = 0.8,
+    latency_ms: float = 0.0,
+    jitter_ms: float = 0.0,
+    error_rate: float = 0.0,
+) -> FakeIBSState:
+    rng = random.Random(seed)
+    state = FakeIBSState(latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate)
+    state.group_attrs = {
+        "Starter-Bot": 'Group="starter"',
+        "1-Month": 'Group="monthly"',
+        "3-Month": 'Group="quarterly"',
+        "1-Hour": "",
+    }
+    for index in range(1, user_count + 1):
+        user = FakeUser(user_id=100000 + index, username=USERNAME_FORMAT.format(index))
+        if rng.random() < logged_in_ratio:
+            user.group = rng.choice(["1-Month", "3-Month"])
+            user.first_login = "1404-01-{:02d} {:02d}:{:02d}".format(rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59))
+            user.expiration = "1405-01-{:02d} {:02d}:{:02d}".format(rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59))
+            user.mb_per_hour = rng.uniform(5, 400)
+        state.add_user(user)
+    return state
+
+
+def _format_size(mb: float) -> str:
+    if mb >= 1024:
+        return f"{mb / 1024:.2f}G"
+    if mb >= 1:
+        return f"{mb:.2f}M"
+    return f"{mb * 1024:.2f}K"
+
+
+def _usage_mb(user: FakeUser) -> float:
+    if not user.first_login:
+        return 0.0
+    hours = (time.time() - user.created) / 3600 + 24
+    return user.mb_per_hour * hours
+
+
+def _apply_edit(user: FakeUser, form) -> None:
+    templates = [name for name in (form.get("edit_tpl_cs") or "").split(",") if name]
+    for name in templates:
+        if name in ("rel_exp_date", "abs_exp_date"):
+            user.expiration = None
+        elif name == "first_login":
+            if form.get("reset_first_login") == "t":
+                user.first_login = None
+        elif name == "group_name":
+            user.group = form.get("group_name") or user.group
+        elif name == "lock":
+            user.locked = form.get("has_lock") == "t"
+        elif name == "radius_attrs":
+            user.radius_attrs = form.get("radius_attrs", "") if form.get("has_radius_attrs") == "t" else ""
+
+
+def make_app(state: FakeIBSState) -> web.Application:
+    @web.middleware
+    async def inject(request: web.Request, handler):
+        endpoint = request.path.rsplit("/", 1)[-1] or "login"
+        with state.lock:
+            state.requests[endpoint] += 1
+        delay = state.latency_ms + (random.uniform(0, state.jitter_ms) if state.jitter_ms else 0)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if state.error_rate and random.random() < state.error_rate:
+            with state.lock:
+                state.errors[endpoint] += 1
+            return web.Response(status=503, text="Service Unavailable")
+        return await handler(request)
+
+    async def login(request: web.Request) -> web.Response:
+        await request.post()
+        return web.Response(text="<html>ok</html>", content_type="text/html")
+
+    async def user_info(request: web.Request) -> web.Response:
+        form = await request.post()
+        user = None
+        if form.get("normal_username_multi"):
+            user = state.users.get(form["normal_username_multi"])
+        elif form.get("user_id_multi"):
+            user = state.by_id.get(str(form["user_id_multi"]))
+        if user is None:
+            return web.Response(text=NOT_FOUND_TEMPLATE, content_type="text/html")
+        text = INFO_TEMPLATE.format(
+            user_id=user.user_id,
+            username=user.username,
+            group=user.group,
+            locked="Yes" if user.locked else "No",
+            first_login=user.first_login or EMPTY_DATE,
+            expiration=user.expiration or EMPTY_DATE,
+            radius_attrs=user.radius_attrs,
+        )
+        return web.Response(text=text, content_type="text/html")
+
+    async def edit(request: web.Request) -> web.Response:
+        form = await request.post()
+        if form.get("edit_group"):
+            group = form.get("group_name") or ""
+            text = GROUP_TEMPLATE.format(group=group, radius_attrs=state.group_attrs.get(group, ""))
+            return web.Response(text=text, content_type="text/html")
+        user = state.by_id.get(str(form.get("target_id") or form.get("user_id") or ""))
+        if user is None:
+            return web.Response(status=404, text="user not found")
+        if form.get("update"):
+            _apply_edit(user, form)
+        return web.Response(text="<html>updated</html>", content_type="text/html")
+
+    async def connections(request: web.Request) -> web.Response:
+        form = await request.post()
+        if not form.get("user_ids"):
+            # Connection log across all users: everyone who has logged in, paged like the panel.
+            rpp = int(form.get("rpp") or 20)
+            page = int(form.get("page") or 1)
+            logged_in = sorted((user for user in state.users.values() if user.first_login), key=lambda u: u.user_id)
+            chunk = logged_in[(page - 1) * rpp:page * rpp]
+            if not chunk:
+                return web.Response(text="<html><body>No Results Found</body></html>", content_type="text/html")
+            rows = "\n".join(
+                CONNECTION_LOG_ROW.format(row=(page - 1) * rpp + index, username=user.username, login_time=user.first_login)
+                for index, user in enumerate(chunk, start=1)
+            )
+            return web.Response(text=CONNECTION_LOG_TEMPLATE.format(rows=rows), content_type="text/html")
+        user = state.by_id.get(str(form.get("user_ids") or ""))
+        total = _usage_mb(user) if user else 0.0
+        text = CONNECTIONS_TEMPLATE.format(
+            received=_format_size(total * 0.85),
+            sent=_format_size(total * 0.15),
+            duration="12:00:00" if total else "00:00:00",
+        )
+        return web.Response(text=text, content_type="text/html")
+
+    async def delete(request: web.Request) -> web.Response:
+        form = await request.post()
+        user = state.by_id.pop(str(form.get("user_id") or ""), None)
+        if user is not None:
+            state.users.pop(user.username, None)
+        return web.Response(text="<html>deleted</html>", content_type="text/html")
+
+    app = web.Application(middlewares=[inject])
+    app.router.add_post("/IBSng/admin/", login)
+    app.router.add_post("/IBSng/admin/user/user_info.php", user_info)
+    app.router.add_post("/IBSng/admin/plugins/edit.php", edit)
+    app.router.add_post("/IBSng/admin/report/connections.php", connections)
+    app.router.add_post("/IBSng/admin/user/del_user.php", delete)
+    return app
+
+
+def ibs_env(host: str, port: int) -> Dict[str, str]:
+    base = f"http://{host}:{port}/IBSng/admin"
+    return {
+        "IBS_URL_BASE": f"{base}/",
+        "IBS_URL_INFO": f"{base}/user/user_info.php",
+        "IBS_URL_EDIT": f"{base}/plugins/edit.php",
+        "IBS_URL_CONNECTIONS": f"{base}/report/connections.php",
+        "IBS_URL_DELETE": f"{base}/user/del_user.php",
+    }
+
+
+class FakeIBSServer:
+    """Runs the fake panel on its own event loop thread, for use from synchronous benchmarks."""
+
+    def __init__(self, state: FakeIBSState, host: str = "127.0.0.1", port: int = 0):
+        self.state = state
+        self.host = host
+        self.port = port
+        self._loop = asyncio.new_event_loop()
+        self._runner: Optional[web.AppRunner] = None
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-ibs", daemon=True)
+
+    def start(self) -> "FakeIBSServer":
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    async def _start(self) -> None:
+        self._runner = web.AppRunner(make_app(self.state), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host=self.host, port=self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def stop(self) -> None:
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    @property
+    def env(self) -> Dict[str, str]:
+        return ibs_env(self.host, self.port)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a fake IBSng panel with synthetic users.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    state = build_state(
+        args.users,
+        seed=args.seed,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+    )
+    for key, value in ibs_env(args.host, args.port).items():
+        print(f"{key}={value}")
+    web.run_app(make_app(state), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+POST recorded Telegram updates to a locally running webhook server.
+
+Usage:
+    BOT_RUN_MODE=webhook WEBHOOK_SECRET=local-secret python bot.py
+    python -m tools.replay_webhook_updates --file updates.jsonl --secret local-secret
+    python -m tools.replay_webhook_updates --synthetic 500 --concurrency 50 --secret local-secret
+
+The input file may be a JSON array of updates or one update object per line.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import aiohttp
+
+from config import WEBHOOK_LISTEN_HOST, WEBHOOK_LISTEN_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_updates(path: Path) -> List[Dict[str, Any]]:
+    text = path.read_text(encoding="utf-8").strip()
+    if not text:
+        return []
+    if text.startswith("["):
+        return list(json.loads(text))
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def synthetic_updates(count: int, first_user_id: int = 900_000_000) -> List[Dict[str, Any]]:
+    now = int(time.time())
+    updates = []
+    for index in range(count):
+        user_id = first_user_id + (index % 1000)
+        updates.append(
+            {
+                "update_id": index + 1,
+                "message": {
+                    "message_id": index + 1,
+                    "date": now,
+                    "chat": {"id": user_id, "type": "private", "first_name": f"load{user_id}"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": f"load{user_id}"},
+                    "text": "/start",
+                },
+            }
+        )
+    return updates
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round((pct / 100.0) * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def replay(url: str, updates: List[Dict[str, Any]], secret: str, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    queue = iter(updates)
+    headers = {SECRET_HEADER: secret} if secret else {}
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        for update in queue:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update, headers=headers) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError:
+                status = 0
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(max(concurrency, 1))))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "sent": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "rate_per_s": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "statuses": statuses,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50), 2),
+            "p95": round(_percentile(latencies, 95), 2),
+            "p99": round(_percentile(latencies, 99), 2),
+            "mean": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", type=Path, help="JSON / JSONL file with recorded updates")
+    source.add_argument("--synthetic", type=int, help="number of generated /start updates")
+    parser.add_argument("--url", default=f"http://{WEBHOOK_LISTEN_HOST}:{WEBHOOK_LISTEN_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=1, help="replay the input this many times")
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else synthetic_updates(args.synthetic)
+    updates = list(itertools.chain.from_iterable(itertools.repeat(updates, max(args.repeat, 1))))
+    result = asyncio.run(replay(args.url, updates, args.secret, args.concurrency))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
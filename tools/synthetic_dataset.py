@@ -0,0 +1,457 @@
+"""
+Build a synthetic bot database with a production-like shape.
+
+Usage:
+    python -m tools.synthetic_dataset --db /tmp/synthetic.db
+    python -m tools.synthetic_dataset --db /tmp/synthetic-10x.db --scale 10
+    python -m tools.synthetic_dataset --db /tmp/custom.db --users 20000 --orders-per-user 1.5 --usage-days 30
+
+The schema comes from ``services.db.create_tables``. Scale 1 is the size of the live database
+(about 1,500 users) and the per-user ratios below were measured on it: open orders, archived
+orders, receipts and conversion-offer logs per user, the mix of order and transaction
+statuses, the share of users with a Telegram username. Every active order also gets
+``--usage-days`` days of hourly usage history. Everything is derived from ``--seed``, so two
+runs with the same arguments produce the same rows.
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+JALALI_FORMAT = "%Y-%m-%d %H:%M"
+SCALE_USERS = 1500
+
+DEFAULT_SHAPE = {
+    "orders_per_user": 0.6,
+    "archive_per_user": 1.3,
+    "transactions_per_user": 1.8,
+    "offer_logs_per_user": 1.2,
+    "free_accounts_per_user": 2.2,
+    "feedbacks_per_user": 0.02,
+    "username_share": 0.78,
+}
+
+ORDER_STATUS_WEIGHTS = (
+    ("active", 0.83),
+    ("converted", 0.07),
+    ("renewed", 0.035),
+    ("expired", 0.02),
+    ("reserved", 0.017),
+    ("waiting_for_renewal", 0.017),
+    ("waiting_for_payment", 0.009),
+    ("waiting_for_renewal_not_paid", 0.002),
+)
+TRANSACTION_STATUS_WEIGHTS = (
+    ("approved", 0.86),
+    ("accounting_approved", 0.067),
+    ("rejected", 0.046),
+    ("draft", 0.012),
+    ("pending_admin", 0.01),
+    ("approved_pending_accounting", 0.005),
+)
+OFFER_LOG_STATUS_WEIGHTS = (
+    ("notified", 0.41),
+    ("viewed", 0.4),
+    ("selected", 0.09),
+    ("confirmed", 0.035),
+    ("converted", 0.035),
+    ("failed", 0.02),
+    ("cancelled", 0.01),
+)
+PLANS = (
+    # name, volume_gb, duration_months, price, group_name, category, visible, is_archived
+    ("یک ماهه 30 گیگ", 30, 1, 150000, "1-Month", "standard", 1, 0),
+    ("یک ماهه 50 گیگ", 50, 1, 220000, "1-Month", "standard", 1, 0),
+    ("یک ماهه نامحدود", 0, 1, 350000, "1-Month", "unlimited", 1, 0),
+    ("سه ماهه 100 گیگ", 100, 3, 520000, "3-Month", "standard", 1, 0),
+    ("سه ماهه 150 گیگ", 150, 3, 690000, "3-Month", "standard", 1, 0),
+    ("شش ماهه 300 گیگ", 300, 6, 1200000, "6-Month", "standard", 1, 0),
+    ("نماینده یک ماهه", 40, 1, 120000, "1-Month", "agent", 1, 0),
+    ("قدیمی یک ماهه 20 گیگ", 20, 1, 90000, "1-Month", "standard", 0, 1),
+    ("قدیمی سه ماهه 60 گیگ", 60, 3, 260000, "3-Month", "standard", 0, 1),
+)
+VOLUME_PACKAGES = (
+    # name, volume_gb, price, is_active, is_archived
+    ("10 گیگ", 10, 60000, 1, 0),
+    ("20 گیگ", 20, 110000, 1, 0),
+    ("50 گیگ", 50, 250000, 1, 0),
+    ("100 گیگ", 100, 450000, 1, 0),
+    ("5 گیگ ویژه", 5, 20000, 1, 0),
+    ("قدیمی 15 گیگ", 15, 70000, 0, 1),
+)
+SEGMENTS = ("vip", "agents", "old_limited", "students", "win_back")
+INSERT_BATCH = 5000
+
+
+def _pick(rng: random.Random, weights: Tuple[Tuple[str, float], ...]) -> str:
+    roll = rng.random()
+    for value, weight in weights:
+        roll -= weight
+        if roll < 0:
+            return value
+    return weights[-1][0]
+
+
+def _count(rng: random.Random, mean: float) -> int:
+    """Poisson draw, so per-user counts vary the way real ones do around ``mean``."""
+    limit, product, count = math.exp(-mean), rng.random(), 0
+    while product > limit:
+        product *= rng.random()
+        count += 1
+    return count
+
+
+def _jalali(dt: datetime) -> str:
+    import jdatetime
+
+    return jdatetime.datetime.fromgregorian(datetime=dt).strftime(JALALI_FORMAT)
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat(sep=" ", timespec="seconds")
+
+
+def _insert(cur: sqlite3.Cursor, sql: str, rows) -> None:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH:
+            cur.executemany(sql, batch)
+            batch = []
+    if batch:
+        cur.executemany(sql, batch)
+
+
+def _order_dates(rng: random.Random, now: datetime, status: str, months: int):
+    """created_at (ISO), starts_at and expires_at (Jalali) for an order in ``status``."""
+    length = timedelta(days=30 * months)
+    if status in ("reserved", "waiting_for_payment"):
+        return _iso(now - timedelta(hours=rng.randint(1, 72))), None, None
+    if status in ("active", "waiting_for_renewal", "waiting_for_renewal_not_paid"):
+        starts = now - timedelta(seconds=rng.randint(3600, int(length.total_seconds()) - 3600))
+    else:
+        starts = now - length - timedelta(days=rng.randint(1, 400))
+    expires = starts + length
+    if status in ("waiting_for_renewal", "waiting_for_renewal_not_paid"):
+        expires = now - timedelta(hours=rng.randint(1, 48))
+    return _iso(starts), _jalali(starts), _jalali(expires)
+
+
+def _seed_catalog(cur: sqlite3.Cursor) -> Tuple[List[Tuple[int, int, int]], List[int], List[int]]:
+    cur.executemany(
+        """
+        INSERT INTO plans (name, volume_gb, duration_months, price, group_name, category, visible, is_archived,
+                           max_users, is_unlimited, access_level)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+        """,
+        [
+            (name, volume, months, price, group, category, visible, archived,
+             1 if volume == 0 else 0, "agent" if category == "agent" else "all")
+            for name, volume, months, price, group, category, visible, archived in PLANS
+        ],
+    )
+    plans = cur.execute("SELECT id, volume_gb, duration_months FROM plans ORDER BY id").fetchall()
+
+    segment_ids = []
+    for slug in SEGMENTS:
+        cur.execute(
+            "INSERT INTO segments (slug, title, is_active) VALUES (?, ?, ?)",
+            (slug, f"سگمنت {slug}", 0 if slug == "win_back" else 1),
+        )
+        segment_ids.append(cur.lastrowid)
+    cur.execute("INSERT INTO plan_segments (plan_id, segment_id) VALUES (?, ?)", (plans[6][0], segment_ids[1]))
+
+    package_ids = []
+    for sort_order, (name, volume, price, active, archived) in enumerate(VOLUME_PACKAGES):
+        cur.execute(
+            "INSERT INTO volume_packages (name, volume_gb, price, sort_order, is_active, is_archived) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, volume, price, sort_order, active, archived),
+        )
+        package_ids.append(cur.lastrowid)
+    cur.execute("INSERT INTO volume_package_segments (package_id, segment_id) VALUES (?, ?)", (package_ids[4], segment_ids[0]))
+    cur.executemany(
+        "INSERT INTO volume_package_categories (package_id, category) VALUES (?, 'standard')",
+        [(package_ids[1],), (package_ids[2],)],
+    )
+
+    cur.executemany(
+        "INSERT INTO bank_cards (card_number, owner_name, bank_name, priority, is_active, show_in_receipt) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"60379911{index:08d}", f"صاحب کارت {index}", "ملی", index, 1 if index < 3 else 0, 1) for index in range(4)],
+    )
+    return plans, segment_ids, package_ids
+
+
+def _seed_users(cur: sqlite3.Cursor, rng: random.Random, now: datetime, users: int, shape: Dict,
+                segment_ids: List[int]) -> List[int]:
+    user_ids = []
+    rows = []
+    for index in range(users):
+        offline = rng.random() < 0.01
+        user_id = -(1000 + index) if offline else 100000000 + index * 37 + rng.randint(0, 36)
+        role = "offline" if offline else ("agent" if rng.random() < 0.02 else "user")
+        username = f"user_{index}_{rng.randint(100, 999)}" if rng.random() < shape["username_share"] else None
+        joined = now - timedelta(days=rng.randint(0, 900), seconds=rng.randint(0, 86400))
+        balance = rng.choice((0, 0, 0, 0, 10000, 50000, 150000, 500000))
+        rows.append((user_id, f"کاربر {index}", None, username, role, _iso(joined), balance))
+        user_ids.append(user_id)
+    _insert(
+        cur,
+        "INSERT INTO users (id, first_name, last_name, username, role, created_at, balance) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    _insert(
+        cur,
+        "INSERT INTO segment_users (segment_id, user_id) VALUES (?, ?)",
+        ((rng.choice(segment_ids), user_id) for user_id in user_ids if rng.random() < 0.1),
+    )
+    return user_ids
+
+
+def _seed_orders(cur: sqlite3.Cursor, rng: random.Random, now: datetime, user_ids: List[int],
+                 plans: List[Tuple[int, int, int]], shape: Dict) -> None:
+    # The archive holds the older orders, so it takes the low ids; moving a row keeps its id.
+    archive_rows = []
+    for user_id in user_ids:
+        for _ in range(_count(rng, shape["archive_per_user"])):
+            plan_id, volume_gb, months = rng.choice(plans)
+            created_at, starts_at, expires_at = _order_dates(rng, now, "expired", months)
+            archive_rows.append((
+                len(archive_rows) + 1, user_id, plan_id, f"pp{len(archive_rows) + 1:07d}", "archived", 100000,
+                created_at, starts_at, expires_at, volume_gb, int(volume_gb * 1024 * rng.random()),
+                _iso(now - timedelta(days=rng.randint(0, 300))),
+            ))
+    _insert(
+        cur,
+        """
+        INSERT INTO orders_archive (
+            id, user_id, plan_id, username, status, price, created_at, starts_at, expires_at, volume_gb,
+            usage_total_mb, archived_at
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        archive_rows,
+    )
+
+    order_id = len(archive_rows)
+    order_rows = []
+    for user_id in user_ids:
+        for _ in range(_count(rng, shape["orders_per_user"])):
+            plan_id, volume_gb, months = rng.choice(plans[:7])
+            status = _pick(rng, ORDER_STATUS_WEIGHTS)
+            created_at, starts_at, expires_at = _order_dates(rng, now, status, months)
+            order_id += 1
+            usage_mb = int(volume_gb * 1024 * rng.random() * 1.1) if starts_at else 0
+            next_refresh = _jalali(now + timedelta(minutes=rng.randint(-30, 360))) if status == "active" else None
+            order_rows.append((
+                order_id, user_id, plan_id, f"pp{order_id:07d}", status, 100000, created_at, starts_at, expires_at,
+                volume_gb, usage_mb, rng.choice((0, 0, 1, 2)), next_refresh, 1 if rng.random() < 0.1 else 0,
+                created_at if starts_at else None,
+            ))
+    _insert(
+        cur,
+        """
+        INSERT INTO orders (
+            id, user_id, plan_id, username, status, price, created_at, starts_at, expires_at, volume_gb,
+            usage_total_mb, last_notif_level, next_usage_refresh_at, auto_renew, usage_last_update
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        order_rows,
+    )
+
+
+def _seed_accounts(cur: sqlite3.Cursor, users: int, shape: Dict) -> None:
+    _insert(
+        cur,
+        "INSERT INTO accounts (username, password, status) VALUES (?, ?, 'free')",
+        ((f"free{index:07d}", f"pw{index:07d}") for index in range(max(int(users * shape["free_accounts_per_user"]), 10))),
+    )
+    cur.execute("""
+        INSERT INTO accounts (username, password, status, order_id)
+        SELECT username, 'pw-' || id, 'assigned', id
+        FROM orders
+        WHERE status IN ('active', 'waiting_for_renewal', 'waiting_for_renewal_not_paid')
+    """)
+
+
+def _seed_transactions(cur: sqlite3.Cursor, rng: random.Random, now: datetime, user_ids: List[int], shape: Dict) -> None:
+    rows = []
+    ledger = []
+    for user_id in user_ids:
+        if user_id < 0:
+            continue
+        for _ in range(_count(rng, shape["transactions_per_user"])):
+            status = _pick(rng, TRANSACTION_STATUS_WEIGHTS)
+            created = now - timedelta(days=rng.randint(0, 600), seconds=rng.randint(0, 86400))
+            amount = rng.choice((100000, 150000, 220000, 350000, 520000))
+            photo = f"{rng.getrandbits(64):016x}"
+            rows.append((
+                user_id, 0 if status == "draft" else amount, amount, status, _iso(created),
+                None if status == "draft" else _jalali(created),
+                f"photo-{photo}", f"media/receipts/{photo}.jpg", photo,
+            ))
+            if status in ("approved", "accounting_approved", "approved_pending_accounting"):
+                ledger.append((user_id, amount, "deposit", "transaction", _iso(created)))
+    _insert(
+        cur,
+        """
+        INSERT INTO transactions (
+            user_id, amount, amount_claimed, status, created_at, submitted_at, photo_id, photo_path, photo_hash
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    # ref_id is left empty: the ledger is here for its size, nothing joins it back to a receipt.
+    _insert(
+        cur,
+        """
+        INSERT INTO wallet_ledger (user_id, amount, balance_after, kind, ref_type, created_at)
+        VALUES (?, ?, 0, ?, ?, ?)
+        """,
+        ledger,
+    )
+
+
+def _seed_service_history(cur: sqlite3.Cursor, rng: random.Random, now: datetime, users: int,
+                          package_ids: List[int], shape: Dict, usage_days: int) -> None:
+    from services.usage_history import DAY_FORMAT, _pack
+
+    active = cur.execute("""
+        SELECT id, user_id, plan_id, price, usage_total_mb
+        FROM orders
+        WHERE status = 'active'
+        ORDER BY id
+    """).fetchall()
+    if not active:
+        return
+    now_text = _iso(now)
+
+    _insert(
+        cur,
+        """
+        INSERT INTO wallet_ledger (user_id, amount, balance_after, kind, ref_type, ref_id, created_at)
+        VALUES (?, ?, 0, 'order_payment', 'order', ?, ?)
+        """,
+        ((user_id, -price, order_id, now_text) for order_id, user_id, _, price, _ in active),
+    )
+    _insert(
+        cur,
+        """
+        INSERT INTO conversion_offer_logs (user_id, service_id, previous_plan_id, status, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (service[1], service[0], service[2], _pick(rng, OFFER_LOG_STATUS_WEIGHTS), now_text, now_text)
+            for service in (rng.choice(active) for _ in range(int(users * shape["offer_logs_per_user"])))
+        ),
+    )
+    _insert(
+        cur,
+        """
+        INSERT INTO order_volume_allocations (order_id, user_id, package_id, source_type, volume_gb, price, applied_at)
+        VALUES (?, ?, ?, 'user_package', ?, ?, ?)
+        """,
+        (
+            (order_id, user_id, rng.choice(package_ids), 20, 110000, now_text)
+            for order_id, user_id, _, _, _ in active if rng.random() < 0.08
+        ),
+    )
+
+    def usage_rows():
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for order_id, _, _, _, usage_total_mb in active:
+            total = max(int(usage_total_mb or 0) - usage_days * 24 * 20, 0)
+            for day_offset in range(usage_days, 0, -1):
+                base = total
+                pairs = []
+                for hour in range(24):
+                    delta = rng.choice((0, 0, 5, 10, 20, 40, 80))
+                    pairs.append((hour * 60, delta))
+                    total += delta
+                day = (today - timedelta(days=day_offset - 1)).strftime(DAY_FORMAT)
+                yield order_id, day, 60, base, total, total - base, len(pairs), _pack(pairs)
+
+    _insert(
+        cur,
+        """
+        INSERT INTO usage_history (
+            order_id, day, resolution_minutes, base_total_mb, last_total_mb, used_mb, sample_count, samples
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        usage_rows(),
+    )
+
+
+def build_dataset(db_path: str, users: int = SCALE_USERS, seed: int = 7, shape: Optional[Dict] = None,
+                  usage_days: int = 7) -> Dict[str, int]:
+    """Create the schema in ``db_path`` (which must not exist) and fill it; returns row counts."""
+    if os.path.exists(db_path):
+        raise FileExistsError(db_path)
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("BOT_TOKEN", "0:synthetic")
+    shape = {**DEFAULT_SHAPE, **(shape or {})}
+
+    from services.db import create_tables
+
+    create_tables()
+    rng = random.Random(seed)
+    now = datetime.now()
+
+    with sqlite3.connect(db_path) as conn:
+        cur = conn.cursor()
+        plans, segment_ids, package_ids = _seed_catalog(cur)
+        user_ids = _seed_users(cur, rng, now, users, shape, segment_ids)
+        _seed_orders(cur, rng, now, user_ids, plans, shape)
+        _seed_accounts(cur, users, shape)
+        _seed_transactions(cur, rng, now, user_ids, shape)
+        _seed_service_history(cur, rng, now, users, package_ids, shape, usage_days)
+        cur.executemany(
+            "INSERT INTO feedbacks (user_id, type, message, created_at) VALUES (?, ?, ?, ?)",
+            [
+                (rng.choice(user_ids), rng.choice(("suggestion", "complaint", "bug")), "پیام آزمایشی", _iso(now))
+                for _ in range(int(users * shape["feedbacks_per_user"]))
+            ],
+        )
+        conn.commit()
+        conn.execute("ANALYZE")
+
+    with sqlite3.connect(db_path) as conn:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("users", "orders", "orders_archive", "transactions", "wallet_ledger", "segment_users",
+                          "conversion_offer_logs", "order_volume_allocations", "usage_history", "accounts")
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build a synthetic bot database.")
+    parser.add_argument("--db", required=True, help="path of the new database file")
+    parser.add_argument("--scale", type=float, default=1.0, help=f"multiple of the live size ({SCALE_USERS} users)")
+    parser.add_argument("--users", type=int, help="exact user count (overrides --scale)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--usage-days", type=int, default=7, help="days of usage history per active order")
+    for key, value in DEFAULT_SHAPE.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=float, default=value, dest=key)
+    args = parser.parse_args()
+
+    users = args.users or max(int(SCALE_USERS * args.scale), 1)
+    started = time.perf_counter()
+    counts = build_dataset(
+        args.db, users=users, seed=args.seed, usage_days=args.usage_days,
+        shape={key: getattr(args, key) for key in DEFAULT_SHAPE},
+    )
+    print(f"built {args.db} in {time.perf_counter() - started:.1f}s: "
+          + ", ".join(f"{table}={count}" for table, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()